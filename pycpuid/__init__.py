@@ -5,13 +5,16 @@
 # http://www.flightdataservices.com
 # See the file "LICENSE" for the full license governing this code.
 
+import sys
+
 # Ensure PyCPUID 0.3 and later has the same namespace as previous version while
 # allowing setup.py and Sphinx to get at the meta data prior to the C extension
 # being built.
 try:
     from pycpuid import *
+    from pycpuid import _LazyModule
 except ImportError:
-    pass
+    _LazyModule = None
 
 __packagename__ = 'PyCPUID'
 __version__ = '0.5'
@@ -27,8 +30,6 @@ __classifiers__ = [
     'Environment :: Console',
     'Intended Audience :: Developers',
     'License :: OSI Approved :: GNU Library or Lesser General Public License (LGPL)',
-    'Programming Language :: Python :: 2.5',
-    'Programming Language :: Python :: 2.6',
     'Programming Language :: Python :: 2.7',
     'Programming Language :: Python :: Implementation :: CPython',
     'Operating System :: OS Independent',
@@ -38,5 +39,10 @@ __platforms__ = ['OS Independent']
 __license__ = 'GNU Library or Lesser General Public License (LGPL)'
 __keywords__ = ['cpuid']
 
+# The feature flags are resolved on first access so that importing the package
+# never executes CPUID.
+if _LazyModule is not None:
+    sys.modules[__name__] = _LazyModule(sys.modules[__name__])
+
 ################################################################################
 # vim:et:ft=python:nowrap:sts=4:sw=4:ts=4
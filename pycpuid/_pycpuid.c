@@ -6,23 +6,33 @@ See the file "LICENSE" for the full license governing this code.
 */
 
 #include <Python.h>
+#include <frameobject.h>
 
 #ifdef _MSC_VER
 #	include <intrin.h>
 #endif
 
+#ifdef __linux__
+#	include <errno.h>
+#	include <sched.h>
+#	include <sys/syscall.h>
+#	include <unistd.h>
+#endif
 
+#define ARCH_GET_XCOMP_PERM 0x1022
+#define ARCH_REQ_XCOMP_PERM 0x1023
 
-static PyObject* _pycpuid_cpuid(PyObject* module, PyObject* args)
+
+
+/* Number of CPUID instructions executed, only updated while holding the GIL. */
+static unsigned long long _pycpuid_executed = 0;
+
+
+
+static void _pycpuid_exec(unsigned infotype, unsigned subleaf, unsigned cpuinfo[4])
 {
-	unsigned cpuinfo[4] = { 0 };
-	unsigned infotype;
-	if (!PyArg_ParseTuple(args, "I:cpuid", &infotype))
-	{
-		return 0;
-	}
 #ifdef _MSC_VER
-	__cpuid(cpuinfo, infotype);
+	__cpuidex((int*)cpuinfo, infotype, subleaf);
 #else
     // cpuid and PIC mode don't play nice. Push ebx before use!
     // see http://www.technovelty.org/code/arch/pic-cas.html
@@ -33,7 +43,7 @@ static PyObject* _pycpuid_cpuid(PyObject* module, PyObject* args)
 	__asm__ __volatile__(
 		"cpuid;"
 		: "=a"(cpuinfo[0]), "=b"(cpuinfo[1]), "=c"(cpuinfo[2]), "=d"(cpuinfo[3])
-		: "a"(infotype));
+		: "0"(infotype), "2"(subleaf));
 #   else
 	__asm__ __volatile__(
 		"pushl %%ebx;"
@@ -41,17 +51,909 @@ static PyObject* _pycpuid_cpuid(PyObject* module, PyObject* args)
 		"movl %%ebx,%1;"
 		"pop %%ebx;"
 		: "=a"(cpuinfo[0]), "=m"(cpuinfo[1]), "=c"(cpuinfo[2]), "=d"(cpuinfo[3])
-		: "a"(infotype));		
+		: "0"(infotype), "2"(subleaf));
 #	endif
 #endif
+}
+
+
+
+static unsigned long long _pycpuid_rdtsc(void)
+{
+#ifdef _MSC_VER
+	return __rdtsc();
+#else
+	unsigned lo, hi;
+	__asm__ __volatile__("rdtsc;" : "=a"(lo), "=d"(hi));
+	return ((unsigned long long)hi << 32) | lo;
+#endif
+}
+
+
+
+static unsigned long long _pycpuid_rdtscp(unsigned* aux)
+{
+#ifdef _MSC_VER
+	return __rdtscp(aux);
+#else
+	unsigned lo, hi;
+	/* Encoded by hand for assemblers predating the mnemonic. */
+	__asm__ __volatile__(".byte 0x0f, 0x01, 0xf9;" : "=a"(lo), "=d"(hi), "=c"(*aux));
+	return ((unsigned long long)hi << 32) | lo;
+#endif
+}
+
+
+
+/* Opt-in statistics, only touched while holding the GIL: executions by
+   (leaf, subleaf), a histogram of their latency in TSC ticks by power of two,
+   and optionally executions by the calling line of Python outside pycpuid. */
+#define _PYCPUID_BUCKETS 64
+static int _pycpuid_tracing = 0;
+static int _pycpuid_tracing_frames = 0;
+static PyObject* _pycpuid_counts = 0;
+static PyObject* _pycpuid_callers = 0;
+static unsigned long long _pycpuid_histogram[_PYCPUID_BUCKETS];
+
+
+
+/* Adds n to the count of key in dict, stealing the reference to key. */
+static int _pycpuid_increment(PyObject* dict, PyObject* key, Py_ssize_t n)
+{
+	PyObject* count;
+	Py_ssize_t value = 0;
+	int result = -1;
+	if (!key)
+	{
+		return -1;
+	}
+	count = PyDict_GetItem(dict, key);
+	if (count)
+	{
+		value = PyInt_AsSsize_t(count);
+		if (value == -1 && PyErr_Occurred())
+		{
+			Py_DECREF(key);
+			return -1;
+		}
+	}
+	count = PyInt_FromSsize_t(value + n);
+	if (count)
+	{
+		result = PyDict_SetItem(dict, key, count);
+		Py_DECREF(count);
+	}
+	Py_DECREF(key);
+	return result;
+}
+
+
+
+/* Returns (filename, line, function) of the innermost frame outside pycpuid. */
+static PyObject* _pycpuid_caller(void)
+{
+	PyFrameObject* frame;
+	for (frame = PyEval_GetFrame(); frame; frame = frame->f_back)
+	{
+		PyObject* name = PyDict_GetItemString(frame->f_globals, "__name__");
+		const char* text = name && PyString_Check(name) ? PyString_AS_STRING(name) : "";
+		if (strncmp(text, "pycpuid", 7) != 0 || (text[7] != '\0' && text[7] != '.'))
+		{
+			break;
+		}
+	}
+	if (!frame)
+	{
+		return Py_BuildValue("(sis)", "<unknown>", 0, "<unknown>");
+	}
+	return Py_BuildValue("(OiO)", frame->f_code->co_filename, PyFrame_GetLineNumber(frame), frame->f_code->co_name);
+}
+
+
+
+static int _pycpuid_record(unsigned infotype, unsigned subleaf, unsigned long long ticks)
+{
+	int bucket = 0;
+	while (ticks >>= 1)
+	{
+		++bucket;
+	}
+	++_pycpuid_histogram[bucket];
+	return _pycpuid_increment(_pycpuid_counts, Py_BuildValue("(II)", infotype, subleaf), 1);
+}
+
+
+
+/* Executes a leaf while holding the GIL, recording it when enabled. */
+static int _pycpuid_exec_counted(unsigned infotype, unsigned subleaf, unsigned cpuinfo[4])
+{
+	unsigned long long start;
+	++_pycpuid_executed;
+	if (!_pycpuid_tracing)
+	{
+		_pycpuid_exec(infotype, subleaf, cpuinfo);
+		return 0;
+	}
+	start = _pycpuid_rdtsc();
+	_pycpuid_exec(infotype, subleaf, cpuinfo);
+	if (_pycpuid_record(infotype, subleaf, _pycpuid_rdtsc() - start) < 0)
+	{
+		return -1;
+	}
+	return _pycpuid_tracing_frames ? _pycpuid_increment(_pycpuid_callers, _pycpuid_caller(), 1) : 0;
+}
+
+
+
+/* Executes a batch of requests, possibly without the GIL, timing each one
+   into ticks when given so they can be recorded once it is reacquired. */
+static void _pycpuid_exec_many(const unsigned* pairs, Py_ssize_t count, unsigned* cpuinfo, unsigned long long* ticks)
+{
+	Py_ssize_t i;
+	for (i = 0; i < count; ++i)
+	{
+		if (ticks)
+		{
+			unsigned long long start = _pycpuid_rdtsc();
+			_pycpuid_exec(pairs[2 * i], pairs[2 * i + 1], cpuinfo + 4 * i);
+			ticks[i] = _pycpuid_rdtsc() - start;
+		}
+		else
+		{
+			_pycpuid_exec(pairs[2 * i], pairs[2 * i + 1], cpuinfo + 4 * i);
+		}
+	}
+}
+
+
+
+static PyObject* _pycpuid_cpuid(PyObject* module, PyObject* args)
+{
+	unsigned cpuinfo[4] = { 0 };
+	unsigned infotype, subleaf = 0;
+	if (!PyArg_ParseTuple(args, "I|I:cpuid", &infotype, &subleaf))
+	{
+		return 0;
+	}
+	if (_pycpuid_exec_counted(infotype, subleaf, cpuinfo) < 0)
+	{
+		return 0;
+	}
 	return Py_BuildValue("IIII", cpuinfo[0], cpuinfo[1], cpuinfo[2], cpuinfo[3]);
 }
 
 
 
+/* Reads (leaf, subleaf) pairs either from a buffer of unsigned 32-bit words or
+   from a sequence whose items are pairs or plain leaves. Returns a newly
+   allocated array of 2 * count words which must be released with PyMem_Free.
+*/
+static unsigned* _pycpuid_requests(PyObject* requests, Py_ssize_t* count)
+{
+	unsigned* pairs;
+	Py_ssize_t i;
+	PyObject* seq;
+
+	if (!PyList_Check(requests) && !PyTuple_Check(requests) && PyObject_CheckReadBuffer(requests))
+	{
+		const void* buffer;
+		Py_ssize_t size;
+		if (PyObject_AsReadBuffer(requests, &buffer, &size) < 0)
+		{
+			return 0;
+		}
+		if (size % (2 * sizeof(unsigned)))
+		{
+			PyErr_SetString(PyExc_ValueError, "request buffer must hold (leaf, subleaf) pairs of 32-bit words");
+			return 0;
+		}
+		*count = size / (2 * sizeof(unsigned));
+		pairs = (unsigned*)PyMem_Malloc(size ? size : 1);
+		if (!pairs)
+		{
+			PyErr_NoMemory();
+			return 0;
+		}
+		memcpy(pairs, buffer, size);
+		return pairs;
+	}
+
+	seq = PySequence_Fast(requests, "requests must be a sequence or buffer of (leaf, subleaf) pairs");
+	if (!seq)
+	{
+		return 0;
+	}
+	*count = PySequence_Fast_GET_SIZE(seq);
+	pairs = (unsigned*)PyMem_Malloc(2 * sizeof(unsigned) * (*count ? *count : 1));
+	if (!pairs)
+	{
+		Py_DECREF(seq);
+		PyErr_NoMemory();
+		return 0;
+	}
+	for (i = 0; i < *count; ++i)
+	{
+		PyObject* item = PySequence_Fast_GET_ITEM(seq, i);
+		unsigned leaf, subleaf = 0;
+		if (PyTuple_Check(item))
+		{
+			if (!PyArg_ParseTuple(item, "I|I:cpuid_many", &leaf, &subleaf))
+			{
+				goto error;
+			}
+		}
+		else
+		{
+			leaf = (unsigned)PyInt_AsUnsignedLongMask(item);
+			if (PyErr_Occurred())
+			{
+				goto error;
+			}
+		}
+		pairs[2 * i] = leaf;
+		pairs[2 * i + 1] = subleaf;
+	}
+	Py_DECREF(seq);
+	return pairs;
+
+error:
+	Py_DECREF(seq);
+	PyMem_Free(pairs);
+	return 0;
+}
+
+
+
+#ifdef __linux__
+/* Returns the affinity mask of the calling thread, growing the mask until the
+   kernel accepts its size. The mask must be released with CPU_FREE.
+*/
+static cpu_set_t* _pycpuid_getmask(int* ncpus)
+{
+	for (*ncpus = 1024; *ncpus <= (1 << 20); *ncpus *= 2)
+	{
+		cpu_set_t* mask = CPU_ALLOC(*ncpus);
+		if (!mask)
+		{
+			errno = ENOMEM;
+			return 0;
+		}
+		if (sched_getaffinity(0, CPU_ALLOC_SIZE(*ncpus), mask) == 0)
+		{
+			return mask;
+		}
+		CPU_FREE(mask);
+		if (errno != EINVAL)
+		{
+			return 0;
+		}
+	}
+	return 0;
+}
+
+
+
+/* Pins the calling thread to a single processor, storing the previous mask in
+   *saved so that it can be restored. Safe to call without holding the GIL.
+*/
+static int _pycpuid_pin(int cpu, cpu_set_t** saved, int* ncpus)
+{
+	cpu_set_t* mask;
+	int size = cpu + 1 > *ncpus ? cpu + 1 : *ncpus;
+	int result;
+
+	*saved = _pycpuid_getmask(ncpus);
+	if (!*saved)
+	{
+		return -1;
+	}
+	mask = CPU_ALLOC(size);
+	if (!mask)
+	{
+		CPU_FREE(*saved);
+		errno = ENOMEM;
+		return -1;
+	}
+	CPU_ZERO_S(CPU_ALLOC_SIZE(size), mask);
+	CPU_SET_S(cpu, CPU_ALLOC_SIZE(size), mask);
+	result = sched_setaffinity(0, CPU_ALLOC_SIZE(size), mask);
+	CPU_FREE(mask);
+	if (result < 0)
+	{
+		CPU_FREE(*saved);
+	}
+	return result;
+}
+
+
+
+static void _pycpuid_unpin(cpu_set_t* saved, int ncpus)
+{
+	sched_setaffinity(0, CPU_ALLOC_SIZE(ncpus), saved);
+	CPU_FREE(saved);
+}
+#endif
+
+
+
+static PyObject* _pycpuid_cpuid_many(PyObject* module, PyObject* args, PyObject* kwargs)
+{
+	static char* kwlist[] = { "requests", "out", "cpu", 0 };
+	PyObject* requests;
+	PyObject* out = 0;
+	unsigned* pairs;
+	unsigned* cpuinfo;
+	unsigned long long* ticks = 0;
+	void* buffer = 0;
+	Py_ssize_t count, size, i;
+	int cpu = -1;
+	int error = 0;
+
+	if (!PyArg_ParseTupleAndKeywords(args, kwargs, "O|Oi:cpuid_many", kwlist, &requests, &out, &cpu))
+	{
+		return 0;
+	}
+#ifndef __linux__
+	if (cpu >= 0)
+	{
+		PyErr_SetString(PyExc_NotImplementedError, "pinning to a processor is only supported on Linux");
+		return 0;
+	}
+#endif
+	pairs = _pycpuid_requests(requests, &count);
+	if (!pairs)
+	{
+		return 0;
+	}
+	if (_pycpuid_tracing)
+	{
+		ticks = (unsigned long long*)PyMem_Malloc(count * sizeof(unsigned long long) + 1);
+		if (!ticks)
+		{
+			PyMem_Free(pairs);
+			return PyErr_NoMemory();
+		}
+	}
+
+	if (out && out != Py_None)
+	{
+		if (PyObject_AsWriteBuffer(out, &buffer, &size) < 0)
+		{
+			PyMem_Free(pairs);
+			PyMem_Free(ticks);
+			return 0;
+		}
+		if (size < count * 4 * (Py_ssize_t)sizeof(unsigned))
+		{
+			PyMem_Free(pairs);
+			PyMem_Free(ticks);
+			PyErr_SetString(PyExc_ValueError, "output buffer is too small");
+			return 0;
+		}
+		/* The caller's buffer may be resized by another thread once the GIL
+		   is released, so execute into scratch space and copy afterwards. */
+		cpuinfo = (unsigned*)PyMem_Malloc(count * 4 * sizeof(unsigned) + 1);
+		if (!cpuinfo)
+		{
+			PyMem_Free(pairs);
+			PyMem_Free(ticks);
+			return PyErr_NoMemory();
+		}
+		Py_INCREF(out);
+	}
+	else
+	{
+		out = PyByteArray_FromStringAndSize(0, count * 4 * sizeof(unsigned));
+		if (!out)
+		{
+			PyMem_Free(pairs);
+			PyMem_Free(ticks);
+			return 0;
+		}
+		cpuinfo = (unsigned*)PyByteArray_AS_STRING(out);
+	}
+
+	Py_BEGIN_ALLOW_THREADS
+#ifdef __linux__
+	{
+		cpu_set_t* saved = 0;
+		int ncpus = 0;
+		if (cpu >= 0 && _pycpuid_pin(cpu, &saved, &ncpus) < 0)
+		{
+			error = errno;
+		}
+		else
+		{
+			_pycpuid_exec_many(pairs, count, cpuinfo, ticks);
+			if (cpu >= 0)
+			{
+				_pycpuid_unpin(saved, ncpus);
+			}
+		}
+	}
+#else
+	_pycpuid_exec_many(pairs, count, cpuinfo, ticks);
+#endif
+	Py_END_ALLOW_THREADS
+
+	if (!error)
+	{
+		_pycpuid_executed += count;
+		if (ticks)
+		{
+			for (i = 0; i < count && !error; ++i)
+			{
+				error = _pycpuid_record(pairs[2 * i], pairs[2 * i + 1], ticks[i]);
+			}
+			if (!error && _pycpuid_tracing_frames)
+			{
+				error = _pycpuid_increment(_pycpuid_callers, _pycpuid_caller(), count);
+			}
+		}
+	}
+	PyMem_Free(pairs);
+	PyMem_Free(ticks);
+	if (buffer)
+	{
+		if (!error)
+		{
+			/* Fetch the pointer again in case the buffer moved. */
+			if (PyObject_AsWriteBuffer(out, &buffer, &size) < 0)
+			{
+				error = -1;
+			}
+			else if (size < count * 4 * (Py_ssize_t)sizeof(unsigned))
+			{
+				PyErr_SetString(PyExc_ValueError, "output buffer is too small");
+				error = -1;
+			}
+			else
+			{
+				memcpy(buffer, cpuinfo, count * 4 * sizeof(unsigned));
+			}
+		}
+		PyMem_Free(cpuinfo);
+	}
+	if (error)
+	{
+		Py_DECREF(out);
+		if (error > 0)
+		{
+			errno = error;
+			PyErr_SetFromErrno(PyExc_OSError);
+		}
+		return 0;
+	}
+	return out;
+}
+
+
+
+static PyObject* _pycpuid_xgetbv(PyObject* module, PyObject* args)
+{
+	unsigned cpuinfo[4] = { 0 };
+	unsigned xcr, eax, edx;
+	if (!PyArg_ParseTuple(args, "I:xgetbv", &xcr))
+	{
+		return 0;
+	}
+
+	/* XGETBV faults unless the OS has enabled it, and XCR1 also needs the
+	   processor to support reading it, so check before executing it. */
+	if (_pycpuid_exec_counted(1, 0, cpuinfo) < 0)
+	{
+		return 0;
+	}
+	if (!(cpuinfo[2] & (1 << 27)))
+	{
+		PyErr_SetString(PyExc_ValueError, "XGETBV is not enabled by the OS");
+		return 0;
+	}
+	if (xcr == 1)
+	{
+		if (_pycpuid_exec_counted(0, 0, cpuinfo) < 0)
+		{
+			return 0;
+		}
+		if (cpuinfo[0] < 0xd)
+		{
+			xcr = ~0u;
+		}
+		else
+		{
+			if (_pycpuid_exec_counted(0xd, 1, cpuinfo) < 0)
+			{
+				return 0;
+			}
+			xcr = cpuinfo[0] & (1 << 2) ? 1 : ~0u;
+		}
+	}
+	if (xcr > 1)
+	{
+		PyErr_SetString(PyExc_ValueError, "the XCR cannot be read on this processor");
+		return 0;
+	}
+
+#ifdef _MSC_VER
+	{
+		unsigned __int64 value = _xgetbv(xcr);
+		eax = (unsigned)value;
+		edx = (unsigned)(value >> 32);
+	}
+#else
+	/* Encoded by hand for assemblers predating the mnemonic. */
+	__asm__ __volatile__(
+		".byte 0x0f, 0x01, 0xd0;"
+		: "=a"(eax), "=d"(edx)
+		: "c"(xcr));
+#endif
+	return PyLong_FromUnsignedLongLong(((unsigned long long)edx << 32) | eax);
+}
+
+
+
+static PyObject* _pycpuid_xcomp_perm(PyObject* module, PyObject* args)
+{
+#if defined(__linux__) && defined(SYS_arch_prctl)
+	unsigned long long permitted = 0;
+	if (syscall(SYS_arch_prctl, ARCH_GET_XCOMP_PERM, &permitted) < 0)
+	{
+		return PyErr_SetFromErrno(PyExc_OSError);
+	}
+	return PyLong_FromUnsignedLongLong(permitted);
+#else
+	PyErr_SetString(PyExc_NotImplementedError, "extended state permissions are only managed on Linux");
+	return 0;
+#endif
+}
+
+
+
+static PyObject* _pycpuid_request_xcomp_perm(PyObject* module, PyObject* args)
+{
+#if defined(__linux__) && defined(SYS_arch_prctl)
+	unsigned xfeature;
+	if (!PyArg_ParseTuple(args, "I:request_xcomp_perm", &xfeature))
+	{
+		return 0;
+	}
+	if (syscall(SYS_arch_prctl, ARCH_REQ_XCOMP_PERM, (unsigned long)xfeature) < 0)
+	{
+		return PyErr_SetFromErrno(PyExc_OSError);
+	}
+	return _pycpuid_xcomp_perm(module, 0);
+#else
+	PyErr_SetString(PyExc_NotImplementedError, "extended state permissions are only managed on Linux");
+	return 0;
+#endif
+}
+
+
+
+static PyObject* _pycpuid_rdtsc_py(PyObject* module, PyObject* args)
+{
+	return PyLong_FromUnsignedLongLong(_pycpuid_rdtsc());
+}
+
+
+
+/* Whether RDTSCP is supported: -1 until checked, as it faults otherwise. */
+static int _pycpuid_has_rdtscp = -1;
+
+static PyObject* _pycpuid_rdtscp_py(PyObject* module, PyObject* args)
+{
+	unsigned long long tsc;
+	unsigned aux = 0;
+	if (_pycpuid_has_rdtscp < 0)
+	{
+		unsigned cpuinfo[4] = { 0 };
+		if (_pycpuid_exec_counted(0x80000000, 0, cpuinfo) < 0)
+		{
+			return 0;
+		}
+		_pycpuid_has_rdtscp = 0;
+		if (cpuinfo[0] >= 0x80000001)
+		{
+			if (_pycpuid_exec_counted(0x80000001, 0, cpuinfo) < 0)
+			{
+				return 0;
+			}
+			_pycpuid_has_rdtscp = (cpuinfo[3] >> 27) & 1;
+		}
+	}
+	if (!_pycpuid_has_rdtscp)
+	{
+		PyErr_SetString(PyExc_ValueError, "RDTSCP is not supported on this processor");
+		return 0;
+	}
+	tsc = _pycpuid_rdtscp(&aux);
+	return Py_BuildValue("KI", tsc, aux);
+}
+
+
+
+static PyObject* _pycpuid_rdtsc_fill(PyObject* module, PyObject* args)
+{
+	PyObject* out;
+	void* buffer;
+	unsigned long long* ticks;
+	Py_ssize_t size, count, i;
+	if (!PyArg_ParseTuple(args, "O:rdtsc_fill", &out))
+	{
+		return 0;
+	}
+	if (PyObject_AsWriteBuffer(out, &buffer, &size) < 0)
+	{
+		return 0;
+	}
+	if (size % sizeof(unsigned long long))
+	{
+		PyErr_SetString(PyExc_ValueError, "buffer must hold unsigned 64-bit words");
+		return 0;
+	}
+	/* Keep the GIL so the buffer cannot be resized while being filled; the
+	   loop is only as long as the buffer. */
+	ticks = (unsigned long long*)buffer;
+	count = size / sizeof(unsigned long long);
+	for (i = 0; i < count; ++i)
+	{
+		ticks[i] = _pycpuid_rdtsc();
+	}
+	return PyInt_FromSsize_t(count);
+}
+
+
+
+static PyObject* _pycpuid_address(PyObject* module, PyObject* args)
+{
+	Py_buffer view;
+	PyObject* result;
+	if (!PyArg_ParseTuple(args, "s*:address", &view))
+	{
+		return 0;
+	}
+	result = PyLong_FromVoidPtr(view.buf);
+	PyBuffer_Release(&view);
+	return result;
+}
+
+
+
+static PyObject* _pycpuid_increment_slot(PyObject* module, PyObject* args)
+{
+	Py_buffer view;
+	Py_ssize_t offset;
+	unsigned long long count, i;
+	volatile unsigned long long* slot;
+	if (!PyArg_ParseTuple(args, "w*nK:increment_slot", &view, &offset, &count))
+	{
+		return 0;
+	}
+	if (offset < 0 || offset % sizeof(unsigned long long) ||
+		offset + (Py_ssize_t)sizeof(unsigned long long) > view.len)
+	{
+		PyBuffer_Release(&view);
+		PyErr_SetString(PyExc_ValueError, "offset must address a 64-bit word of the buffer");
+		return 0;
+	}
+	/* The buffer stays exported until released, so it cannot move while the
+	   GIL is released. Every increment loads and stores the word, so threads
+	   incrementing words on one cache line contend for it. */
+	slot = (volatile unsigned long long*)((char*)view.buf + offset);
+	Py_BEGIN_ALLOW_THREADS
+	for (i = 0; i < count; ++i)
+	{
+		*slot += 1;
+	}
+	Py_END_ALLOW_THREADS
+	PyBuffer_Release(&view);
+	Py_RETURN_NONE;
+}
+
+
+
+static PyObject* _pycpuid_setaffinity(PyObject* module, PyObject* args)
+{
+#ifdef __linux__
+	PyObject* cpus;
+	PyObject* seq;
+	cpu_set_t* mask;
+	Py_ssize_t count, i;
+	int tid = 0, size = 1, result;
+
+	if (!PyArg_ParseTuple(args, "O|i:setaffinity", &cpus, &tid))
+	{
+		return 0;
+	}
+	seq = PySequence_Fast(cpus, "cpus must be a sequence of processor numbers");
+	if (!seq)
+	{
+		return 0;
+	}
+	count = PySequence_Fast_GET_SIZE(seq);
+	for (i = 0; i < count; ++i)
+	{
+		long cpu = PyInt_AsLong(PySequence_Fast_GET_ITEM(seq, i));
+		if (cpu == -1 && PyErr_Occurred())
+		{
+			Py_DECREF(seq);
+			return 0;
+		}
+		if (cpu < 0 || cpu >= 65536)
+		{
+			Py_DECREF(seq);
+			PyErr_SetString(PyExc_ValueError, "processor number out of range");
+			return 0;
+		}
+		if (cpu + 1 > size)
+		{
+			size = (int)cpu + 1;
+		}
+	}
+	mask = CPU_ALLOC(size);
+	if (!mask)
+	{
+		Py_DECREF(seq);
+		return PyErr_NoMemory();
+	}
+	CPU_ZERO_S(CPU_ALLOC_SIZE(size), mask);
+	for (i = 0; i < count; ++i)
+	{
+		CPU_SET_S(PyInt_AsLong(PySequence_Fast_GET_ITEM(seq, i)), CPU_ALLOC_SIZE(size), mask);
+	}
+	Py_DECREF(seq);
+	result = sched_setaffinity(tid, CPU_ALLOC_SIZE(size), mask);
+	CPU_FREE(mask);
+	if (result < 0)
+	{
+		return PyErr_SetFromErrno(PyExc_OSError);
+	}
+	Py_RETURN_NONE;
+#else
+	PyErr_SetString(PyExc_NotImplementedError, "processor affinity is only supported on Linux");
+	return 0;
+#endif
+}
+
+
+
+static PyObject* _pycpuid_set_stats(PyObject* module, PyObject* args)
+{
+	int enabled, frames = 0;
+	if (!PyArg_ParseTuple(args, "i|i:set_stats", &enabled, &frames))
+	{
+		return 0;
+	}
+	if (!_pycpuid_counts)
+	{
+		_pycpuid_counts = PyDict_New();
+		_pycpuid_callers = PyDict_New();
+		if (!_pycpuid_counts || !_pycpuid_callers)
+		{
+			Py_CLEAR(_pycpuid_counts);
+			Py_CLEAR(_pycpuid_callers);
+			return 0;
+		}
+	}
+	_pycpuid_tracing = enabled != 0;
+	_pycpuid_tracing_frames = enabled && frames;
+	Py_RETURN_NONE;
+}
+
+
+
+static PyObject* _pycpuid_stats(PyObject* module, PyObject* args)
+{
+	PyObject* histogram = PyList_New(_PYCPUID_BUCKETS);
+	PyObject* counts;
+	PyObject* callers;
+	int i;
+	if (!histogram)
+	{
+		return 0;
+	}
+	for (i = 0; i < _PYCPUID_BUCKETS; ++i)
+	{
+		PyObject* count = PyLong_FromUnsignedLongLong(_pycpuid_histogram[i]);
+		if (!count)
+		{
+			Py_DECREF(histogram);
+			return 0;
+		}
+		PyList_SET_ITEM(histogram, i, count);
+	}
+	if (!_pycpuid_counts)
+	{
+		return Py_BuildValue("({}N{})", histogram);
+	}
+	counts = PyDict_Copy(_pycpuid_counts);
+	callers = counts ? PyDict_Copy(_pycpuid_callers) : 0;
+	if (!callers)
+	{
+		Py_XDECREF(counts);
+		Py_DECREF(histogram);
+		return 0;
+	}
+	return Py_BuildValue("(NNN)", counts, histogram, callers);
+}
+
+
+
+static PyObject* _pycpuid_reset_stats(PyObject* module, PyObject* args)
+{
+	memset(_pycpuid_histogram, 0, sizeof(_pycpuid_histogram));
+	if (_pycpuid_counts)
+	{
+		PyDict_Clear(_pycpuid_counts);
+		PyDict_Clear(_pycpuid_callers);
+	}
+	Py_RETURN_NONE;
+}
+
+
+
+static PyObject* _pycpuid_executions(PyObject* module, PyObject* args)
+{
+	return PyLong_FromUnsignedLongLong(_pycpuid_executed);
+}
+
+
+
+static PyObject* _pycpuid_getaffinity(PyObject* module, PyObject* args)
+{
+#ifdef __linux__
+	cpu_set_t* mask;
+	PyObject* cpus;
+	int ncpus, cpu;
+
+	mask = _pycpuid_getmask(&ncpus);
+	if (!mask)
+	{
+		return PyErr_SetFromErrno(PyExc_OSError);
+	}
+	cpus = PyList_New(0);
+	for (cpu = 0; cpus && cpu < ncpus; ++cpu)
+	{
+		if (CPU_ISSET_S(cpu, CPU_ALLOC_SIZE(ncpus), mask))
+		{
+			PyObject* item = PyInt_FromLong(cpu);
+			if (!item || PyList_Append(cpus, item) < 0)
+			{
+				Py_XDECREF(item);
+				Py_CLEAR(cpus);
+				break;
+			}
+			Py_DECREF(item);
+		}
+	}
+	CPU_FREE(mask);
+	return cpus;
+#else
+	PyErr_SetString(PyExc_NotImplementedError, "processor affinity is only supported on Linux");
+	return 0;
+#endif
+}
+
+
+
 static PyMethodDef _pycpuid_methods[] = 
 {
-	{ "cpuid", _pycpuid_cpuid, METH_VARARGS, "cpuid(eax) -> (eax, ebx, ecx, edx)"},
+	{ "cpuid", _pycpuid_cpuid, METH_VARARGS, "cpuid(eax[, ecx]) -> (eax, ebx, ecx, edx)"},
+	{ "cpuid_many", (PyCFunction)_pycpuid_cpuid_many, METH_VARARGS | METH_KEYWORDS, "cpuid_many(requests[, out[, cpu]]) -> buffer of (eax, ebx, ecx, edx) words"},
+	{ "getaffinity", _pycpuid_getaffinity, METH_NOARGS, "getaffinity() -> [cpu, ...]"},
+	{ "setaffinity", _pycpuid_setaffinity, METH_VARARGS, "setaffinity(cpus[, tid]) -> None"},
+	{ "xgetbv", _pycpuid_xgetbv, METH_VARARGS, "xgetbv(ecx) -> value of the extended control register"},
+	{ "xcomp_perm", _pycpuid_xcomp_perm, METH_NOARGS, "xcomp_perm() -> extended state components the process is permitted to use"},
+	{ "request_xcomp_perm", _pycpuid_request_xcomp_perm, METH_VARARGS, "request_xcomp_perm(xfeature) -> extended state components permitted after requesting one"},
+	{ "executions", _pycpuid_executions, METH_NOARGS, "executions() -> number of CPUID instructions executed"},
+	{ "set_stats", _pycpuid_set_stats, METH_VARARGS, "set_stats(enabled[, frames]) -> None"},
+	{ "stats", _pycpuid_stats, METH_NOARGS, "stats() -> ({(leaf, subleaf): count}, [count, ...], {(file, line, function): count})"},
+	{ "reset_stats", _pycpuid_reset_stats, METH_NOARGS, "reset_stats() -> None"},
+	{ "rdtsc", _pycpuid_rdtsc_py, METH_NOARGS, "rdtsc() -> time stamp counter"},
+	{ "rdtscp", _pycpuid_rdtscp_py, METH_NOARGS, "rdtscp() -> (time stamp counter, IA32_TSC_AUX)"},
+	{ "rdtsc_fill", _pycpuid_rdtsc_fill, METH_VARARGS, "rdtsc_fill(buffer) -> number of time stamp counter reads written"},
+	{ "address", _pycpuid_address, METH_VARARGS, "address(buffer) -> address of the first byte of the buffer"},
+	{ "increment_slot", _pycpuid_increment_slot, METH_VARARGS, "increment_slot(buffer, offset, count) -> None, incrementing a 64-bit word count times without the GIL"},
 	{ 0, 0, 0, 0 },
 };
 
@@ -0,0 +1,375 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright (c) Bram de Greve <bram.degreve@bramz.net>
+# Copyright (c) Flight Data Services Ltd
+# http://www.flightdataservices.com
+# See the file "LICENSE" for the full license governing this code.
+
+'''
+Backends reading CPUID leaves other than by executing the instruction in place.
+
+Installing a backend with :func:`pycpuid.set_backend` makes every accessor
+decode the recorded machine instead, for example::
+
+    with open('fleet/host42.txt') as f:
+        pycpuid.set_backend(ReplayBackend.from_cpuid_r(f.read()))
+    print pycpuid.brand_string(), pycpuid.microarch_level()
+    pycpuid.set_backend(None)
+
+Dumps can be recorded with the ``cpuid -r`` tool, by reading
+``/dev/cpu/N/cpuid`` on Linux, or with :meth:`pycpuid.Snapshot.to_bytes`.
+
+On Linux, :class:`DeviceBackend` reads the live processors through that device
+instead of pinning threads to them.
+'''
+
+import errno
+import os
+import re
+import struct
+import threading
+
+from pycpuid import Backend, LiveBackend, Snapshot, _subleaf_table
+
+DEVICE_PATH = '/dev/cpu/%d/cpuid'
+
+# A processor header and a leaf line of the raw output of the cpuid tool:
+#   CPU 0:
+#      0x00000000 0x00: eax=0x00000016 ebx=0x756e6547 ecx=0x6c65746e edx=0x49656e69
+_cpu_line = re.compile(r'^CPU\s*(\d*):')
+_leaf_line = re.compile(
+    r'^\s*0x([0-9a-f]+)\s+0x([0-9a-f]+):'
+    r'\s+eax=0x([0-9a-f]+)\s+ebx=0x([0-9a-f]+)\s+ecx=0x([0-9a-f]+)\s+edx=0x([0-9a-f]+)',
+    re.IGNORECASE)
+
+
+def parse_cpuid_r(text):
+    '''
+    parse_cpuid_r(text) -> {cpu: {(infotype, subleaf): (eax, ebx, ecx, edx), ...}, ...}
+    parses the output of ``cpuid -r``, or ``cpuid -r -1`` for one processor
+    raises ValueError when the text holds no leaves
+    '''
+    cpus = {}
+    leaves = None
+    for line in text.splitlines():
+        match = _cpu_line.match(line)
+        if match:
+            leaves = cpus.setdefault(int(match.group(1) or 0), {})
+            continue
+        match = _leaf_line.match(line)
+        if match:
+            if leaves is None:
+                leaves = cpus.setdefault(0, {})
+            words = [int(word, 16) for word in match.groups()]
+            leaves[words[0], words[1]] = tuple(words[2:])
+    if not any(cpus.values()):
+        raise ValueError("no CPUID leaves found in the text")
+    return cpus
+
+
+def parse_raw(data, offset=0):
+    '''
+    parse_raw(data[, offset]) -> {(infotype, subleaf): (eax, ebx, ecx, edx), ...}
+    parses a raw capture of ``/dev/cpu/N/cpuid`` read from the given file offset
+
+    The driver executes leaf ``offset & 0xffffffff`` with subleaf
+    ``offset >> 32`` for the first 16 bytes and moves on to the next leaf for
+    each 16 bytes after, so a capture holds a run of consecutive leaves.
+    raises ValueError when the data is not a whole number of leaves
+    '''
+    data = buffer(data)
+    if len(data) % 16:
+        raise ValueError("a raw capture holds 16 bytes per leaf")
+    leaves = {}
+    for row in xrange(len(data) // 16):
+        position = offset + row
+        leaves[position & 0xffffffff, position >> 32] = struct.unpack_from('<4I', data, row << 4)
+    return leaves
+
+
+def _pair(request):
+    '''
+    Normalises a leaf, or a (leaf[, subleaf]) tuple, to an (infotype, subleaf)
+    pair, with subleaf 0 when it is left out as the extension does.
+    '''
+    if not isinstance(request, tuple):
+        return request, 0
+    if len(request) == 1:
+        return request[0], 0
+    return request
+
+
+def _pairs(requests):
+    '''
+    Normalises the requests accepted by cpuid_many() to (infotype, subleaf) pairs.
+    '''
+    try:
+        data = buffer(requests)
+    except TypeError:
+        return [_pair(request) for request in requests]
+    if len(data) % 8:
+        raise ValueError("request buffer must hold (leaf, subleaf) pairs of 32-bit words")
+    words = struct.unpack_from('=%dI' % (len(data) // 4), data)
+    return zip(words[::2], words[1::2])
+
+
+def _runs(pairs):
+    '''
+    Groups (infotype, subleaf) pairs into runs of consecutive device offsets,
+    returning the offset and length of each run in order.
+    '''
+    runs = []
+    for infotype, subleaf in pairs:
+        position = subleaf << 32 | infotype
+        if runs and runs[-1][0] + runs[-1][1] == position:
+            runs[-1][1] += 1
+        else:
+            runs.append([position, 1])
+    return runs
+
+
+def _output(data, out):
+    '''
+    Returns the registers read for cpuid_many(), copying them into ``out``
+    when given.
+    '''
+    if out is None:
+        return bytearray(data)
+    try:
+        struct.pack_into('%ds' % len(data), out, 0, data)
+    except struct.error:
+        raise ValueError("output buffer is too small")
+    return out
+
+
+class ReplayBackend(Backend):
+    '''
+    Replays the leaves recorded on one or more logical processors.
+
+    Leaves missing from the recording read as zeros, except that the subleaf
+    of a leaf which is not indexed is ignored, as it is by the processor.
+    XGETBV reads the recorded XCR0, or assumes the OS enabled every state
+    component reported by leaf 0xD when none was recorded.
+    '''
+
+    def __init__(self, cpus, xcr0=None):
+        '''
+        :param cpus: Mapping of logical processor to a mapping of (leaf,
+            subleaf) to registers.
+        :type cpus: dict
+        :param xcr0: Value of XCR0 on the recorded machine.
+        :type xcr0: int
+        '''
+        if not cpus:
+            raise ValueError("a replay needs at least one processor")
+        self._cpus = dict((cpu, dict((key, tuple(regs)) for key, regs in leaves.items()))
+                          for cpu, leaves in cpus.items())
+        self._xcr0 = xcr0
+
+    @classmethod
+    def from_leaves(cls, leaves, xcr0=None):
+        '''
+        ReplayBackend.from_leaves({(infotype, subleaf): regs, ...}) -> ReplayBackend
+        replays the leaves of a single processor
+        '''
+        return cls({0: leaves}, xcr0)
+
+    @classmethod
+    def from_array(cls, keys, regs, xcr0=None):
+        '''
+        ReplayBackend.from_array([(infotype, subleaf), ...], regs) -> ReplayBackend
+        replays a single processor from a buffer holding the four native
+        unsigned 32-bit registers of each leaf in turn, as returned by
+        cpuid_many()
+        '''
+        keys = list(keys)
+        regs = buffer(regs)
+        if len(regs) != 16 * len(keys):
+            raise ValueError("the buffer must hold 16 bytes per leaf")
+        return cls.from_leaves(dict((key, struct.unpack_from('=4I', regs, row << 4))
+                                    for row, key in enumerate(keys)), xcr0)
+
+    @classmethod
+    def from_snapshots(cls, snapshots, xcr0=None):
+        '''
+        ReplayBackend.from_snapshots({cpu: Snapshot, ...}) -> ReplayBackend
+        replays snapshots, such as those of dump_all_cpus() or loaded with
+        Snapshot.from_buffer(), or a single snapshot as processor 0
+        '''
+        if isinstance(snapshots, Snapshot):
+            snapshots = {0: snapshots}
+        return cls(dict((cpu, dict((key, snapshot.cpuid(*key)) for key in snapshot.leaves()))
+                        for cpu, snapshot in snapshots.items()), xcr0)
+
+    @classmethod
+    def from_cpuid_r(cls, text, xcr0=None):
+        '''
+        ReplayBackend.from_cpuid_r(text) -> ReplayBackend
+        replays the output of ``cpuid -r``
+        '''
+        return cls(parse_cpuid_r(text), xcr0)
+
+    @classmethod
+    def from_raw(cls, data, offset=0, xcr0=None):
+        '''
+        ReplayBackend.from_raw(data[, offset]) -> ReplayBackend
+        replays a raw capture of ``/dev/cpu/N/cpuid`` as processor 0
+        '''
+        return cls.from_leaves(parse_raw(data, offset), xcr0)
+
+    def _leaves(self, cpu):
+        if cpu is None:
+            cpu = min(self._cpus)
+        try:
+            return self._cpus[cpu]
+        except KeyError:
+            raise ValueError("processor %d is not in the recording" % cpu)
+
+    def _read(self, leaves, infotype, subleaf):
+        regs = leaves.get((infotype, subleaf))
+        if regs is None:
+            if subleaf and infotype not in _subleaf_table:
+                return self._read(leaves, infotype, 0)
+            return (0, 0, 0, 0)
+        return regs
+
+    def cpuid(self, infotype, subleaf=0):
+        return self._read(self._leaves(None), infotype, subleaf)
+
+    def cpuid_many(self, requests, out=None, cpu=None):
+        leaves = self._leaves(cpu)
+        words = []
+        for infotype, subleaf in _pairs(requests):
+            words.extend(self._read(leaves, infotype, subleaf))
+        return _output(struct.pack('=%dI' % len(words), *words), out)
+
+    def xgetbv(self, xcr=0):
+        if xcr != 0:
+            raise ValueError("only XCR0 is recorded")
+        if self._xcr0 is not None:
+            return self._xcr0
+        eax, ebx, ecx, edx = self.cpuid(0xd)
+        return edx << 32 | eax
+
+    def cpus(self):
+        return sorted(self._cpus)
+
+    def __repr__(self):
+        return '<%s: %d processors>' % (self.__class__.__name__, len(self._cpus))
+
+
+class DeviceBackend(LiveBackend):
+    '''
+    Reads the leaves of any logical processor through the Linux cpuid driver,
+    so the calling thread is never pinned.
+
+    Reading 16 bytes of ``/dev/cpu/N/cpuid`` at offset ``subleaf << 32 |
+    leaf`` executes that leaf on processor N, and the driver moves on to the
+    next leaf for every further 16 bytes, so each run of consecutive leaves in
+    a request takes a single read. The devices of the ``max_open`` most
+    recently read processors are kept open.
+
+    Processors whose device cannot be opened, as when the cpuid module is not
+    loaded or the process lacks the privilege, are read by pinning the calling
+    thread as LiveBackend does, and requests for no particular processor
+    execute on the current one.
+    '''
+
+    def __init__(self, path=DEVICE_PATH, max_open=16):
+        '''
+        :param path: Path of the device, with ``%d`` for the processor.
+        :type path: str
+        :param max_open: Number of devices to keep open.
+        :type max_open: int
+        '''
+        self._path = path
+        self._max_open = max_open
+        self._fds = {}
+        self._recent = []
+        self._unavailable = set()
+        self._locks = {}
+        self._lock = threading.Lock()
+
+    def _cpu_lock(self, cpu):
+        '''
+        Returns the lock serialising the reads of a processor's device, so
+        reads of different processors never wait for each other.
+        '''
+        with self._lock:
+            return self._locks.setdefault(cpu, threading.Lock())
+
+    def _device(self, cpu):
+        '''
+        Returns the open device of a processor, or None when it cannot be
+        opened. Must be called with the processor's lock held.
+        '''
+        with self._lock:
+            fd = self._fds.get(cpu)
+            if fd is None:
+                if cpu in self._unavailable:
+                    return None
+                try:
+                    fd = os.open(self._path % cpu, os.O_RDONLY)
+                except OSError:
+                    self._unavailable.add(cpu)
+                    return None
+                self._evict()
+                self._fds[cpu] = fd
+            else:
+                self._recent.remove(cpu)
+            self._recent.append(cpu)
+            return fd
+
+    def _evict(self):
+        '''
+        Closes the least recently read devices to make room for another,
+        skipping those being read, which may briefly leave more than
+        ``max_open`` open. Must be called with the lock held.
+        '''
+        for cpu in list(self._recent):
+            if len(self._recent) < self._max_open:
+                break
+            lock = self._locks[cpu]
+            if lock.acquire(False):
+                try:
+                    os.close(self._fds.pop(cpu))
+                    self._recent.remove(cpu)
+                finally:
+                    lock.release()
+
+    def _read(self, fd, position, count):
+        '''
+        Reads ``count`` consecutive leaves from the device, starting at the
+        given offset.
+        '''
+        os.lseek(fd, position, os.SEEK_SET)
+        data = os.read(fd, count << 4)
+        if len(data) != count << 4:
+            raise OSError(errno.EIO, "short read from the cpuid device")
+        return data
+
+    def cpuid_many(self, requests, out=None, cpu=None):
+        if cpu is not None:
+            pairs = _pairs(requests)
+            with self._cpu_lock(cpu):
+                fd = self._device(cpu)
+                if fd is not None:
+                    data = ''.join([self._read(fd, position, count)
+                                    for position, count in _runs(pairs)])
+                    return _output(data, out)
+        return LiveBackend.cpuid_many(self, requests, out, cpu)
+
+    def close(self):
+        '''
+        close()
+        closes every open device
+        '''
+        with self._lock:
+            cpus = list(self._fds)
+        for cpu in cpus:
+            with self._locks[cpu]:
+                with self._lock:
+                    fd = self._fds.pop(cpu, None)
+                    if fd is not None:
+                        os.close(fd)
+                        self._recent.remove(cpu)
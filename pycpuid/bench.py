@@ -0,0 +1,266 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright (c) Bram de Greve <bram.degreve@bramz.net>
+# Copyright (c) Flight Data Services Ltd
+# http://www.flightdataservices.com
+# See the file "LICENSE" for the full license governing this code.
+
+'''
+Benchmarks of the cost of PyCPUID, written as JSON::
+
+    python -m pycpuid.bench --output before.json
+    python -m pycpuid.bench --baseline before.json --threshold 0.1
+
+Every result is the best time in nanoseconds per operation over several
+repeats. With a baseline, results slower than the baseline by more than the
+threshold are listed under ``regressions`` and the exit status is 1.
+'''
+
+import json
+import optparse
+import os
+import subprocess
+import sys
+import timeit
+
+from pycpuid import (HYPERVISOR_OFFSET, EXTENDED_OFFSET, Dispatcher, Snapshot, brand_string,
+                     cpuid, default_snapshot, feature_set, features, hypervisor, model,
+                     vendor)
+
+# Slowdown over the baseline, as a fraction, reported as a regression.
+DEFAULT_THRESHOLD = 0.1
+
+# Time each repeat of a benchmark runs for, in seconds.
+DEFAULT_BUDGET = 0.02
+
+DEFAULT_REPEAT = 5
+
+# Snapshots decoded by each call of the bulk decoding benchmarks, whose results
+# are per snapshot.
+BULK_SIZE = 1000
+
+# Code timed in a fresh interpreter by the import benchmarks, printing the
+# seconds taken.
+_import_code = {
+    'import': 'import time; t = time.time(); import pycpuid; print time.time() - t',
+    'import+first_access': ('import time; t = time.time(); import pycpuid; pycpuid.HAS_SSE2; '
+                            'print time.time() - t'),
+    }
+
+
+def measure(func, budget=DEFAULT_BUDGET, repeat=DEFAULT_REPEAT):
+    '''
+    measure(func[, budget[, repeat]]) -> float
+    returns the best time in nanoseconds taken by a call to a function of no
+    arguments, calling it as often as fits in the budget for each repeat
+    '''
+    timer = timeit.Timer(func)
+    number = 1
+    while True:
+        elapsed = timer.timeit(number)
+        if elapsed >= budget / 10 or number >= 1 << 30:
+            break
+        number *= 10
+    number = max(int(number * budget / max(elapsed, 1e-9)), 1)
+    return min(timer.repeat(repeat, number)) / number * 1e9
+
+
+def _cpuid_benchmarks():
+    benchmarks = {}
+    snapshot = default_snapshot()
+    leaves = [0, 1, 7, 0xb, 0xd, EXTENDED_OFFSET, EXTENDED_OFFSET | 0x1]
+    if snapshot.cpuid(1)[2] & (1 << 31):
+        leaves.append(HYPERVISOR_OFFSET)
+    for leaf in leaves:
+        if leaf & 0xc0000000 or leaf <= snapshot.cpuid(0)[0]:
+            benchmarks['cpuid/0x%x' % leaf] = lambda leaf=leaf: cpuid(leaf)
+    benchmarks['probe'] = Snapshot.probe
+    return benchmarks
+
+
+def _brand_string():
+    '''
+    Returns the brand string, or None when the processor reports none, as
+    under some hypervisors.
+    '''
+    try:
+        return brand_string()
+    except (AssertionError, ValueError):
+        return None
+
+
+def _accessor_benchmarks():
+    benchmarks = {
+        'accessor/features': features,
+        'accessor/model': model,
+        'accessor/vendor': vendor,
+        'accessor/feature_set': feature_set,
+        }
+    if _brand_string() is not None:
+        benchmarks['accessor/brand_string'] = brand_string
+    return benchmarks
+
+
+def _kernel():
+    return 0
+
+# Left out of the registry so that refresh() and dispatched() in the host
+# process never see it.
+_kernel = _dispatcher = Dispatcher(_kernel, registered=False)
+
+
+@_kernel.register('SSE2')
+def _kernel_sse2():
+    return 1
+
+
+def _dispatch_benchmarks():
+    # Resolve against the current default snapshot, rebinding the name.
+    _dispatcher.reset()
+    _kernel()
+    return {
+        'dispatch/resolve': _dispatcher.resolve,
+        # The first call rebound the name in this module, so this measures the
+        # direct call that dispatched code pays.
+        'dispatch/call': lambda: _kernel(),
+        }
+
+
+def _decode_benchmarks():
+    data = default_snapshot().to_bytes()
+
+    def decode():
+        for _ in xrange(BULK_SIZE):
+            snapshot = Snapshot.from_buffer(data)
+            feature_set(snapshot), vendor(snapshot), model(snapshot)
+
+    decode.operations = BULK_SIZE
+    benchmarks = {'decode/snapshots': decode}
+    try:
+        import numpy
+        from pycpuid import fleet
+    except ImportError:
+        return benchmarks
+    regs = numpy.repeat(fleet.to_array([default_snapshot()]), BULK_SIZE, axis=0)
+    decode_fleet = lambda: fleet.decode(regs)
+    decode_fleet.operations = BULK_SIZE
+    benchmarks['decode/fleet'] = decode_fleet
+    return benchmarks
+
+
+def benchmarks():
+    '''
+    benchmarks() -> {str: function, ...}
+    returns every benchmark run in this process by name, each performing the
+    number of operations in its ``operations`` attribute, or one, per call
+    '''
+    result = {}
+    for group in (_cpuid_benchmarks, _accessor_benchmarks, _dispatch_benchmarks,
+                  _decode_benchmarks):
+        result.update(group())
+    return result
+
+
+def measure_import(code, repeat=DEFAULT_REPEAT):
+    '''
+    measure_import(code[, repeat]) -> float
+    returns the best time in nanoseconds printed by code run in a fresh
+    interpreter, which imports PyCPUID from the directory holding it
+    '''
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    best = None
+    for _ in range(repeat):
+        process = subprocess.Popen([sys.executable, '-c', code], cwd=root,
+                                   stdout=subprocess.PIPE)
+        output = process.communicate()[0]
+        if process.returncode:
+            raise RuntimeError("the import benchmark failed with status %d" % process.returncode)
+        elapsed = float(output) * 1e9
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def run(names=None, budget=DEFAULT_BUDGET, repeat=DEFAULT_REPEAT):
+    '''
+    run([names[, budget[, repeat]]]) -> {str: float, ...}
+    runs the benchmarks whose names contain any of the given substrings, or
+    every benchmark, returning nanoseconds per operation by name
+    '''
+    selected = lambda name: not names or any(part in name for part in names)
+    results = {}
+    for name, func in sorted(benchmarks().items()):
+        if selected(name):
+            results[name] = measure(func, budget, repeat) / getattr(func, 'operations', 1)
+    for name, code in sorted(_import_code.items()):
+        if selected(name):
+            results[name] = measure_import(code, repeat)
+    return results
+
+
+def compare(results, baseline, threshold=DEFAULT_THRESHOLD):
+    '''
+    compare(results, baseline[, threshold]) -> {str: float, ...}
+    returns the ratio of each result to the baseline which exceeds one by more
+    than the threshold, ignoring results missing from the baseline
+    '''
+    regressions = {}
+    for name, value in results.items():
+        reference = baseline.get(name)
+        if reference and value / reference > 1 + threshold:
+            regressions[name] = value / reference
+    return regressions
+
+
+def report(results, baseline=None, threshold=DEFAULT_THRESHOLD):
+    '''
+    report(results[, baseline[, threshold]]) -> dict
+    returns the document written by main(), describing the machine along with
+    the results and any comparison with a baseline
+    '''
+    machine = hypervisor()
+    document = {
+        'pycpuid': sys.modules['pycpuid'].__version__,
+        'python': sys.version.split()[0],
+        'vendor': vendor(),
+        'brand_string': _brand_string(),
+        'hypervisor': machine.name if machine else None,
+        'unit': 'ns',
+        'results': results,
+        }
+    if baseline is not None:
+        document['threshold'] = threshold
+        document['regressions'] = compare(results, baseline, threshold)
+    return document
+
+
+def main(argv=None):
+    '''
+    main([argv]) -> int
+    runs the benchmarks from the command line, returning the exit status
+    '''
+    parser = optparse.OptionParser(usage='python -m pycpuid.bench [options] [name ...]')
+    parser.add_option('-o', '--output', help='write the JSON to a file instead of stdout')
+    parser.add_option('-b', '--baseline', help='compare with the results in a JSON file')
+    parser.add_option('-t', '--threshold', type='float', default=DEFAULT_THRESHOLD,
+                      help='slowdown reported as a regression [default: %default]')
+    parser.add_option('--budget', type='float', default=DEFAULT_BUDGET,
+                      help='seconds to run each repeat for [default: %default]')
+    parser.add_option('-r', '--repeat', type='int', default=DEFAULT_REPEAT,
+                      help='repeats to take the best of [default: %default]')
+    options, names = parser.parse_args(argv)
+    baseline = None
+    if options.baseline:
+        with open(options.baseline) as f:
+            baseline = json.load(f)['results']
+    document = report(run(names, options.budget, options.repeat), baseline, options.threshold)
+    text = json.dumps(document, indent=2, sort_keys=True)
+    if options.output:
+        with open(options.output, 'w') as f:
+            f.write(text + '\n')
+    else:
+        print text
+    return 1 if document.get('regressions') else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,212 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright (c) Bram de Greve <bram.degreve@bramz.net>
+# Copyright (c) Flight Data Services Ltd
+# http://www.flightdataservices.com
+# See the file "LICENSE" for the full license governing this code.
+
+'''
+Buffers aligned to the cache line or page size, and counters which cannot
+share a cache line between threads.
+
+Two threads writing to different words of one cache line make it bounce
+between their cores, so counters and ring buffers written by different
+threads should start on lines of their own::
+
+    ring = aligned(1 << 20, 'page')
+    counters = PaddedSlots(threads)
+    counters.add(counters.thread_slot())
+
+:func:`false_sharing` measures the cost on the running machine.
+'''
+
+import ctypes
+import mmap
+import threading
+import time
+
+import _pycpuid
+from pycpuid import affinity, cache_line_size
+
+PAGE_SIZE = mmap.PAGESIZE
+
+
+def _alignment(alignment):
+    '''
+    Resolves an alignment of None for the cache line, 'page' or a power of two.
+    '''
+    if alignment is None:
+        alignment = cache_line_size()
+    elif alignment == 'page':
+        alignment = PAGE_SIZE
+    if alignment < 1 or alignment & (alignment - 1):
+        raise ValueError("alignment must be a power of two")
+    return alignment
+
+
+def _allocate(size, alignment):
+    '''
+    Returns a bytearray holding ``size`` bytes at an aligned offset, and that
+    offset.
+    '''
+    if size < 0:
+        raise ValueError("size must not be negative")
+    data = bytearray(size + alignment - 1)
+    return data, -_pycpuid.address(data) % alignment
+
+
+def aligned(size, alignment=None):
+    '''
+    aligned(size[, alignment]) -> memoryview
+    returns a writable buffer of zeros whose first byte is aligned to the
+    cache line, to the page with ``'page'``, or to a given power of two
+    '''
+    data, offset = _allocate(size, _alignment(alignment))
+    return memoryview(data)[offset:offset + size]
+
+
+def aligned_array(shape, dtype=float, alignment=None):
+    '''
+    aligned_array(shape[, dtype[, alignment]]) -> numpy.ndarray
+    returns an array of zeros aligned as by aligned(), which needs NumPy
+    '''
+    import numpy as np
+    dtype = np.dtype(dtype)
+    count = int(np.prod(shape))
+    data, offset = _allocate(count * dtype.itemsize, _alignment(alignment))
+    return np.frombuffer(data, dtype, count, offset).reshape(shape)
+
+
+def address(buf):
+    '''
+    address(buffer) -> int
+    returns the address of the first byte of a buffer
+    '''
+    return _pycpuid.address(buf)
+
+
+class PaddedSlots(object):
+    '''
+    Unsigned 64-bit counters, each starting a cache line of its own so that
+    threads updating different slots never share a line.
+    '''
+
+    def __init__(self, count, padding=None):
+        '''
+        :param count: Number of slots.
+        :type count: int
+        :param padding: Bytes from one slot to the next, a multiple of 8, the
+            cache line size when not given.
+        :type padding: int
+        '''
+        if padding is None:
+            padding = cache_line_size()
+        if padding < 8 or padding % 8:
+            raise ValueError("padding must be a positive multiple of 8 bytes")
+        self.padding = padding
+        self._count = count
+        self._step = padding // 8
+        self._data, offset = _allocate(count * padding, _alignment(None))
+        self._words = (ctypes.c_uint64 * (count * self._step)).from_buffer(self._data, offset)
+        self._owners = 0
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return self._count
+
+    def _index(self, slot):
+        if not 0 <= slot < self._count:
+            raise IndexError("slot out of range")
+        return slot * self._step
+
+    def __getitem__(self, slot):
+        return self._words[self._index(slot)]
+
+    def __setitem__(self, slot, value):
+        self._words[self._index(slot)] = value
+
+    def add(self, slot, value=1):
+        '''
+        add(slot[, value])
+        adds to a slot, which only the thread owning it may do
+        '''
+        self._words[self._index(slot)] += value
+
+    def total(self):
+        '''
+        total() -> int
+        returns the sum of every slot
+        '''
+        return sum(self._words[::self._step])
+
+    def offset(self, slot):
+        '''
+        offset(slot) -> int
+        returns the offset in bytes of a slot within buffer()
+        '''
+        return self._index(slot) * 8
+
+    def buffer(self):
+        '''
+        buffer() -> ctypes array
+        returns the memory holding the slots, for passing to native code
+        '''
+        return self._words
+
+    def thread_slot(self):
+        '''
+        thread_slot() -> int
+        returns the slot of the calling thread, handing out the slots in turn
+        to the threads asking for one, which keep it after they exit
+        raises IndexError when every slot belongs to another thread
+        '''
+        slot = getattr(self._local, 'slot', None)
+        if slot is None:
+            with self._lock:
+                if self._owners >= self._count:
+                    raise IndexError("every slot belongs to another thread")
+                slot = self._local.slot = self._owners
+                self._owners += 1
+        return slot
+
+    def __repr__(self):
+        return '<%s: %d slots of %d bytes>' % (self.__class__.__name__, self._count, self.padding)
+
+
+def _increment(slots, threads, iterations):
+    '''
+    Times threads incrementing a slot each, without holding the GIL.
+    '''
+    workers = [threading.Thread(target=_pycpuid.increment_slot,
+                                args=(slots.buffer(), slots.offset(slot), iterations))
+               for slot in range(threads)]
+    start = time.time()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return time.time() - start
+
+
+def false_sharing(threads=None, iterations=10000000, rounds=3):
+    '''
+    false_sharing([threads[, iterations[, rounds]]]) -> {str: float, ...}
+    returns the best time in seconds over the rounds for each of the
+    ``threads`` to increment a counter of its own the given number of times,
+    with the counters ``packed`` into adjacent words or ``padded`` to lines of
+    their own, and the ``ratio`` of the two
+
+    The threads run in parallel, one per allowed processor by default, so
+    packed counters are only slower on more than one processor.
+    '''
+    if threads is None:
+        threads = len(affinity())
+    packed = PaddedSlots(threads, 8)
+    padded = PaddedSlots(threads)
+    result = {'packed': float('inf'), 'padded': float('inf'), 'threads': threads}
+    for _ in range(rounds):
+        result['packed'] = min(result['packed'], _increment(packed, threads, iterations))
+        result['padded'] = min(result['padded'], _increment(padded, threads, iterations))
+    result['ratio'] = result['packed'] / result['padded'] if result['padded'] else 1.0
+    return result
@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright (c) Bram de Greve <bram.degreve@bramz.net>
+# Copyright (c) Flight Data Services Ltd
+# http://www.flightdataservices.com
+# See the file "LICENSE" for the full license governing this code.
+
+'''
+A clock reading the time stamp counter, for timing hot paths more cheaply than
+the time module can::
+
+    clock = default_clock()
+    start = clock.ticks()
+    work()
+    print clock.to_ns(clock.ticks() - start)
+
+Ticks are only worth converting to time when :attr:`TscClock.reliable` is
+true, as the counter of older processors changes rate with the clock speed
+and may differ between processors.
+'''
+
+import time
+
+import _pycpuid
+from pycpuid import invariant_tsc, rdtsc, tsc_frequency
+
+# How long to calibrate against the system clock when the processor does not
+# report the frequency of the counter, in seconds.
+CALIBRATION_TIME = 0.05
+
+
+def calibrate(duration=CALIBRATION_TIME):
+    '''
+    calibrate([duration]) -> int
+    measures the frequency of the time stamp counter in Hz against the system
+    clock over the given number of seconds
+    '''
+    start, ticks = time.time(), rdtsc()
+    time.sleep(duration)
+    end, elapsed = time.time(), rdtsc() - ticks
+    return int(elapsed / (end - start))
+
+
+class TscClock(object):
+    '''
+    Converts time stamp counter ticks to nanoseconds.
+
+    The frequency is read from CPUID leaves 0x15, 0x40000010 or 0x16 when the
+    processor reports it, and otherwise calibrated once against the system
+    clock when the clock is created.
+    '''
+
+    def __init__(self, frequency=None, snapshot=None):
+        '''
+        :param frequency: Frequency of the counter in Hz, found from the
+            processor when not given.
+        :type frequency: int
+        :param snapshot: Snapshot to read the frequency and invariant TSC flag
+            from, the default snapshot when not given.
+        :type snapshot: Snapshot
+        '''
+        self.source = 'given'
+        if frequency is None:
+            frequency = tsc_frequency(snapshot)
+            self.source = 'cpuid'
+        if frequency is None:
+            frequency = calibrate()
+            self.source = 'calibrated'
+        if frequency <= 0:
+            raise ValueError("the frequency must be positive")
+        self.frequency = frequency
+        self.reliable = invariant_tsc(snapshot)
+        self._ns_per_tick = 1e9 / frequency
+
+    # Reading the counter is the only work done on the hot path, so call the
+    # extension directly.
+    ticks = staticmethod(_pycpuid.rdtsc)
+
+    def to_ns(self, ticks):
+        '''
+        to_ns(ticks) -> int
+        converts a number of ticks to nanoseconds
+        '''
+        return int(ticks * self._ns_per_tick)
+
+    def now_ns(self):
+        '''
+        now_ns() -> int
+        returns the counter in nanoseconds, which only makes sense relative to
+        another reading
+        '''
+        return int(_pycpuid.rdtsc() * self._ns_per_tick)
+
+    def __repr__(self):
+        return '<%s: %.3f MHz, %s%s>' % (self.__class__.__name__, self.frequency / 1e6, self.source,
+                                         '' if self.reliable else ', unreliable')
+
+
+_clock = None
+
+
+def default_clock():
+    '''
+    default_clock() -> TscClock
+    returns the process-wide clock, creating it on first use
+    '''
+    global _clock
+    if _clock is None:
+        _clock = TscClock()
+    return _clock
@@ -0,0 +1,197 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright (c) Bram de Greve <bram.degreve@bramz.net>
+# Copyright (c) Flight Data Services Ltd
+# http://www.flightdataservices.com
+# See the file "LICENSE" for the full license governing this code.
+
+'''
+Vectorised decoding of CPUID dumps from many machines at once with NumPy.
+
+A fleet is an (N, L, 4) array of unsigned 32-bit registers, holding for each of
+N machines the (eax, ebx, ecx, edx) of the L leaves listed in ``keys``. Leaves
+missing from a dump are left as zeros. :func:`decode` returns a column of
+results per field, each decoded for every machine with array shifts and masks::
+
+    regs = fleet.to_array(snapshots)
+    columns = fleet.decode(regs)
+    print numpy.bincount(columns['microarch_level'])
+
+NumPy is an optional dependency, installed with the ``numpy`` extra.
+'''
+
+import numpy as np
+
+from pycpuid import (EXTENDED_OFFSET, FeatureSet, _feat_tables,
+                     _microarch_table, _xstate_table)
+
+#: Leaves needed by every column of decode(), in the default order.
+LEAVES = ([(0, 0), (1, 0)] + [(4, subleaf) for subleaf in range(8)] +
+          [(7, 0), (7, 1), (0xd, 0), (0xd, 1),
+           (EXTENDED_OFFSET, 0), (EXTENDED_OFFSET | 0x1, 0),
+           (EXTENDED_OFFSET | 0x5, 0), (EXTENDED_OFFSET | 0x6, 0)] +
+          [(EXTENDED_OFFSET | 0x1d, subleaf) for subleaf in range(8)])
+
+# Number of 32-bit words in the feature columns, four per feature table.
+WORDS = 4 * len(_feat_tables)
+
+
+def _feat_word_masks():
+    '''
+    Returns the bits of each feature word which belong to a known feature.
+    '''
+    masks = np.zeros(WORDS, np.uint32)
+    for i, (leaf, table) in enumerate(_feat_tables):
+        for key, reg, bit in table:
+            masks[i * 4 + reg] |= 1 << bit
+    return masks
+
+_word_masks = _feat_word_masks()
+
+
+def to_array(snapshots, keys=None):
+    '''
+    to_array([Snapshot, ...][, keys]) -> numpy.ndarray
+    packs the given leaves of each snapshot into an (N, L, 4) array
+    '''
+    if keys is None:
+        keys = LEAVES
+    snapshots = list(snapshots)
+    regs = np.zeros((len(snapshots), len(keys), 4), np.uint32)
+    for row, snapshot in enumerate(snapshots):
+        regs[row] = [snapshot.cpuid(*key) for key in keys]
+    return regs
+
+
+def feature_words(features):
+    '''
+    feature_words(features) -> numpy.ndarray
+    returns a FeatureSet, or anything FeatureSet() accepts, as a row of
+    feature words for comparing against the feature columns
+    '''
+    mask = FeatureSet(features).mask
+    return np.array([(mask >> (32 * i)) & 0xffffffff for i in range(WORDS)], np.uint32)
+
+
+def feature_sets(words):
+    '''
+    feature_sets(words) -> [FeatureSet, ...]
+    converts each row of a feature column back into a FeatureSet
+    '''
+    return [FeatureSet(sum(int(word) << (32 * i) for i, word in enumerate(row)))
+            for row in np.asarray(words, np.uint32)]
+
+
+def has_features(words, features):
+    '''
+    has_features(words, features) -> numpy.ndarray
+    returns whether each row of a feature column includes all the features
+    '''
+    required = feature_words(features)
+    return ((np.asarray(words, np.uint32) & required) == required).all(axis=1)
+
+
+def _deterministic_caches(leaves, sizes):
+    '''
+    Sums the caches reported by each subleaf of leaf 0x4 or 0x8000001D into
+    the l1d, l1i, l2 and l3 columns.
+    '''
+    for a, b, c, d in leaves:
+        kind = a & 0x1f
+        level = (a >> 5) & 0x7
+        size = ((((b >> 22) & 0x3ff) + 1).astype(np.uint64) *
+                (((b >> 12) & 0x3ff) + 1) * ((b & 0xfff) + 1) *
+                (c.astype(np.uint64) + 1))
+        for name, selected in (('l1d', (level == 1) & (kind == 1)),
+                               ('l1i', (level == 1) & (kind == 2)),
+                               ('l2', (level == 2) & (kind != 0)),
+                               ('l3', (level == 3) & (kind != 0))):
+            sizes[name] += np.where(selected, size, np.uint64(0))
+
+
+def _legacy_caches(top, l1, l2, sizes):
+    '''
+    Decodes the legacy AMD cache leaves 0x80000005 and 0x80000006 into the l1d,
+    l1i, l2 and l3 columns.
+    '''
+    zero = np.uint64(0)
+    has_l1 = top >= EXTENDED_OFFSET | 0x5
+    has_l2 = top >= EXTENDED_OFFSET | 0x6
+    c, d = l1[:, 2].astype(np.uint64), l1[:, 3].astype(np.uint64)
+    sizes['l1d'] += np.where(has_l1, (c >> 24) << 10, zero)
+    sizes['l1i'] += np.where(has_l1, (d >> 24) << 10, zero)
+    c, d = l2[:, 2].astype(np.uint64), l2[:, 3].astype(np.uint64)
+    sizes['l2'] += np.where(has_l2 & ((c >> 12) & 0xf != 0), (c >> 16) << 10, zero)
+    sizes['l3'] += np.where(has_l2 & ((d >> 12) & 0xf != 0), (d >> 18) << 19, zero)
+
+
+def decode(regs, keys=None, xcr0=None):
+    '''
+    decode(regs[, keys[, xcr0]]) -> {name: numpy.ndarray, ...}
+    decodes an (N, L, 4) array of the registers of leaves ``keys`` into columns
+
+    The columns are ``vendor``, ``family``, ``model`` and ``stepping``, the
+    ``features`` and ``usable`` feature words, the ``microarch_level`` and the
+    ``l1d``, ``l1i``, ``l2`` and ``l3`` cache sizes in bytes, summed over the
+    caches at each level. As dumps hold no XCR0, the OS is taken to enable
+    every state component of leaf 0xD unless ``xcr0`` gives one value, or one
+    per machine.
+    raises ValueError when the array does not match the keys
+    '''
+    if keys is None:
+        keys = LEAVES
+    regs = np.asarray(regs, np.uint32)
+    if regs.ndim != 3 or regs.shape[1:] != (len(keys), 4):
+        raise ValueError("expected an array of shape (N, %d, 4)" % len(keys))
+    count = regs.shape[0]
+    positions = dict((tuple(key), i) for i, key in enumerate(keys))
+    zeros = np.zeros((count, 4), np.uint32)
+
+    def leaf(infotype, subleaf=0):
+        i = positions.get((infotype, subleaf))
+        return zeros if i is None else regs[:, i]
+
+    columns = {}
+    columns['vendor'] = np.ascontiguousarray(leaf(0)[:, [1, 3, 2]], '<u4').view('S12')[:, 0]
+    a = leaf(1)[:, 0]
+    columns['stepping'] = a & 0xf
+    columns['model'] = (((a >> 16) & 0xf) << 4) + ((a >> 4) & 0xf)
+    columns['family'] = ((a >> 20) & 0xff) + ((a >> 8) & 0xf)
+
+    available = np.empty((count, WORDS), np.uint32)
+    for i, (key, table) in enumerate(_feat_tables):
+        available[:, i * 4:i * 4 + 4] = leaf(*key) & _word_masks[i * 4:i * 4 + 4]
+    columns['features'] = available
+
+    if xcr0 is None:
+        xsave = leaf(0xd)
+        osxsave = (leaf(1)[:, 2] >> 27) & 1 != 0
+        xcr0 = np.where(osxsave, (xsave[:, 3].astype(np.uint64) << 32) | xsave[:, 0],
+                        np.uint64(0))
+    xcr0 = np.asarray(xcr0, np.uint64)
+    usable = available.copy()
+    for components, dependent in _xstate_table:
+        missing = (xcr0 & np.uint64(components)) != components
+        usable &= np.where(np.reshape(missing, (-1, 1)), ~feature_words(dependent),
+                           np.uint32(0xffffffff))
+    columns['usable'] = usable
+
+    level = np.zeros(count, np.uint8)
+    supported = np.ones(count, bool)
+    for number, added in _microarch_table:
+        supported &= has_features(usable, added)
+        level[supported] = number
+    columns['microarch_level'] = level
+
+    sizes = dict((name, np.zeros(count, np.uint64)) for name in ('l1d', 'l1i', 'l2', 'l3'))
+    amd = (columns['vendor'] == 'AuthenticAMD') | (columns['vendor'] == 'HygonGenuine')
+    topoext = amd & ((leaf(EXTENDED_OFFSET | 0x1)[:, 2] >> 22) & 1 != 0)
+    intel = ~amd & (leaf(0)[:, 0] >= 4)
+    for selected, infotype in (intel, 4), (topoext, EXTENDED_OFFSET | 0x1d):
+        _deterministic_caches([tuple((leaf(*key) * selected[:, None]).T)
+                               for key in sorted(positions) if key[0] == infotype], sizes)
+    legacy = ~intel & ~topoext
+    _legacy_caches(leaf(EXTENDED_OFFSET)[:, 0] * legacy,
+                   leaf(EXTENDED_OFFSET | 0x5), leaf(EXTENDED_OFFSET | 0x6), sizes)
+    columns.update(sizes)
+    return columns
@@ -0,0 +1,201 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright (c) Bram de Greve <bram.degreve@bramz.net>
+# Copyright (c) Flight Data Services Ltd
+# http://www.flightdataservices.com
+# See the file "LICENSE" for the full license governing this code.
+
+'''
+Persistent cache of the default snapshot for short-lived processes.
+
+The first process to probe writes its snapshot into a per-user runtime
+directory, keyed by the boot ID and the set of processors it may run on. Later
+processes map the file into memory and only execute leaves 0x0 and 0x1 to check
+that it still describes the processor, probing everything again on a mismatch.
+
+Enable it by setting ``PYCPUID_CACHE=1`` in the environment, and optionally
+``PYCPUID_CACHE_DIR`` to choose the directory.
+'''
+
+import hashlib
+import mmap
+import os
+import struct
+import tempfile
+
+from pycpuid import Snapshot, affinity, cpuid_many
+
+BOOT_ID_PATH = '/proc/sys/kernel/random/boot_id'
+
+# Bumped whenever the layout of the file or the leaves probed change.
+FORMAT_VERSION = 2
+
+# Magic, format version and boot ID, followed by the snapshot as serialised by
+# Snapshot.to_bytes().
+_header = struct.Struct('<8sI36s')
+_MAGIC = 'PYCPUIDC'
+
+# Mask of the initial APIC ID in leaf 0x1 EBX, which depends on the processor
+# running the check rather than the processor model.
+_APIC_MASK = 0x00ffffff
+
+
+def boot_id():
+    '''
+    boot_id() -> str
+    returns the ID of the running kernel boot, or None when unavailable
+    '''
+    try:
+        with open(BOOT_ID_PATH) as f:
+            return f.read().strip()
+    except (IOError, OSError):
+        return None
+
+
+def cache_dir():
+    '''
+    cache_dir() -> str
+    returns the private directory holding the cache, creating it if needed,
+    or None when no directory owned by the user is available
+    '''
+    path = os.environ.get('PYCPUID_CACHE_DIR')
+    if not path:
+        runtime = os.environ.get('XDG_RUNTIME_DIR')
+        if runtime:
+            path = os.path.join(runtime, 'pycpuid')
+        else:
+            path = os.path.join(tempfile.gettempdir(), 'pycpuid-%d' % os.getuid())
+    try:
+        os.mkdir(path, 0700)
+    except OSError:
+        pass
+    # Never trust a directory another user could have planted a file in.
+    try:
+        info = os.stat(path)
+    except OSError:
+        return None
+    if info.st_uid != os.getuid() or info.st_mode & 0022:
+        return None
+    return path
+
+
+def cache_path():
+    '''
+    cache_path() -> str
+    returns the path of the cache file for this boot and processor set, or
+    None when the cache cannot be used
+    '''
+    boot = boot_id()
+    directory = cache_dir()
+    if not boot or not directory:
+        return None
+    try:
+        cpus = affinity()
+    except NotImplementedError:
+        return None
+    key = hashlib.sha1(','.join(map(str, cpus))).hexdigest()[:16]
+    return os.path.join(directory, 'snapshot-%s-%s' % (boot, key))
+
+
+def save(snapshot, path=None):
+    '''
+    save(snapshot[, path]) -> str
+    writes a snapshot to the cache, atomically replacing any previous file,
+    and removes the files cached by earlier boots
+    '''
+    if path is None:
+        path = cache_path()
+        if path is None:
+            return None
+        _prune(os.path.dirname(path), boot_id())
+    data = _header.pack(_MAGIC, FORMAT_VERSION, boot_id() or '') + snapshot.to_bytes()
+    fd, temporary = tempfile.mkstemp(prefix='.snapshot-', dir=os.path.dirname(path))
+    saved = False
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.rename(temporary, path)
+        saved = True
+    finally:
+        if not saved:
+            os.unlink(temporary)
+    return path
+
+
+def _prune(directory, boot):
+    '''
+    Removes the snapshots cached in a directory by boots other than the given
+    one, which can never match again.
+    '''
+    for name in os.listdir(directory):
+        if name.startswith('snapshot-') and not name.startswith('snapshot-%s-' % boot):
+            try:
+                os.unlink(os.path.join(directory, name))
+            except OSError:
+                pass
+
+
+def load(path=None):
+    '''
+    load([path]) -> Snapshot
+    maps a cached snapshot into memory, returning None when it is missing,
+    corrupt, of another version or boot, or no longer matches the processor
+    '''
+    if path is None:
+        path = cache_path()
+        if path is None:
+            return None
+    try:
+        with open(path, 'rb') as f:
+            buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (IOError, OSError, ValueError):
+        return None
+    snapshot = None
+    try:
+        snapshot = _validate(buf)
+    except ValueError:
+        pass
+    finally:
+        if snapshot is None:
+            buf.close()
+    return snapshot
+
+
+def _validate(buf):
+    '''
+    Returns the snapshot in a mapped cache file, or None when it is of another
+    version or boot, or no longer matches the processor.
+    '''
+    if len(buf) < _header.size:
+        return None
+    magic, version, boot = _header.unpack_from(buf)
+    if magic != _MAGIC or version != FORMAT_VERSION or boot.rstrip('\0') != (boot_id() or ''):
+        return None
+    snapshot = Snapshot.from_buffer(buf, _header.size)
+    return snapshot if _matches(snapshot) else None
+
+
+def _matches(snapshot):
+    '''
+    Checks leaves 0x0 and 0x1 of a snapshot against the running processor.
+    '''
+    live = struct.unpack('=8I', bytes(cpuid_many([0, 1])))
+    recorded = snapshot.cpuid(0) + snapshot.cpuid(1)
+    mask = (0xffffffff,) * 5 + (_APIC_MASK, 0xffffffff, 0xffffffff)
+    return all(a & m == b & m for a, b, m in zip(live, recorded, mask))
+
+
+def cached_snapshot():
+    '''
+    cached_snapshot() -> Snapshot
+    returns the cached snapshot, probing the processor and caching the result
+    when there is no valid one
+    '''
+    snapshot = load()
+    if snapshot is None:
+        snapshot = Snapshot.probe()
+        try:
+            save(snapshot)
+        except (IOError, OSError):
+            pass
+    return snapshot
@@ -0,0 +1,258 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Copyright (c) Bram de Greve <bram.degreve@bramz.net>
+# Copyright (c) Flight Data Services Ltd
+# http://www.flightdataservices.com
+# See the file "LICENSE" for the full license governing this code.
+
+'''
+A process pool placing its workers by the processor topology, so CPU-bound
+workers are not stacked on SMT siblings while whole cores sit idle::
+
+    pool = PinnedPool(policy='cores')
+    for placement in pool.plan:
+        log.info('worker on cpu %d, core %s', placement.cpu, placement.core)
+    results = pool.map(work, items)
+
+Each worker takes a processor of the plan when it starts and pins itself to
+it, handing it back when it exits so a replacement worker can take it.
+
+:class:`PartitionScheduler` keeps the working set of each partition of a data
+set within one last level cache, such as the L3 of an AMD CCX, by running the
+thread consuming a partition on the processors sharing that cache::
+
+    scheduler = PartitionScheduler(len(shards))
+    totals = scheduler.map(lambda partition: aggregate(shards[partition]))
+'''
+
+import Queue
+import collections
+import multiprocessing
+import multiprocessing.pool
+import multiprocessing.util
+import sys
+import threading
+import warnings
+
+from pycpuid import cache_domains, set_affinity, topology as _topology
+
+#: Placement policies understood by plan().
+POLICIES = ('cores', 'siblings-last')
+
+# How long a worker waits for a processor before running unpinned with a
+# warning, in seconds, as a worker killed outright never hands its processor
+# back.
+PIN_TIMEOUT = 1.0
+
+Placement = collections.namedtuple('Placement', 'worker cpu package core')
+
+# Processor the current worker is pinned to.
+_cpu = None
+
+
+def plan(processes=None, policy='cores', package=None, topology=None):
+    '''
+    plan([processes[, policy[, package]]]) -> [Placement, ...]
+    returns the processors planned for the workers of a pool
+
+    This is a placement plan rather than the assignment of each worker.
+    PinnedPool workers take the planned processors as they start, in no fixed
+    order, and worker_cpu() returns the one a worker actually runs on. A
+    worker finding none free within PIN_TIMEOUT runs unpinned with a
+    RuntimeWarning.
+
+    With the ``cores`` policy every worker gets a core of its own, on the
+    first logical processor of the core. With ``siblings-last`` the workers
+    fill the first logical processor of every core before any second one.
+    ``package`` restricts the workers to the cores of one package. There is
+    one worker per processor of the policy by default, and any more workers
+    are placed around the policy again.
+    raises ValueError for an unknown policy or package
+    '''
+    if policy not in POLICIES:
+        raise ValueError("unknown placement policy %r" % (policy,))
+    if topology is None:
+        topology = _topology()
+    if package is not None and package not in topology.packages():
+        raise ValueError("no package %r among the allowed processors" % (package,))
+    cores = topology.cores(package)
+    rounds = 1 if policy == 'cores' else max(len(topology.threads(core)) for core in cores)
+    order = []
+    for thread in range(rounds):
+        order.extend((topology.threads(core)[thread], core) for core in cores
+                     if thread < len(topology.threads(core)))
+    if processes is None:
+        processes = len(order)
+    if processes < 1:
+        raise ValueError("a pool needs at least one process")
+    placements = []
+    for worker in range(processes):
+        cpu, core = order[worker % len(order)]
+        placements.append(Placement(worker, cpu, core[0], core))
+    return placements
+
+
+def worker_cpu():
+    '''
+    worker_cpu() -> int
+    returns the processor the calling worker is pinned to, or None outside a
+    pinned worker
+    '''
+    return _cpu
+
+
+def _pin(cpus, initializer, initargs):
+    '''
+    Initialises a worker, pinning it to a processor taken from the queue
+    before calling the initializer of the pool.
+    '''
+    global _cpu
+    try:
+        _cpu = cpus.get(True, PIN_TIMEOUT)
+    except Queue.Empty:
+        _cpu = None
+        warnings.warn("no planned processor was free after %g seconds, running unpinned"
+                      % PIN_TIMEOUT, RuntimeWarning)
+    else:
+        set_affinity([_cpu])
+        # Runs when a worker retires after maxtasksperchild tasks, ahead of
+        # the finalizers flushing the queue.
+        multiprocessing.util.Finalize(None, cpus.put, args=(_cpu,), exitpriority=20)
+    if initializer is not None:
+        initializer(*initargs)
+
+
+class PinnedPool(multiprocessing.pool.Pool):
+    '''
+    A multiprocessing pool with each worker pinned to a processor chosen by
+    plan(), exposed as the ``plan`` attribute.
+    '''
+
+    def __init__(self, processes=None, policy='cores', package=None, initializer=None,
+                 initargs=(), maxtasksperchild=None, topology=None):
+        '''
+        :param processes: Number of workers, one per processor of the policy
+            when not given.
+        :type processes: int
+        :param policy: Placement policy, one of POLICIES.
+        :type policy: str
+        :param package: Package to restrict the workers to.
+        :type package: int
+        :param topology: Topology to place the workers by, that of the allowed
+            processors when not given.
+        :type topology: Topology
+        '''
+        self.plan = plan(processes, policy, package, topology)
+        cpus = multiprocessing.Queue()
+        for placement in self.plan:
+            cpus.put(placement.cpu)
+        multiprocessing.pool.Pool.__init__(self, len(self.plan), _pin,
+                                           (cpus, initializer, initargs), maxtasksperchild)
+
+
+class PartitionScheduler(object):
+    '''
+    Assigns partitions of a data set to the groups of logical processors
+    sharing a cache, and pins the threads consuming them.
+
+    Each domain takes a run of consecutive partitions in proportion to its
+    number of processors, so neighbouring partitions share a cache.
+    '''
+
+    def __init__(self, partitions, level=None, snapshots=None):
+        '''
+        :param partitions: Number of partitions.
+        :type partitions: int
+        :param level: Level of the cache to group the processors by, the last
+            level cache when not given.
+        :type level: int
+        :param snapshots: Snapshots of the processors, those of the allowed
+            processors when not given.
+        :type snapshots: dict
+        '''
+        if partitions < 1:
+            raise ValueError("there must be at least one partition")
+        self.domains = cache_domains(level, snapshots)
+        total = sum(len(cpus) for cpus in self.domains)
+        self.assignment = []
+        covered = 0
+        for index, cpus in enumerate(self.domains):
+            covered += len(cpus)
+            end = partitions * covered // total
+            self.assignment.extend([index] * (end - len(self.assignment)))
+
+    def domain(self, partition):
+        '''
+        domain(partition) -> (cpu, cpu, ...)
+        returns the processors sharing the cache a partition is assigned to
+        '''
+        return self.domains[self.assignment[partition]]
+
+    def partitions(self, domain):
+        '''
+        partitions(domain) -> [int, int, ...]
+        returns the partitions assigned to the domain at the given index
+        '''
+        return [partition for partition, index in enumerate(self.assignment) if index == domain]
+
+    def pin(self, partition):
+        '''
+        pin(partition) -> (cpu, cpu, ...)
+        restricts the calling thread to the processors of the partition's
+        domain and returns them
+        '''
+        cpus = self.domain(partition)
+        set_affinity(cpus)
+        return cpus
+
+    def map(self, function):
+        '''
+        map(function) -> [result, ...]
+        calls the function with each partition and returns the results in
+        partition order
+
+        Each domain runs no more threads than it has processors, pinned to
+        them once, which take the partitions assigned to the domain in turn.
+        The first exception raised by a call is raised again once every
+        thread has finished.
+        '''
+        results = [None] * len(self.assignment)
+        errors = []
+
+        def consume(cpus, partitions, first):
+            try:
+                set_affinity(cpus)
+            except Exception:
+                errors.append((first, sys.exc_info()))
+                return
+            while True:
+                try:
+                    partition = partitions.get_nowait()
+                except Queue.Empty:
+                    return
+                try:
+                    results[partition] = function(partition)
+                except Exception:
+                    errors.append((partition, sys.exc_info()))
+
+        threads = []
+        for index, cpus in enumerate(self.domains):
+            assigned = self.partitions(index)
+            partitions = Queue.Queue()
+            for partition in assigned:
+                partitions.put(partition)
+            for _ in range(min(len(cpus), len(assigned))):
+                threads.append(threading.Thread(target=consume,
+                                                args=(cpus, partitions, assigned[0])))
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        if errors:
+            partition, (kind, value, traceback) = min(errors)
+            raise kind, value, traceback
+        return results
+
+    def __repr__(self):
+        return '<%s: %d partitions over %d domains>' % (
+            self.__class__.__name__, len(self.assignment), len(self.domains))
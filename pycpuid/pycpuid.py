@@ -5,65 +5,878 @@
 # http://www.flightdataservices.com
 # See the file "LICENSE" for the full license governing this code.
 
-import sys
+import os
+import threading as _threading
+import time as _time
 import _pycpuid
 import struct as _struct
+import types as _types
+from collections import namedtuple as _namedtuple
 
 EXTENDED_OFFSET = 0x80000000
+HYPERVISOR_OFFSET = 0x40000000
 
+# Upper bound on the number of leaves read from each range, protecting against
+# hypervisors and broken BIOSes reporting nonsensical maximum leaves.
+_MAX_LEAVES = 0x100
 
-def cpuid(infotype):
+
+class Backend(object):
+    '''
+    A source of CPUID leaves.
+
+    Every snapshot, and so every accessor, reads its leaves through the backend
+    installed with set_backend(). Subclasses implement cpuid_many(), and may
+    override the other methods where they have something better to offer.
+    '''
+
+    #: Whether the leaves come from the processor running this process.
+    live = False
+
+    def cpuid(self, infotype, subleaf=0):
+        '''
+        cpuid(infotype[, subleaf]) -> (eax, ebx, ecx, edx)
+        '''
+        return _struct.unpack_from('=4I', self.cpuid_many([(infotype, subleaf)]))
+
+    def cpuid_many(self, requests, out=None, cpu=None):
+        '''
+        cpuid_many(requests[, out[, cpu]]) -> bytearray
+        returns the registers of every request, see :func:`cpuid_many`
+        '''
+        raise NotImplementedError
+
+    def xgetbv(self, xcr=0):
+        '''
+        xgetbv([xcr]) -> int
+        returns the value of an extended control register
+        '''
+        raise ValueError("the XCR cannot be read from this backend")
+
+    def cpus(self):
+        '''
+        cpus() -> [int, int, ...]
+        returns the logical processors whose leaves can be read
+        '''
+        return [0]
+
+
+class LiveBackend(Backend):
+    '''
+    Executes the CPUID instruction on the running processor.
+    '''
+
+    live = True
+
+    def cpuid(self, infotype, subleaf=0):
+        return _pycpuid.cpuid(infotype, subleaf)
+
+    def cpuid_many(self, requests, out=None, cpu=None):
+        return _pycpuid.cpuid_many(requests, out, -1 if cpu is None else cpu)
+
+    def xgetbv(self, xcr=0):
+        return _pycpuid.xgetbv(xcr)
+
+    def cpus(self):
+        return affinity()
+
+
+_backend = LiveBackend()
+
+
+def get_backend():
+    '''
+    get_backend() -> Backend
+    returns the backend the leaves are read from
+    '''
+    return _backend
+
+
+def set_backend(backend=None):
+    '''
+    set_backend([backend]) -> Backend
+    reads leaves from another backend, such as a recorded dump from
+    :mod:`pycpuid.backends`, or the running processor when None, and
+    refreshes the process-wide snapshot from it
+    returns the previous backend
+    '''
+    global _backend
+    previous = _backend
+    _backend = LiveBackend() if backend is None else backend
+    refresh()
+    return previous
+
+
+def cpuid(infotype, subleaf=0):
+    '''
+    cpuid(infotype[, subleaf]) -> (eax, ebx, ecx, edx)
+    '''
+    return _backend.cpuid(infotype, subleaf)
+
+
+def cpuid_many(requests, out=None, cpu=None):
+    '''
+    cpuid_many([(infotype, subleaf), ...]) -> bytearray
+    executes every request in a single call, returning the (eax, ebx, ecx, edx)
+    of each as consecutive native unsigned 32-bit words
+
+    Requests may also be given as a buffer of unsigned 32-bit (infotype,
+    subleaf) pairs.  The results are written into ``out`` instead when it is a
+    writable buffer large enough to hold them.  When ``cpu`` is given the
+    calling thread is pinned to that processor while the requests execute.
+    The GIL is released throughout.
+    '''
+    return _backend.cpuid_many(requests, out, cpu)
+
+
+def xgetbv(xcr=0):
+    '''
+    xgetbv([xcr]) -> int
+    returns the value of an extended control register, XCR0 by default
+    raises ValueError when the register cannot be read
+    '''
+    return _backend.xgetbv(xcr)
+
+
+def affinity():
+    '''
+    affinity() -> [int, int, ...]
+    returns the logical processors the calling thread may run on
+    '''
+    return _pycpuid.getaffinity()
+
+
+def set_affinity(cpus, process=False):
+    '''
+    set_affinity([int, int, ...][, process])
+    restricts the calling thread, or with ``process`` every thread of the
+    process, to the given logical processors
+
+    Threads started afterwards inherit the affinity of the thread starting
+    them.
+    '''
+    cpus = list(cpus)
+    if not process:
+        _pycpuid.setaffinity(cpus)
+        return
+    for task in os.listdir('/proc/self/task'):
+        try:
+            _pycpuid.setaffinity(cpus, int(task))
+        except OSError:
+            # The thread exited since the directory was listed.
+            pass
+
+
+def rdtsc():
+    '''
+    rdtsc() -> int
+    returns the time stamp counter of the running processor
+    '''
+    return _pycpuid.rdtsc()
+
+
+def rdtscp():
+    '''
+    rdtscp() -> (int, int)
+    returns the time stamp counter along with IA32_TSC_AUX, which Linux sets to
+    the number of the running processor, plus its NUMA node shifted left by 12
+    raises ValueError when the processor does not support RDTSCP
+    '''
+    return _pycpuid.rdtscp()
+
+
+def rdtsc_fill(buffer):
+    '''
+    rdtsc_fill(buffer) -> int
+    fills a writable buffer of unsigned 64-bit words, such as a ctypes array,
+    with back to back reads of the time stamp counter, returning their number
+    '''
+    return _pycpuid.rdtsc_fill(buffer)
+
+
+class Stats(object):
+    '''
+    Statistics of the CPUID instructions executed since they were enabled with
+    enable_stats() or last reset.
+
+    ``counts`` maps each (leaf, subleaf) to the number of times it executed,
+    ``histogram[i]`` holds the number of executions taking between ``2 ** i``
+    and ``2 ** (i + 1)`` time stamp counter ticks, and when frames are captured
+    ``callers`` maps the (filename, line, function) of the innermost caller
+    outside pycpuid to the number of executions it caused.
+    '''
+
+    def __init__(self, counts, histogram, callers):
+        '''
+        :param counts: Executions by (leaf, subleaf).
+        :type counts: dict
+        :param histogram: Executions by power of two of their latency in ticks.
+        :type histogram: list
+        :param callers: Executions by (filename, line, function) of the caller.
+        :type callers: dict
+        '''
+        self.counts = counts
+        self.histogram = histogram
+        self.callers = callers
+
+    @property
+    def total(self):
+        return sum(self.counts.values())
+
+    def top(self, n=10):
+        '''
+        top([n]) -> [((filename, line, function), count), ...]
+        returns the callers executing the most instructions, most first
+        '''
+        return sorted(self.callers.items(), key=lambda item: (-item[1], item[0]))[:n]
+
+    def percentile(self, fraction):
+        '''
+        percentile(fraction) -> int
+        returns an upper bound in ticks on the latency of the given fraction of
+        executions, or 0 when none were recorded
+        '''
+        remaining = fraction * sum(self.histogram)
+        for bucket, count in enumerate(self.histogram):
+            remaining -= count
+            if count and remaining <= 0:
+                return 2 << bucket
+        return 0
+
+    def reset(self):
+        '''
+        reset()
+        clears the process-wide statistics, leaving this record intact
+        '''
+        reset_stats()
+
+    def __repr__(self):
+        return '<%s: %d executions of %d leaves>' % (self.__class__.__name__, self.total, len(self.counts))
+
+
+def enable_stats(frames=False):
+    '''
+    enable_stats([frames])
+    starts counting and timing every CPUID instruction executed, and with
+    ``frames`` also which lines of Python called for them
+
+    Setting ``PYCPUID_STATS=1``, or ``PYCPUID_STATS=frames``, in the
+    environment enables them from import.
+    '''
+    _pycpuid.set_stats(True, frames)
+
+
+def disable_stats():
+    '''
+    disable_stats()
+    stops collecting statistics, keeping those collected so far
+    '''
+    _pycpuid.set_stats(False)
+
+
+def stats():
+    '''
+    stats() -> Stats
+    returns the statistics collected so far
+    '''
+    return Stats(*_pycpuid.stats())
+
+
+def reset_stats():
+    '''
+    reset_stats()
+    clears the statistics collected so far
+    '''
+    _pycpuid.reset_stats()
+
+
+if os.environ.get('PYCPUID_STATS'):
+    enable_stats(os.environ['PYCPUID_STATS'] == 'frames')
+
+
+# Leaves whose output depends on the subleaf in ECX, along with the rule used to
+# find their valid subleaves:
+#   'count' - subleaf 0 reports the highest valid subleaf in EAX.
+#   'eax'   - subleaves are valid until one reports a null type in EAX[4:0].
+#   'ecx'   - subleaves are valid until one reports a null level in ECX[15:8].
+#   'xsave' - subleaves 0 and 1, then one per state component in XCR0 | XSS.
+_subleaf_table = {
+    0x4: 'eax',
+    0x7: 'count',
+    0xb: 'ecx',
+    0xd: 'xsave',
+    0x14: 'count',
+    0x17: 'count',
+    0x18: 'count',
+    0x1d: 'count',
+    0x1f: 'ecx',
+    0x8000001d: 'eax',
+    }
+
+# Upper bound on the number of subleaves walked for each indexed leaf.
+_MAX_SUBLEAVES = 64
+
+
+def _walk(infotype, read):
+    '''
+    Walks the subleaves of an indexed leaf until the termination condition it
+    defines, using ``read(infotype, subleaves)`` to obtain their registers.
+
+    :returns: The valid subleaves.
+    :rtype: list
+    '''
+    rule = _subleaf_table[infotype]
+    if rule == 'count':
+        top = min(read(infotype, [0])[0][0], _MAX_SUBLEAVES - 1)
+        subleaves = range(top + 1)
+        read(infotype, subleaves)
+        return subleaves
+    if rule == 'xsave':
+        (a0, b0, c0, d0), (a1, b1, c1, d1) = read(infotype, [0, 1])
+        mask = a0 | d0 << 32 | c1 | d1 << 32
+        subleaves = [0, 1] + [k for k in xrange(2, _MAX_SUBLEAVES) if mask >> k & 1]
+        read(infotype, subleaves[2:])
+        return subleaves
+    reg, shift, mask = (0, 0, 0x1f) if rule == 'eax' else (2, 8, 0xff)
+    subleaves = []
+    for subleaf in xrange(_MAX_SUBLEAVES):
+        if not (read(infotype, [subleaf])[0][reg] >> shift) & mask:
+            break
+        subleaves.append(subleaf)
+    return subleaves
+
+
+def _ranges(read, bases):
+    '''
+    Lists the leaves following each base leaf up to the maximum it reports,
+    using ``read(infotype)`` to obtain the registers of the base leaves.
+    '''
+    leaves = []
+    for base in bases:
+        top = read(base)[0]
+        if base <= top < base + _MAX_LEAVES:
+            leaves.extend((leaf, 0) for leaf in xrange(base + 1, top + 1))
+    return leaves
+
+
+# Layout of the header of a serialised snapshot: magic, format version and the
+# number of leaves.
+SNAPSHOT_MAGIC = 'PYCPUIDS'
+SNAPSHOT_VERSION = 1
+_snapshot_header = _struct.Struct('<8sII')
+
+
+class Snapshot(object):
+    '''
+    An immutable record of every CPUID leaf supported by the processor.
+
+    Each standard, extended and hypervisor leaf, and every valid subleaf of the
+    indexed leaves, is executed exactly once when the snapshot is taken and the
+    registers are kept in a single compact array of unsigned 32-bit words.
+    Reading from a snapshot never executes the CPUID instruction again.
+
+    Snapshots serialise to a fixed little-endian layout: a header holding the
+    magic, format version and number of leaves, an index of sorted (leaf,
+    subleaf) pairs of 32-bit words, then the four register words of each leaf
+    in the same order.
+    '''
+
+    __slots__ = ('_index', '_regs', '_offset')
+
+    def __init__(self, index, regs, offset=0):
+        '''
+        :param index: Mapping of (leaf, subleaf) to row number in ``regs``, or
+            None when it is to be decoded from a serialised snapshot.
+        :type index: dict
+        :param regs: Buffer of unsigned 32-bit words, four per row.
+        :type regs: bytearray
+        :param offset: Offset in bytes of the first row in ``regs``.
+        :type offset: int
+        '''
+        self._index = index
+        self._regs = regs
+        self._offset = offset
+
+    @classmethod
+    def from_buffer(cls, buf, offset=0):
+        '''
+        Snapshot.from_buffer(buf[, offset]) -> Snapshot
+        loads a snapshot serialised by to_bytes() from any buffer, such as a
+        str, bytearray or mmap, without copying the registers
+
+        Only the header is checked up front; the index is decoded on first use.
+        raises ValueError when the buffer does not hold a snapshot
+        '''
+        try:
+            magic, version, count = _snapshot_header.unpack_from(buf, offset)
+        except _struct.error:
+            raise ValueError("buffer is too small to hold a snapshot")
+        if magic != SNAPSHOT_MAGIC:
+            raise ValueError("buffer does not hold a snapshot")
+        if version != SNAPSHOT_VERSION:
+            raise ValueError("unsupported snapshot version %d" % version)
+        if len(buf) - offset != _snapshot_header.size + 24 * count:
+            raise ValueError("snapshot size does not match its %d leaves" % count)
+        return cls(None, buf, offset + _snapshot_header.size + 8 * count)
+
+    def to_bytes(self):
+        '''
+        to_bytes() -> str
+        serialises the snapshot for storing or sending to another machine
+        '''
+        keys = self.leaves()
+        data = [_snapshot_header.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, len(keys))]
+        data.extend(_struct.pack('<2I', *key) for key in keys)
+        data.extend(_struct.pack('<4I', *self.cpuid(*key)) for key in keys)
+        return ''.join(data)
+
+    def _keys(self):
+        '''
+        Returns the index, decoding it from the serialised snapshot if needed.
+        '''
+        index = self._index
+        if index is None:
+            # The rows run to the end of the buffer, preceded by the pairs.
+            count = (len(self._regs) - self._offset) >> 4
+            start = self._offset - 8 * count
+            words = _struct.unpack_from('<%dI' % (2 * count), self._regs, start)
+            keys = zip(words[::2], words[1::2])
+            if any(a >= b for a, b in zip(keys, keys[1:])):
+                raise ValueError("snapshot index is not sorted")
+            index = self._index = dict((key, row) for row, key in enumerate(keys))
+        return index
+
+    @classmethod
+    def probe(cls, cpu=None):
+        '''
+        Snapshot.probe([cpu]) -> Snapshot
+        executes every supported leaf on the current processor, or on the given
+        logical processor by pinning the calling thread to it
+        '''
+        snapshot = cls({}, bytearray())
+        snapshot._fill(cpu)
+        return snapshot
+
+    def _extend(self, requests, cpu):
+        '''
+        Executes the requests not held yet, appending their registers.
+        '''
+        requests = [key for key in requests if key not in self._index]
+        if requests:
+            rows = len(self._index)
+            self._regs += cpuid_many(requests, cpu=cpu)
+            for row, key in enumerate(requests):
+                self._index[key] = rows + row
+
+    def _fill(self, cpu):
+        '''
+        Executes every supported leaf not held yet.
+        '''
+        index = self._index
+
+        def leaf(infotype):
+            return self._lookup(index, infotype, 0)
+
+        def read(infotype, subleaves):
+            self._extend([(infotype, subleaf) for subleaf in subleaves], cpu)
+            return [self._lookup(index, infotype, subleaf) for subleaf in subleaves]
+
+        self._extend([(0, 0), (1, 0), (EXTENDED_OFFSET, 0)], cpu)
+
+        # The hypervisor range only exists when the hypervisor present bit is
+        # set, otherwise these leaves return whatever the processor likes.
+        tail = _ranges(leaf, (0, EXTENDED_OFFSET))
+        if leaf(1)[2] & (1 << 31):
+            tail.append((HYPERVISOR_OFFSET, 0))
+        self._extend(tail, cpu)
+        if (HYPERVISOR_OFFSET, 0) in index:
+            self._extend(_ranges(leaf, (HYPERVISOR_OFFSET,)), cpu)
+
+        for infotype in sorted(_subleaf_table):
+            if (infotype, 0) in index:
+                _walk(infotype, read)
+
+    def _lookup(self, index, infotype, subleaf):
+        row = index.get((infotype, subleaf))
+        if row is None:
+            # Leaves that are not indexed ignore the subleaf entirely.
+            if not subleaf or infotype in _subleaf_table:
+                return (0, 0, 0, 0)
+            return self._lookup(index, infotype, 0)
+        return _struct.unpack_from('<4I', self._regs, self._offset + (row << 4))
+
+    def cpuid(self, infotype, subleaf=0):
+        '''
+        cpuid(infotype[, subleaf]) -> (eax, ebx, ecx, edx)
+        returns zeros for leaves not supported by the processor
+        '''
+        return self._lookup(self._keys(), infotype, subleaf)
+
+    def leaves(self):
+        '''
+        leaves() -> [(int, int), ...]
+        returns sorted sequence of (leaf, subleaf) pairs held by the snapshot
+        '''
+        return sorted(self._keys())
+
+    def __contains__(self, key):
+        if not isinstance(key, tuple):
+            key = (key, 0)
+        return key in self._keys()
+
+    def __len__(self):
+        return len(self._keys())
+
+    def __eq__(self, other):
+        if not isinstance(other, Snapshot):
+            return NotImplemented
+        return self.leaves() == other.leaves() and \
+            all(self.cpuid(*key) == other.cpuid(*key) for key in self._keys())
+
+    def __ne__(self, other):
+        result = self.__eq__(other)
+        return result if result is NotImplemented else not result
+
+    def __repr__(self):
+        return '<%s: %d leaves>' % (self.__class__.__name__, len(self))
+
+
+class LazySnapshot(Snapshot):
+    '''
+    A snapshot which executes each leaf, along with all its subleaves, the
+    first time it is read rather than all of them up front.
+
+    This suits processors where CPUID is expensive, as under hypervisors which
+    trap it, and programs which only read a few leaves. Enumerating the leaves,
+    comparing or serialising the snapshot executes every remaining leaf.
+    '''
+
+    __slots__ = ('_cpu', '_loaded', '_complete', '_lock')
+
+    def __init__(self, cpu=None):
+        '''
+        :param cpu: Logical processor to execute the leaves on, the current one
+            when not given.
+        :type cpu: int
+        '''
+        Snapshot.__init__(self, {}, bytearray())
+        self._cpu = cpu
+        self._loaded = set()
+        self._complete = False
+        self._lock = _threading.Lock()
+
+    def _load(self, infotype):
+        '''
+        Executes a leaf and its subleaves if the processor supports it.
+        '''
+        if infotype in self._loaded:
+            return
+        self._loaded.add(infotype)
+        base = infotype & 0xc0000000
+        if base not in (0, HYPERVISOR_OFFSET, EXTENDED_OFFSET):
+            return
+        if base == HYPERVISOR_OFFSET:
+            self._load(1)
+            if not self._lookup(self._index, 1, 0)[2] & (1 << 31):
+                return
+        if infotype != base:
+            self._load(base)
+            top = self._lookup(self._index, base, 0)[0]
+            if not base < infotype <= top < base + _MAX_LEAVES:
+                return
+        self._extend([(infotype, 0)], self._cpu)
+        if infotype in _subleaf_table:
+            def read(infotype, subleaves):
+                self._extend([(infotype, subleaf) for subleaf in subleaves], self._cpu)
+                return [self._lookup(self._index, infotype, subleaf) for subleaf in subleaves]
+            _walk(infotype, read)
+
+    def _keys(self):
+        if not self._complete:
+            with self._lock:
+                if not self._complete:
+                    self._fill(self._cpu)
+                    self._complete = True
+        return self._index
+
+    def cpuid(self, infotype, subleaf=0):
+        if self._complete:
+            return Snapshot.cpuid(self, infotype, subleaf)
+        with self._lock:
+            self._load(infotype)
+            return self._lookup(self._index, infotype, subleaf)
+
+
+_snapshot = None
+_cpu_snapshots = None
+_topology = None
+_features = None
+_xcr0 = None
+
+
+def probe_cost_ns(samples=32, rounds=3):
+    '''
+    probe_cost_ns([samples[, rounds]]) -> float
+    measures the cost in nanoseconds of executing a leaf through the backend,
+    taking the best of the given rounds of executions
+
+    Executing CPUID takes around a hundred nanoseconds on bare metal, but
+    hypervisors trap it and can take well over a microsecond. The measurement
+    executes ``samples * rounds`` leaves, so it is not used to choose how the
+    default snapshot is taken.
+    '''
+    requests = [0] * samples
+    best = None
+    for i in xrange(rounds):
+        start = _time.time()
+        cpuid_many(requests)
+        elapsed = _time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best * 1e9 / samples
+
+
+def _probe():
+    '''
+    Takes the process-wide snapshot eagerly or lazily as set by
+    ``PYCPUID_PROBE``, lazily when the hypervisor present bit is set unless it
+    is ``eager`` or ``lazy``.
     '''
-    cpuid(infotype) -> (eax, ebx, ecx, edx)
+    policy = os.environ.get('PYCPUID_PROBE', 'auto')
+    if policy not in ('auto', 'eager', 'lazy'):
+        raise ValueError("PYCPUID_PROBE must be auto, eager or lazy, not %r" % policy)
+    if policy == 'eager' or (policy == 'auto' and not _backend.live):
+        return Snapshot.probe()
+    snapshot = LazySnapshot()
+    if policy == 'lazy' or snapshot.cpuid(1)[2] & (1 << 31):
+        return snapshot
+    # On bare metal, complete the probe from the leaves already read for the
+    # hypervisor bit, so it executes no more leaves than an eager probe.
+    return Snapshot(snapshot._keys(), snapshot._regs)
+
+
+def default_snapshot():
+    '''
+    default_snapshot() -> Snapshot
+    returns the process-wide snapshot, taking it on first use
+
+    Under a hypervisor, which traps CPUID, the snapshot executes leaves as
+    they are first read, see :class:`LazySnapshot`, which ``PYCPUID_PROBE``
+    set to ``eager`` or ``lazy`` overrides. Setting ``PYCPUID_CACHE=1`` shares
+    the snapshot between processes through a file, see :mod:`pycpuid.persist`.
+    '''
+    global _snapshot
+    if _snapshot is None:
+        if os.environ.get('PYCPUID_CACHE') and _backend.live:
+            from persist import cached_snapshot
+            _snapshot = cached_snapshot()
+        else:
+            _snapshot = _probe()
+    return _snapshot
+
+
+def refresh():
+    '''
+    refresh() -> Snapshot
+    replaces the process-wide snapshot with a fresh one
     '''
-    return _pycpuid.cpuid(infotype)
+    global _snapshot, _cpu_snapshots, _topology, _features, _xcr0
+    _snapshot = _probe()
+    _cpu_snapshots = None
+    _topology = None
+    _features = None
+    _xcr0 = None
+    for dispatcher in _dispatchers:
+        dispatcher.reset()
+    return _snapshot
 
 
-def vendor():
-    a, b, c, d = cpuid(0)
+def cpu_snapshots():
+    '''
+    cpu_snapshots() -> {cpu: Snapshot, ...}
+    returns the process-wide snapshot of every logical processor, taking them
+    with dump_all_cpus() on first use
+    '''
+    global _cpu_snapshots
+    if _cpu_snapshots is None:
+        _cpu_snapshots = dump_all_cpus()
+    return _cpu_snapshots
+
+
+def dump_all_cpus(cpus=None, threads=None):
+    '''
+    dump_all_cpus() -> {cpu: Snapshot, ...}
+    takes a snapshot on every logical processor the process may run on, or
+    every one recorded by the backend
+
+    Each processor is probed from a pool of worker threads which pin themselves
+    to it for the duration, with the GIL released while the leaves execute.
+    '''
+    from multiprocessing.pool import ThreadPool
+    if cpus is None:
+        cpus = _backend.cpus()
+    cpus = list(cpus)
+    if not cpus:
+        return {}
+    pool = ThreadPool(threads or min(len(cpus), 32))
+    try:
+        snapshots = pool.map(Snapshot.probe, cpus)
+    finally:
+        pool.close()
+        pool.join()
+    return dict(zip(cpus, snapshots))
+
+
+def _leaf(infotype, snapshot=None, subleaf=0):
+    if snapshot is None:
+        snapshot = default_snapshot()
+    return snapshot.cpuid(infotype, subleaf)
+
+
+def subleaves(infotype, snapshot=None):
+    '''
+    subleaves(infotype) -> [(subleaf, (eax, ebx, ecx, edx)), ...]
+    returns every valid subleaf of an indexed leaf such as 0x4, 0x7, 0xB, 0xD
+    or 0x1F, stopping at the termination condition defined by the leaf
+    '''
+    if infotype not in _subleaf_table:
+        raise ValueError("leaf 0x%x does not have subleaves" % infotype)
+    if snapshot is None:
+        snapshot = default_snapshot()
+    read = lambda infotype, subleaves: [snapshot.cpuid(infotype, k) for k in subleaves]
+    return [(k, snapshot.cpuid(infotype, k)) for k in _walk(infotype, read)]
+
+
+def vendor(snapshot=None):
+    a, b, c, d = _leaf(0, snapshot)
     return _struct.pack("III", b, d, c)
 
 
-def stepping_id():
-    return cpuid(1)[0] & 0xf
+def stepping_id(snapshot=None):
+    return _leaf(1, snapshot)[0] & 0xf
 
 
-def model():
-    a = cpuid(1)[0]
+def model(snapshot=None):
+    a = _leaf(1, snapshot)[0]
     model_number = (a >> 4) & 0xf
     extended_model = (a >> 16) & 0xf
     return (extended_model << 4) + model_number
 
 
-def family():
-    a = cpuid(1)[0]
+def family(snapshot=None):
+    a = _leaf(1, snapshot)[0]
     family_code = (a >> 8) & 0xf
     extended_family = (a >> 20) & 0xff
     return extended_family + family_code
 
 
-def processor_type():
-    return (cpuid(1)[0] >> 12) & 0x3
+def processor_type(snapshot=None):
+    return (_leaf(1, snapshot)[0] >> 12) & 0x3
 
 
-def brand_id():
-    return cpuid(1)[1] & 0xff
+def brand_id(snapshot=None):
+    return _leaf(1, snapshot)[1] & 0xff
 
 
-def brand_string():
-    a = cpuid(EXTENDED_OFFSET)
+def brand_string(snapshot=None):
+    a = _leaf(EXTENDED_OFFSET, snapshot)[0]
     assert a >= (EXTENDED_OFFSET | 0x4), "brand string is not supported by this CPU"
-    s = ''.join([_struct.pack("IIII", *cpuid(EXTENDED_OFFSET | k)) for k in 0x2, 0x3, 0x4])
+    s = ''.join([_struct.pack("IIII", *_leaf(EXTENDED_OFFSET | k, snapshot)) for k in 0x2, 0x3, 0x4])
     return s[:s.index('\0')]
 
 
-def features():
+class Hypervisor(_namedtuple('Hypervisor', 'name signature max_leaf')):
+    '''
+    The hypervisor reported by leaf 0x40000000: its name, the raw vendor
+    signature and the highest leaf of the hypervisor range.
+    '''
+    __slots__ = ()
+
+
+# Names of the hypervisors by the vendor signature of leaf 0x40000000.
+_hypervisor_table = {
+    'KVMKVMKVM': 'KVM',
+    'Linux KVM Hv': 'KVM',
+    'Microsoft Hv': 'Hyper-V',
+    'XenVMMXenVMM': 'Xen',
+    'VMwareVMware': 'VMware',
+    'VBoxVBoxVBox': 'VirtualBox',
+    'TCGTCGTCGTCG': 'QEMU',
+    ' lrpepyh  vr': 'Parallels',
+    'bhyve bhyve ': 'bhyve',
+    'ACRNACRNACRN': 'ACRN',
+    'QNXQVMBSQG': 'QNX',
+    'HAXMHAXMHAXM': 'HAXM',
+    'Jailhouse': 'Jailhouse',
+    'EVMMEVMMEVMM': 'Intel KGT',
+    'UnisysSpar64': 'Unisys s-Par',
+    'SRESRESRESRE': 'Lockheed Martin LMHS',
+    'Apple VZ': 'Apple Virtualization',
+    }
+
+
+def hypervisor_present(snapshot=None):
+    '''
+    hypervisor_present() -> bool
+    returns whether the processor is virtualised, from the hypervisor present
+    bit of leaf 0x1
+    '''
+    return bool(_leaf(1, snapshot)[2] & (1 << 31))
+
+
+def hypervisor(snapshot=None):
+    '''
+    hypervisor() -> Hypervisor
+    returns the hypervisor running the processor, or None on bare metal
+
+    Hypervisors offering the interfaces of another, such as Xen or KVM
+    emulating Hyper-V, report the signature of the one they emulate.
+    '''
+    if not hypervisor_present(snapshot):
+        return None
+    a, b, c, d = _leaf(HYPERVISOR_OFFSET, snapshot)
+    signature = _struct.pack('III', b, c, d).rstrip('\0')
+    # Some hypervisors leave the maximum leaf as zero to mean 0x40000001.
+    max_leaf = a if a >= HYPERVISOR_OFFSET else HYPERVISOR_OFFSET | 0x1 if signature else 0
+    return Hypervisor(_hypervisor_table.get(signature, signature or None), signature, max_leaf)
+
+
+def perfmon_version(snapshot=None):
+    '''
+    perfmon_version() -> int
+    returns the version of architectural performance monitoring from leaf 0xA,
+    or 0 when the performance counters are not available, as under many
+    hypervisors
+    '''
+    if _leaf(0, snapshot)[0] < 0xa:
+        return 0
+    return _leaf(0xa, snapshot)[0] & 0xff
+
+
+def _requirements(requirements):
+    '''
+    Parses feature requirements given as names or strings like "AVX2 & FMA".
+    '''
+    result = set()
+    for requirement in requirements:
+        for key in requirement.split('&'):
+            key = key.strip().upper()
+            if key not in _feat_names:
+                raise ValueError("unknown feature %r" % key)
+            result.add(key)
+    return frozenset(result)
+
+
+def features(snapshot=None):
     '''
     features() -> [str, str, ...]
     returns sequence of available features
     '''
-    info = cpuid(1)
-    return [key for key, reg, bit in _feat_table if info[reg] & (1 << bit)]
+    global _features
+    if snapshot is not None:
+        return list(feature_set(snapshot))
+    if _features is None:
+        _features = list(feature_set())
+    return list(_features)
 
 _feat_table = [
     ("FPU", 3, 0),
@@ -104,34 +917,1311 @@ _feat_table = [
     ("SMX", 2, 6),
     ("EST", 2, 7),
     ("TM2", 2, 8),
-    ("SSE3", 2, 9),
+    ("SSSE3", 2, 9),
     ("CNXTID", 2, 10),
+    ("FMA", 2, 12),
     ("CX16", 2, 13),
     ("XTPR", 2, 14),
     ("PDCM", 2, 15),
+    ("PCID", 2, 17),
     ("DCA", 2, 18),
     ("SSE4_1", 2, 19),
     ("SSE4_2", 2, 20),
     ("X2APIC", 2, 21),
     ("MOVBE", 2, 22),
     ("POPCNT", 2, 23),
+    ("TSCDEADLINE", 2, 24),
     ("AES", 2, 25),
     ("XSAVE", 2, 26),
     ("OSXSAVE", 2, 27),
+    ("AVX", 2, 28),
+    ("F16C", 2, 29),
+    ("RDRAND", 2, 30),
+    ("HYPERVISOR", 2, 31),
     ]
 
+# Structured extended features, leaf 0x7 subleaf 0.
+_feat7_table = [
+    ("FSGSBASE", 1, 0),
+    ("SGX", 1, 2),
+    ("BMI1", 1, 3),
+    ("HLE", 1, 4),
+    ("AVX2", 1, 5),
+    ("SMEP", 1, 7),
+    ("BMI2", 1, 8),
+    ("ERMS", 1, 9),
+    ("INVPCID", 1, 10),
+    ("RTM", 1, 11),
+    ("MPX", 1, 14),
+    ("AVX512F", 1, 16),
+    ("AVX512DQ", 1, 17),
+    ("RDSEED", 1, 18),
+    ("ADX", 1, 19),
+    ("SMAP", 1, 20),
+    ("AVX512IFMA", 1, 21),
+    ("CLFLUSHOPT", 1, 23),
+    ("CLWB", 1, 24),
+    ("AVX512PF", 1, 26),
+    ("AVX512ER", 1, 27),
+    ("AVX512CD", 1, 28),
+    ("SHA", 1, 29),
+    ("AVX512BW", 1, 30),
+    ("AVX512VL", 1, 31),
+    ("PREFETCHWT1", 2, 0),
+    ("AVX512VBMI", 2, 1),
+    ("UMIP", 2, 2),
+    ("PKU", 2, 3),
+    ("OSPKE", 2, 4),
+    ("WAITPKG", 2, 5),
+    ("AVX512VBMI2", 2, 6),
+    ("CETSS", 2, 7),
+    ("GFNI", 2, 8),
+    ("VAES", 2, 9),
+    ("VPCLMULQDQ", 2, 10),
+    ("AVX512VNNI", 2, 11),
+    ("AVX512BITALG", 2, 12),
+    ("AVX512VPOPCNTDQ", 2, 14),
+    ("LA57", 2, 16),
+    ("RDPID", 2, 22),
+    ("CLDEMOTE", 2, 25),
+    ("MOVDIRI", 2, 27),
+    ("MOVDIR64B", 2, 28),
+    ("AVX5124VNNIW", 3, 2),
+    ("AVX5124FMAPS", 3, 3),
+    ("FSRM", 3, 4),
+    ("AVX512VP2INTERSECT", 3, 8),
+    ("MDCLEAR", 3, 10),
+    ("SERIALIZE", 3, 14),
+    ("HYBRID", 3, 15),
+    ("TSXLDTRK", 3, 16),
+    ("PCONFIG", 3, 18),
+    ("CETIBT", 3, 20),
+    ("AMXBF16", 3, 22),
+    ("AVX512FP16", 3, 23),
+    ("AMXTILE", 3, 24),
+    ("AMXINT8", 3, 25),
+    ]
 
-def _init():
-    if __name__ == '__main__':
-        mod = sys.modules['__main__']
+# Structured extended features, leaf 0x7 subleaf 1.
+_feat7_1_table = [
+    ("AVXVNNI", 0, 4),
+    ("AVX512BF16", 0, 5),
+    ("FZLRM", 0, 10),
+    ("FSRS", 0, 11),
+    ("FSRCS", 0, 12),
+    ("HRESET", 0, 22),
+    ("AVXIFMA", 0, 23),
+    ("LAM", 0, 26),
+    ]
+
+# Extended features, leaf 0x80000001.
+_feat_ext_table = [
+    ("LAHFSAHF", 2, 0),
+    ("CMPLEGACY", 2, 1),
+    ("SVM", 2, 2),
+    ("EXTAPIC", 2, 3),
+    ("CR8LEGACY", 2, 4),
+    ("LZCNT", 2, 5),
+    ("SSE4A", 2, 6),
+    ("MISALIGNSSE", 2, 7),
+    ("PREFETCHW", 2, 8),
+    ("OSVW", 2, 9),
+    ("IBS", 2, 10),
+    ("XOP", 2, 11),
+    ("SKINIT", 2, 12),
+    ("WDT", 2, 13),
+    ("LWP", 2, 15),
+    ("FMA4", 2, 16),
+    ("TCE", 2, 17),
+    ("TBM", 2, 21),
+    ("TOPOEXT", 2, 22),
+    ("PERFCTRCORE", 2, 23),
+    ("PERFCTRNB", 2, 24),
+    ("DBX", 2, 26),
+    ("PERFTSC", 2, 27),
+    ("PERFCTRL2I", 2, 28),
+    ("MONITORX", 2, 29),
+    ("SYSCALL", 3, 11),
+    ("NX", 3, 20),
+    ("MMXEXT", 3, 22),
+    ("FFXSR", 3, 25),
+    ("PDPE1GB", 3, 26),
+    ("RDTSCP", 3, 27),
+    ("LM", 3, 29),
+    ("3DNOWEXT", 3, 30),
+    ("3DNOW", 3, 31),
+    ]
+
+# Processor extended state features, leaf 0xD subleaf 1.
+_feat_xsave_table = [
+    ("XSAVEOPT", 0, 0),
+    ("XSAVEC", 0, 1),
+    ("XGETBV1", 0, 2),
+    ("XSAVES", 0, 3),
+    ("XFD", 0, 4),
+    ]
+
+# Every feature table along with the (leaf, subleaf) it decodes. Tables must
+# only ever be appended as their order fixes the bits of a FeatureSet.
+_feat_tables = [
+    ((1, 0), _feat_table),
+    ((7, 0), _feat7_table),
+    ((7, 1), _feat7_1_table),
+    ((EXTENDED_OFFSET | 0x1, 0), _feat_ext_table),
+    ((0xd, 1), _feat_xsave_table),
+    ]
+
+
+def _feat_positions():
+    '''
+    Numbers every feature by its table, register and bit: each table occupies
+    four 32-bit words of a FeatureSet, one per register.
+    '''
+    positions = {}
+    for i, (leaf, table) in enumerate(_feat_tables):
+        for key, reg, bit in table:
+            positions[key] = (i * 4 + reg) * 32 + bit
+    return positions
+
+_feat_bits = _feat_positions()
+_feat_names = frozenset(_feat_bits)
+_feat_mask = sum(1 << bit for bit in _feat_bits.values())
+_feat_order = sorted(_feat_bits, key=_feat_bits.get)
+
+
+class FeatureSet(object):
+    '''
+    An immutable set of processor features held as a single integer bitmask.
+
+    Supports the usual set algebra through ``&``, ``|``, ``-`` and ``^`` and
+    comparisons through ``<=``, ``>=``, ``<`` and ``>``, so checking a whole
+    set of requirements is one mask and compare:
+
+        required = FeatureSet(['AVX2', 'FMA'])
+        if required <= feature_set():
+            ...
+
+    The bits are stable across hosts and releases, so sets can be hashed,
+    pickled and compared between machines cheaply.
+    '''
+
+    __slots__ = ('_mask',)
+
+    def __init__(self, features=0):
+        '''
+        :param features: Names of features, strings like "AVX2 & FMA", or an
+            integer bitmask.
+        :type features: iterable or int
+        '''
+        if isinstance(features, (int, long)):
+            mask = features & _feat_mask
+        else:
+            if isinstance(features, basestring):
+                features = [features]
+            mask = 0
+            for key in _requirements(features):
+                mask |= 1 << _feat_bits[key]
+        self._mask = mask
+
+    @property
+    def mask(self):
+        return self._mask
+
+    def _coerce(self, other):
+        if isinstance(other, FeatureSet):
+            return other._mask
+        return FeatureSet(other)._mask
+
+    def __and__(self, other):
+        return FeatureSet(self._mask & self._coerce(other))
+
+    def __or__(self, other):
+        return FeatureSet(self._mask | self._coerce(other))
+
+    def __sub__(self, other):
+        return FeatureSet(self._mask & ~self._coerce(other))
+
+    def __xor__(self, other):
+        return FeatureSet(self._mask ^ self._coerce(other))
+
+    __rand__ = __and__
+    __ror__ = __or__
+    __rxor__ = __xor__
+
+    def __le__(self, other):
+        return self._mask & ~self._coerce(other) == 0
+
+    def __ge__(self, other):
+        return self._coerce(other) & ~self._mask == 0
+
+    def __lt__(self, other):
+        return self <= other and self._mask != self._coerce(other)
+
+    def __gt__(self, other):
+        return self >= other and self._mask != self._coerce(other)
+
+    def __eq__(self, other):
+        if not isinstance(other, FeatureSet):
+            return NotImplemented
+        return self._mask == other._mask
+
+    def __ne__(self, other):
+        if not isinstance(other, FeatureSet):
+            return NotImplemented
+        return self._mask != other._mask
+
+    def __hash__(self):
+        return hash(self._mask)
+
+    def __contains__(self, key):
+        bit = _feat_bits.get(key)
+        return bit is not None and (self._mask >> bit) & 1 == 1
+
+    def __iter__(self):
+        return (key for key in _feat_order if (self._mask >> _feat_bits[key]) & 1)
+
+    def __len__(self):
+        return bin(self._mask).count('1')
+
+    def __nonzero__(self):
+        return self._mask != 0
+
+    def __reduce__(self):
+        return (FeatureSet, (self._mask,))
+
+    def __repr__(self):
+        return '%s([%s])' % (self.__class__.__name__, ', '.join(repr(key) for key in self))
+
+
+def feature_set(snapshot=None):
+    '''
+    feature_set() -> FeatureSet
+    returns the available features as a bitmask
+    '''
+    mask = 0
+    for i, ((infotype, subleaf), table) in enumerate(_feat_tables):
+        for reg, value in enumerate(_leaf(infotype, snapshot, subleaf)):
+            mask |= value << (i * 4 + reg) * 32
+    return FeatureSet(mask)
+
+
+# State components of XCR0.
+XSTATE_X87 = 1 << 0
+XSTATE_SSE = 1 << 1
+XSTATE_AVX = 1 << 2
+XSTATE_OPMASK = 1 << 5
+XSTATE_ZMM_HI256 = 1 << 6
+XSTATE_HI16_ZMM = 1 << 7
+XSTATE_TILECFG = 1 << 17
+XSTATE_TILEDATA = 1 << 18
+
+# Features whose registers are only usable when the OS saves the given state
+# components in XCR0.
+_xstate_table = [
+    (XSTATE_SSE | XSTATE_AVX,
+     FeatureSet(['AVX', 'AVX2', 'FMA', 'F16C', 'VAES', 'VPCLMULQDQ', 'AVXVNNI',
+                 'AVXIFMA', 'FMA4', 'XOP']) |
+     FeatureSet([key for key in _feat_names if key.startswith('AVX512')])),
+    (XSTATE_OPMASK | XSTATE_ZMM_HI256 | XSTATE_HI16_ZMM,
+     FeatureSet([key for key in _feat_names if key.startswith('AVX512')])),
+    (XSTATE_TILECFG | XSTATE_TILEDATA,
+     FeatureSet(['AMXTILE', 'AMXINT8', 'AMXBF16'])),
+    ]
+
+
+def _enabled_xstate(snapshot):
+    '''
+    Reads XCR0 of the running process, or zero when XGETBV is not enabled.
+    '''
+    global _xcr0
+    if 'OSXSAVE' not in feature_set(snapshot):
+        return 0
+    if _xcr0 is None:
+        _xcr0 = xgetbv(0)
+    return _xcr0
+
+
+def usable_features(snapshot=None, xcr0=None):
+    '''
+    usable_features() -> FeatureSet
+    returns the available features whose register state is also enabled by
+    the OS, which are the only ones safe to execute
+
+    The live XCR0 is used unless one is given, as recorded snapshots hold none.
+    '''
+    available = feature_set(snapshot)
+    if xcr0 is None:
+        xcr0 = _enabled_xstate(snapshot)
+    for components, dependent in _xstate_table:
+        if xcr0 & components != components:
+            available -= dependent
+    return available
+
+
+def usable_avx(snapshot=None, xcr0=None):
+    '''
+    usable_avx() -> bool
+    returns whether AVX is supported and the OS saves the YMM registers
+    '''
+    return 'AVX' in usable_features(snapshot, xcr0)
+
+
+def usable_avx512(snapshot=None, xcr0=None):
+    '''
+    usable_avx512() -> bool
+    returns whether AVX-512 is supported and the OS saves the opmask and ZMM
+    registers
+    '''
+    return 'AVX512F' in usable_features(snapshot, xcr0)
+
+
+def usable_amx(snapshot=None, xcr0=None):
+    '''
+    usable_amx() -> bool
+    returns whether AMX is supported and the OS saves the tile registers
+
+    Linux only hands out the tile data state to processes asking for it, so
+    for the live process this also needs the permission of request_amx().
+    '''
+    if 'AMXTILE' not in usable_features(snapshot, xcr0):
+        return False
+    if xcr0 is None and _backend.live and 'XFD' in feature_set(snapshot):
+        try:
+            permitted = _pycpuid.xcomp_perm()
+        except (OSError, NotImplementedError):
+            return False
+        return permitted & XSTATE_TILEDATA != 0
+    return True
+
+
+def request_amx():
+    '''
+    request_amx() -> bool
+    asks Linux for permission to use the tile data state for the rest of the
+    life of the process, returning whether AMX is then usable
+    '''
+    if 'AMXTILE' not in usable_features():
+        return False
+    if _backend.live and 'XFD' in feature_set():
+        try:
+            _pycpuid.request_xcomp_perm(18)
+        except (OSError, NotImplementedError):
+            return False
+    return usable_amx()
+
+
+# Features added by each x86-64 microarchitecture level over the one below, as
+# defined by the x86-64 psABI. The vector levels also need the OS to manage the
+# extended register state, so they are checked against the usable features.
+_microarch_table = [
+    (1, FeatureSet('CMOV & CX8 & FPU & FXSR & MMX & SYSCALL & SSE & SSE2')),
+    (2, FeatureSet('CX16 & LAHFSAHF & POPCNT & SSE3 & SSE4_1 & SSE4_2 & SSSE3')),
+    (3, FeatureSet('AVX & AVX2 & BMI1 & BMI2 & F16C & FMA & LZCNT & MOVBE & OSXSAVE')),
+    (4, FeatureSet('AVX512F & AVX512BW & AVX512CD & AVX512DQ & AVX512VL')),
+    ]
+
+
+def _microarch_requirements(level):
+    required = FeatureSet()
+    for number, added in _microarch_table:
+        if number <= level:
+            required |= added
+    return required
+
+
+def microarch_level(snapshot=None, xcr0=None):
+    '''
+    microarch_level() -> int
+    returns the highest x86-64 microarchitecture level (1 to 4 for x86-64 to
+    x86-64-v4) fully supported by the processor and OS, or 0 for none
+    '''
+    available = usable_features(snapshot, xcr0)
+    level = 0
+    for number, added in _microarch_table:
+        if not added <= available:
+            break
+        level = number
+    return level
+
+
+def microarch_missing(level=None, snapshot=None, xcr0=None):
+    '''
+    microarch_missing([level]) -> FeatureSet
+    returns the features missing or not enabled by the OS for a
+    microarchitecture level, by default the one above the level supported
+    '''
+    if level is None:
+        level = microarch_level(snapshot, xcr0) + 1
+    return _microarch_requirements(level) - usable_features(snapshot, xcr0)
+
+
+def microarch_select(choices, snapshot=None, xcr0=None):
+    '''
+    microarch_select({level: value, ...}) -> value
+    returns the value for the highest level supported, such as the path of the
+    fastest binary to exec, or None when no level is supported
+    '''
+    level = microarch_level(snapshot, xcr0)
+    supported = [number for number in choices if number <= level]
+    if not supported:
+        return None
+    return choices[max(supported)]
+
+
+class Cache(_namedtuple('Cache', 'level type size line_size ways partitions sets sharing inclusive')):
+    '''
+    Deterministic parameters of a cache. Sizes are in bytes, ``ways`` is zero
+    for fully associative caches and ``sharing`` is the maximum number of
+    logical processors sharing the cache, or None when it is not reported.
+    '''
+
+    __slots__ = ()
+
+_cache_types = {1: 'data', 2: 'instruction', 3: 'unified'}
+
+# Associativity encoding of the AMD L2 and L3 cache leaf, zero meaning fully
+# associative.
+_amd_ways = {1: 1, 2: 2, 3: 3, 4: 4, 5: 6, 6: 8, 8: 16, 0xa: 32, 0xb: 48,
+             0xc: 64, 0xd: 96, 0xe: 128, 0xf: 0}
+
+
+def _amd(snapshot):
+    return vendor(snapshot) in ('AuthenticAMD', 'HygonGenuine')
+
+
+def caches(snapshot=None):
+    '''
+    caches() -> [Cache, Cache, ...]
+    returns the caches of the processor from leaf 0x4 on Intel, or 0x8000001D
+    on AMD, ordered by level
+    '''
+    amd = _amd(snapshot)
+    if amd and _leaf(EXTENDED_OFFSET | 0x1, snapshot)[2] & (1 << 22):
+        infotype = EXTENDED_OFFSET | 0x1d
+    elif not amd and _leaf(0, snapshot)[0] >= 4:
+        infotype = 4
     else:
-        mod = sys.modules['pycpuid']
-    info = cpuid(0)
-    for key, reg, bit in _feat_table:
-        has_feat = (info[reg] & (1 << bit)) != 0
-        mod.__dict__['HAS_' + key] = has_feat
+        return _amd_caches(snapshot)
+
+    result = []
+    for subleaf, (a, b, c, d) in subleaves(infotype, snapshot):
+        line_size = (b & 0xfff) + 1
+        partitions = ((b >> 12) & 0x3ff) + 1
+        ways = ((b >> 22) & 0x3ff) + 1
+        sets = c + 1
+        result.append(Cache(level=(a >> 5) & 0x7,
+                            type=_cache_types.get(a & 0x1f, 'unknown'),
+                            size=ways * partitions * line_size * sets,
+                            line_size=line_size,
+                            ways=0 if a & (1 << 9) else ways,
+                            partitions=partitions,
+                            sets=sets,
+                            sharing=((a >> 14) & 0xfff) + 1,
+                            inclusive=bool(d & 0x2)))
+    return sorted(result, key=lambda cache: (cache.level, cache.type))
+
+
+def _amd_caches(snapshot):
+    '''
+    Decodes the legacy AMD L1 (0x80000005) and L2/L3 (0x80000006) cache leaves.
+    '''
+    result = []
+    top = _leaf(EXTENDED_OFFSET, snapshot)[0]
+    if top >= EXTENDED_OFFSET | 0x5:
+        c, d = _leaf(EXTENDED_OFFSET | 0x5, snapshot)[2:]
+        for kind, reg in ('data', c), ('instruction', d):
+            if reg >> 24:
+                ways = (reg >> 16) & 0xff
+                result.append(Cache(1, kind, (reg >> 24) << 10, reg & 0xff,
+                                    0 if ways == 0xff else ways, 1, None, None, False))
+    if top >= EXTENDED_OFFSET | 0x6:
+        c, d = _leaf(EXTENDED_OFFSET | 0x6, snapshot)[2:]
+        for level, size, reg in (2, (c >> 16) << 10, c), (3, (d >> 18) << 19, d):
+            if size and (reg >> 12) & 0xf:
+                result.append(Cache(level, 'unified', size, reg & 0xff,
+                                    _amd_ways.get((reg >> 12) & 0xf, 0), 1, None, None, False))
+    for i, cache in enumerate(result):
+        if cache.line_size and cache.ways:
+            result[i] = cache._replace(sets=cache.size // (cache.line_size * cache.ways))
+    return result
+
+
+def recommended_block_bytes(level=2, fraction=0.5, per_thread=False, snapshot=None):
+    '''
+    recommended_block_bytes([level[, fraction]]) -> int
+    returns the size of a working set occupying the given fraction of the data
+    cache at a level, rounded down to whole cache lines
+
+    With ``per_thread`` the cache is divided between every logical processor
+    sharing it, for sizing blocks when all of them are busy.
+    '''
+    for cache in caches(snapshot):
+        if cache.level == level and cache.type in ('data', 'unified'):
+            break
+    else:
+        raise ValueError("no level %d data cache was found" % level)
+    size = cache.size * fraction
+    if per_thread and cache.sharing:
+        size /= cache.sharing
+    return max(int(size) // cache.line_size, 1) * cache.line_size
+
+
+def recommended_block_items(itemsize, level=2, fraction=0.5, per_thread=False, snapshot=None):
+    '''
+    recommended_block_items(itemsize[, level[, fraction]]) -> int
+    returns the number of items of the given size in the working set suggested
+    by recommended_block_bytes()
+    '''
+    return max(recommended_block_bytes(level, fraction, per_thread, snapshot) // itemsize, 1)
+
+
+# Line size assumed when the processor reports none, that of every current x86
+# processor.
+DEFAULT_LINE_SIZE = 64
+
+
+def cache_line_size(snapshot=None):
+    '''
+    cache_line_size() -> int
+    returns the line size in bytes flushed by CLFLUSH from leaf 0x1, falling
+    back to the line size of the L1 data cache, or DEFAULT_LINE_SIZE
+    '''
+    if 'CLFLSH' in feature_set(snapshot):
+        size = ((_leaf(1, snapshot)[1] >> 8) & 0xff) * 8
+        if size:
+            return size
+    for cache in caches(snapshot):
+        if cache.level == 1 and cache.type in ('data', 'unified') and cache.line_size:
+            return cache.line_size
+    return DEFAULT_LINE_SIZE
+
+
+def cache_domain(level=None, snapshot=None):
+    '''
+    cache_domain([level]) -> int
+    returns an ID shared by every logical processor sharing the data cache at
+    the given level, or the last level cache, with the processor
+
+    Processors share a cache when their APIC IDs agree above the bits needed
+    to number the processors sharing it, as reported by leaf 0x4 or
+    0x8000001D. Returns None when the sharing is not reported.
+    '''
+    found = [cache for cache in caches(snapshot)
+             if cache.type in ('data', 'unified') and level in (None, cache.level)]
+    if not found or found[-1].sharing is None:
+        return None
+    return apic_id(snapshot) >> (found[-1].sharing - 1).bit_length()
+
+
+def cache_domains(level=None, snapshots=None):
+    '''
+    cache_domains([level]) -> [(cpu, cpu, ...), ...]
+    groups the logical processors by the data cache they share at the given
+    level, or the last level cache, such as the L3 of each AMD CCX, decoded
+    from the snapshot of every processor when none are given
+
+    Processors whose sharing is not reported are grouped by package.
+    '''
+    if snapshots is None:
+        snapshots = cpu_snapshots()
+    packages = Topology.from_snapshots(snapshots)
+    domains = {}
+    for cpu in sorted(snapshots):
+        domain = cache_domain(level, snapshots[cpu])
+        if domain is None:
+            domain = ('package', packages.package(cpu))
+        domains.setdefault(domain, []).append(cpu)
+    return sorted(tuple(cpus) for cpus in domains.values())
+
+
+class Tlb(_namedtuple('Tlb', 'level type page_sizes entries ways')):
+    '''
+    A translation lookaside buffer. ``page_sizes`` holds the sizes in bytes of
+    the pages it translates, sharing its entries, and ``ways`` is zero for
+    fully associative TLBs or None when not reported.
+    '''
+
+    __slots__ = ()
+
+_4K, _2M, _4M, _1G = 4 << 10, 2 << 20, 4 << 20, 1 << 30
+
+# TLBs described by the descriptor bytes of leaf 0x2, as (level, type, page
+# sizes, entries, ways). Descriptors of caches and prefetching are absent.
+_tlb_descriptors = {
+    0x01: [(1, 'instruction', (_4K,), 32, 4)],
+    0x02: [(1, 'instruction', (_4M,), 2, 0)],
+    0x03: [(1, 'data', (_4K,), 64, 4)],
+    0x04: [(1, 'data', (_4M,), 8, 4)],
+    0x05: [(2, 'data', (_4M,), 32, 4)],
+    0x0b: [(1, 'instruction', (_4M,), 4, 4)],
+    0x4f: [(1, 'instruction', (_4K,), 32, None)],
+    0x50: [(1, 'instruction', (_4K, _2M, _4M), 64, None)],
+    0x51: [(1, 'instruction', (_4K, _2M, _4M), 128, None)],
+    0x52: [(1, 'instruction', (_4K, _2M, _4M), 256, None)],
+    0x55: [(1, 'instruction', (_2M, _4M), 7, 0)],
+    0x56: [(1, 'data', (_4M,), 16, 4)],
+    0x57: [(1, 'data', (_4K,), 16, 4)],
+    0x59: [(1, 'data', (_4K,), 16, 0)],
+    0x5a: [(1, 'data', (_2M, _4M), 32, 4)],
+    0x5b: [(1, 'data', (_4K, _4M), 64, None)],
+    0x5c: [(1, 'data', (_4K, _4M), 128, None)],
+    0x5d: [(1, 'data', (_4K, _4M), 256, None)],
+    0x61: [(1, 'instruction', (_4K,), 48, 0)],
+    0x63: [(1, 'data', (_2M, _4M), 32, 4), (1, 'data', (_1G,), 4, 4)],
+    0x64: [(1, 'data', (_4K,), 512, 4)],
+    0x6a: [(1, 'data', (_4K,), 64, 8)],
+    0x6b: [(1, 'data', (_4K,), 256, 8)],
+    0x6c: [(1, 'data', (_2M, _4M), 128, 8)],
+    0x6d: [(1, 'data', (_1G,), 16, 0)],
+    0x76: [(1, 'instruction', (_2M, _4M), 8, 0)],
+    0xa0: [(1, 'data', (_4K,), 32, 0)],
+    0xb0: [(1, 'instruction', (_4K,), 128, 4)],
+    0xb1: [(1, 'instruction', (_2M, _4M), 8, 4)],
+    0xb2: [(1, 'instruction', (_4K,), 64, 4)],
+    0xb3: [(1, 'data', (_4K,), 128, 4)],
+    0xb4: [(2, 'data', (_4K,), 256, 4)],
+    0xb5: [(1, 'instruction', (_4K,), 64, 8)],
+    0xb6: [(1, 'instruction', (_4K,), 128, 8)],
+    0xba: [(2, 'data', (_4K,), 64, 4)],
+    0xc0: [(1, 'data', (_4K, _4M), 8, 4)],
+    0xc1: [(2, 'unified', (_4K, _2M), 1024, 8)],
+    0xc2: [(1, 'data', (_4K, _2M), 16, 4)],
+    0xc3: [(2, 'unified', (_4K, _2M), 1536, 6), (2, 'unified', (_1G,), 16, 4)],
+    0xc4: [(1, 'data', (_2M, _4M), 32, 4)],
+    0xca: [(2, 'unified', (_4K,), 512, 4)],
+    }
+
+# Descriptor of leaf 0x2 deferring to the deterministic leaf 0x18.
+_TLB_LEAF_DESCRIPTOR = 0xfe
+
+_tlb_types = {1: 'data', 2: 'instruction', 3: 'unified', 4: 'load', 5: 'store'}
+
+
+def _descriptors(snapshot):
+    '''
+    Lists the descriptor bytes of leaf 0x2, skipping registers flagged invalid
+    and the iteration count in AL.
+    '''
+    descriptors = []
+    for i, reg in enumerate(_leaf(2, snapshot)):
+        if not reg & (1 << 31):
+            shifts = (8, 16, 24) if i == 0 else (0, 8, 16, 24)
+            descriptors.extend((reg >> shift) & 0xff for shift in shifts)
+    return [descriptor for descriptor in descriptors if descriptor]
+
+
+def _deterministic_tlbs(snapshot):
+    '''
+    Decodes the deterministic address translation parameters of leaf 0x18.
+    '''
+    result = []
+    for subleaf, (a, b, c, d) in subleaves(0x18, snapshot):
+        kind = d & 0x1f
+        if not kind:
+            continue
+        page_sizes = tuple(size for bit, size in enumerate((_4K, _2M, _4M, _1G)) if b & (1 << bit))
+        ways = b >> 16
+        result.append(Tlb((d >> 5) & 0x7, _tlb_types.get(kind, 'unknown'), page_sizes,
+                          ways * c, 0 if d & (1 << 8) else ways))
+    return result
+
+
+def _amd_tlbs(snapshot):
+    '''
+    Decodes the AMD L1 (0x80000005), L2 (0x80000006) and 1 GB page
+    (0x80000019) TLB leaves.
+    '''
+    result = []
+    top = _leaf(EXTENDED_OFFSET, snapshot)[0]
+    if top >= EXTENDED_OFFSET | 0x5:
+        a, b = _leaf(EXTENDED_OFFSET | 0x5, snapshot)[:2]
+        for page_sizes, reg in ((_2M, _4M), a), ((_4K,), b):
+            for kind, half in ('data', reg >> 16), ('instruction', reg & 0xffff):
+                ways = half >> 8
+                result.append(Tlb(1, kind, page_sizes, half & 0xff, 0 if ways == 0xff else ways))
+    leaves = []
+    if top >= EXTENDED_OFFSET | 0x6:
+        a, b = _leaf(EXTENDED_OFFSET | 0x6, snapshot)[:2]
+        leaves.extend([(2, (_2M, _4M), a), (2, (_4K,), b)])
+    if top >= EXTENDED_OFFSET | 0x19:
+        a, b = _leaf(EXTENDED_OFFSET | 0x19, snapshot)[:2]
+        leaves.extend([(1, (_1G,), a), (2, (_1G,), b)])
+    for level, page_sizes, reg in leaves:
+        for kind, half in ('data', reg >> 16), ('instruction', reg & 0xffff):
+            ways = half >> 12
+            if ways:
+                result.append(Tlb(level, kind, page_sizes, half & 0xfff, _amd_ways.get(ways, 0)))
+    return [tlb for tlb in result if tlb.entries]
+
+
+def tlbs(snapshot=None):
+    '''
+    tlbs() -> [Tlb, Tlb, ...]
+    returns the TLBs of the processor from the descriptors of leaf 0x2 or
+    leaf 0x18 on Intel, or leaves 0x80000005, 0x80000006 and 0x80000019 on
+    AMD, ordered by level
+    '''
+    if _amd(snapshot):
+        result = _amd_tlbs(snapshot)
+    elif _leaf(0, snapshot)[0] >= 2:
+        descriptors = _descriptors(snapshot)
+        result = []
+        for descriptor in descriptors:
+            result.extend(Tlb(*tlb) for tlb in _tlb_descriptors.get(descriptor, ()))
+        if _TLB_LEAF_DESCRIPTOR in descriptors and _leaf(0, snapshot)[0] >= 0x18:
+            result.extend(_deterministic_tlbs(snapshot))
+    else:
+        result = []
+    return sorted(result, key=lambda tlb: (tlb.level, tlb.type))
+
+
+def page_sizes(snapshot=None):
+    '''
+    page_sizes() -> [int, int, ...]
+    returns the page sizes in bytes the processor can map, 4 KB, 2 MB and,
+    with PDPE1GB, 1 GB
+    '''
+    sizes = [_4K, _2M]
+    if 'PDPE1GB' in feature_set(snapshot):
+        sizes.append(_1G)
+    return sizes
+
+
+def tlb_reach(page_size, snapshot=None):
+    '''
+    tlb_reach(page_size) -> int
+    returns the bytes of memory the largest data TLB holding pages of the
+    given size can translate without a page walk, or zero when no TLB is
+    reported for it
+    '''
+    entries = [tlb.entries for tlb in tlbs(snapshot)
+               if tlb.type != 'instruction' and page_size in tlb.page_sizes]
+    return max(entries or [0]) * page_size
+
+
+class PageAdvice(_namedtuple('PageAdvice', 'page_size strategy reach options')):
+    '''
+    The page size recommended for a working set, with the ``strategy`` for
+    getting it from Linux and the TLB ``reach`` it gives. ``options`` maps
+    every page size the processor can map to its TLB reach.
+    '''
+
+    __slots__ = ()
+
+# How to back memory with each page size on Linux: no action for normal pages,
+# madvise(MADV_HUGEPAGE) for transparent huge pages, and mmap(MAP_HUGETLB |
+# MAP_HUGE_1GB) from pages reserved at boot, as transparent huge pages are
+# never larger than 2 MB.
+_page_strategies = {
+    _4K: 'MADV_NORMAL',
+    _2M: 'MADV_HUGEPAGE',
+    _1G: 'MAP_HUGETLB|MAP_HUGE_1GB',
+    }
+
+
+def page_advice(working_set, snapshot=None):
+    '''
+    page_advice(working_set) -> PageAdvice
+    recommends the smallest page size whose TLB reach covers a working set of
+    the given number of bytes, or the page size with the most reach when none
+    covers it
+
+    When the processor reports no TLBs, as under some hypervisors, 2 MB pages
+    are recommended for working sets of at least 2 MB.
+    '''
+    options = dict((size, tlb_reach(size, snapshot)) for size in page_sizes(snapshot))
+    if not any(options.values()):
+        size = _2M if working_set >= _2M else _4K
+        return PageAdvice(size, _page_strategies[size], 0, options)
+    for size in sorted(options):
+        if options[size] >= working_set:
+            break
+    else:
+        size = max(sorted(options), key=options.get)
+    return PageAdvice(size, _page_strategies[size], options[size], options)
+
+
+# Crystal clock frequency in Hz of Intel processors which report a zero
+# frequency in leaf 0x15, by (family, model).
+_crystal_table = {
+    (6, 0x4e): 24000000,  # Skylake mobile
+    (6, 0x5e): 24000000,  # Skylake desktop
+    (6, 0x8e): 24000000,  # Kaby Lake mobile
+    (6, 0x9e): 24000000,  # Kaby Lake desktop
+    (6, 0x5c): 19200000,  # Goldmont
+    (6, 0x5f): 25000000,  # Denverton
+    }
+
+
+def invariant_tsc(snapshot=None):
+    '''
+    invariant_tsc() -> bool
+    returns whether the time stamp counter runs at a constant rate in every
+    power state, so ticks can be converted to time
+    '''
+    if _leaf(EXTENDED_OFFSET, snapshot)[0] < EXTENDED_OFFSET | 0x7:
+        return False
+    return bool(_leaf(EXTENDED_OFFSET | 0x7, snapshot)[3] & (1 << 8))
+
+
+def tsc_frequency(snapshot=None):
+    '''
+    tsc_frequency() -> int
+    returns the nominal frequency of the time stamp counter in Hz, or None when
+    the processor does not report it
+
+    Leaf 0x15 gives the ratio to the crystal clock, leaf 0x40000010 the
+    frequency set by a hypervisor and leaf 0x16 the base frequency, which the
+    counter runs at on processors lacking the others.
+    '''
+    top = _leaf(0, snapshot)[0]
+    if top >= 0x15:
+        denominator, numerator, crystal = _leaf(0x15, snapshot)[:3]
+        if not crystal:
+            crystal = _crystal_table.get((family(snapshot), model(snapshot)), 0)
+        if not crystal and top >= 0x16 and numerator:
+            crystal = (_leaf(0x16, snapshot)[0] & 0xffff) * 1000000 * denominator // numerator
+        if denominator and numerator and crystal:
+            return crystal * numerator // denominator
+    if _leaf(HYPERVISOR_OFFSET, snapshot)[0] >= HYPERVISOR_OFFSET | 0x10:
+        khz = _leaf(HYPERVISOR_OFFSET | 0x10, snapshot)[0]
+        if khz:
+            return khz * 1000
+    if top >= 0x16:
+        mhz = _leaf(0x16, snapshot)[0] & 0xffff
+        if mhz:
+            return mhz * 1000000
+    return None
+
+
+# Level types reported in ECX[15:8] of the extended topology leaves.
+_level_table = {
+    1: 'SMT',
+    2: 'Core',
+    3: 'Module',
+    4: 'Tile',
+    5: 'Die',
+    6: 'DieGrp',
+    }
+
+
+def _ceil_log2(n):
+    return (max(n, 1) - 1).bit_length()
+
+
+def _topology_leaf(snapshot):
+    '''
+    Selects the extended topology leaf, preferring 0x1F over 0xB.
+    '''
+    for infotype in 0x1f, 0xb:
+        if _leaf(0, snapshot)[0] >= infotype and _leaf(infotype, snapshot)[1]:
+            return infotype
+    return None
+
+
+def topology_levels(snapshot=None):
+    '''
+    topology_levels() -> [(str, int), ...]
+    returns each topology level with the shift applied to the x2APIC ID to get
+    the ID of the next level up, from the extended topology leaves
+    '''
+    infotype = _topology_leaf(snapshot)
+    if infotype is None:
+        return []
+    levels = []
+    for subleaf, (a, b, c, d) in subleaves(infotype, snapshot):
+        level = (c >> 8) & 0xff
+        levels.append((_level_table.get(level, str(level)), a & 0x1f))
+    return levels
+
+
+def apic_id(snapshot=None):
+    '''
+    apic_id() -> int
+    returns the x2APIC ID of the processor, or the initial APIC ID on
+    processors without the extended topology leaves
+    '''
+    infotype = _topology_leaf(snapshot)
+    if infotype is None:
+        return _leaf(1, snapshot)[1] >> 24
+    return _leaf(infotype, snapshot)[3]
+
+
+def _topology_shifts(snapshot):
+    '''
+    Works out the shifts of the APIC ID giving the core and the package.
+    '''
+    levels = topology_levels(snapshot)
+    if levels:
+        smt_shift = dict(levels).get('SMT', 0)
+        return smt_shift, levels[-1][1]
+
+    # Older processors only report the number of addressable IDs per package.
+    a, b, c, d = _leaf(1, snapshot)
+    logical = (b >> 16) & 0xff if d & (1 << 28) else 1
+    if _amd(snapshot):
+        c = _leaf(EXTENDED_OFFSET | 0x8, snapshot)[2]
+        package_shift = (c >> 12) & 0xf or _ceil_log2((c & 0xff) + 1)
+        threads = ((_leaf(EXTENDED_OFFSET | 0x1e, snapshot)[1] >> 8) & 0xff) + 1
+        return _ceil_log2(threads), max(package_shift, _ceil_log2(logical))
+    cores = ((_leaf(4, snapshot)[0] >> 26) & 0x3f) + 1
+    return _ceil_log2(logical // cores), _ceil_log2(logical)
+
+
+class Topology(object):
+    '''
+    The arrangement of logical processors into cores and packages, indexed for
+    constant time lookups in either direction.
+
+    Cores are identified by (package, core) pairs.
+    '''
+
+    __slots__ = ('_placement', '_threads', '_cores')
+
+    def __init__(self, placement):
+        '''
+        :param placement: Mapping of logical processor to (package, core,
+            thread) IDs.
+        :type placement: dict
+        '''
+        threads = {}
+        cores = {}
+        for cpu in sorted(placement):
+            package, core, thread = placement[cpu]
+            threads.setdefault((package, core), []).append(cpu)
+            cores.setdefault(package, [])
+            if (package, core) not in cores[package]:
+                cores[package].append((package, core))
+        self._placement = dict(placement)
+        self._threads = dict((key, tuple(cpus)) for key, cpus in threads.items())
+        self._cores = dict((key, tuple(sorted(keys))) for key, keys in cores.items())
+
+    @classmethod
+    def from_snapshots(cls, snapshots):
+        '''
+        Topology.from_snapshots({cpu: Snapshot, ...}) -> Topology
+        decodes the APIC ID of each logical processor
+        '''
+        placement = {}
+        for cpu, snapshot in snapshots.items():
+            smt_shift, package_shift = _topology_shifts(snapshot)
+            x2apic = apic_id(snapshot)
+            placement[cpu] = (x2apic >> package_shift,
+                              (x2apic & ((1 << package_shift) - 1)) >> smt_shift,
+                              x2apic & ((1 << smt_shift) - 1))
+        return cls(placement)
+
+    def cpus(self):
+        '''
+        cpus() -> [int, int, ...]
+        '''
+        return sorted(self._placement)
+
+    def packages(self):
+        '''
+        packages() -> [int, int, ...]
+        '''
+        return sorted(self._cores)
+
+    def cores(self, package=None):
+        '''
+        cores([package]) -> ((package, core), ...)
+        returns the cores in a package, or in every package
+        '''
+        if package is None:
+            return tuple(sorted(self._threads))
+        return self._cores[package]
+
+    def threads(self, core):
+        '''
+        threads((package, core)) -> (cpu, cpu, ...)
+        returns the logical processors on a core
+        '''
+        return self._threads[core]
+
+    def core(self, cpu):
+        '''
+        core(cpu) -> (package, core)
+        '''
+        return self._placement[cpu][:2]
+
+    def package(self, cpu):
+        '''
+        package(cpu) -> int
+        '''
+        return self._placement[cpu][0]
+
+    def siblings(self, cpu):
+        '''
+        siblings(cpu) -> (cpu, cpu, ...)
+        returns the logical processors sharing a core with the given one,
+        including itself
+        '''
+        return self._threads[self._placement[cpu][:2]]
+
+    def __repr__(self):
+        return '<%s: %d packages, %d cores, %d threads>' % (
+            self.__class__.__name__, len(self._cores), len(self._threads), len(self._placement))
+
+
+def topology(snapshots=None):
+    '''
+    topology() -> Topology
+    returns the arrangement of the logical processors into cores and packages,
+    decoded from the snapshot of every processor when none are given
+    '''
+    global _topology
+    if snapshots is not None:
+        return Topology.from_snapshots(snapshots)
+    if _topology is None:
+        _topology = Topology.from_snapshots(cpu_snapshots())
+    return _topology
+
+
+# Core types reported in EAX[31:24] of leaf 0x1A on hybrid processors.
+_core_type_table = {
+    0x20: 'efficiency',
+    0x40: 'performance',
+    }
+
+
+def core_type(snapshot=None):
+    '''
+    core_type() -> str
+    returns ``'performance'`` or ``'efficiency'`` for the kind of core of the
+    processor on a hybrid part, or None when the processor is not hybrid
+    '''
+    if 'HYBRID' not in feature_set(snapshot) or _leaf(0, snapshot)[0] < 0x1a:
+        return None
+    kind = _leaf(0x1a, snapshot)[0] >> 24
+    return _core_type_table.get(kind, 'unknown-0x%02x' % kind)
+
+
+def core_types(snapshots=None):
+    '''
+    core_types() -> {str: [int, int, ...], ...}
+    returns the logical processors of each kind of core, decoded from the
+    snapshot of every processor when none are given, with every processor
+    under None when the processor is not hybrid
+    '''
+    if snapshots is None:
+        snapshots = cpu_snapshots()
+    result = {}
+    for cpu in sorted(snapshots):
+        result.setdefault(core_type(snapshots[cpu]), []).append(cpu)
+    return result
+
+
+def pin_core_type(kind, process=False, snapshots=None):
+    '''
+    pin_core_type(kind[, process]) -> [int, int, ...]
+    restricts the calling thread, or the process, to the logical processors
+    with the given kind of core and returns them
+
+    Every processor counts as any kind when the processor is not hybrid.
+    raises ValueError when no processor has that kind of core
+    '''
+    kinds = core_types(snapshots)
+    cpus = kinds.get(kind)
+    if kinds.keys() == [None]:
+        cpus = kinds[None]
+    if not cpus:
+        raise ValueError("no processor has %s cores" % kind)
+    set_affinity(cpus, process)
+    return cpus
+
+
+_dispatchers = []
+
+
+class Dispatcher(object):
+    '''
+    A function with implementations specialised for processor features.
+
+    The best implementation is resolved on the first call from those whose
+    requirements are all usable: the one of highest priority, then one whose
+    requirements are a strict superset of another's, then the earliest
+    registered, or the original function when none qualify. The name of the
+    function is then rebound to that implementation in the module defining it,
+    so later calls through the module pay no dispatch overhead at all.
+
+    The choice can be forced for benchmarking by setting ``PYCPUID_DISPATCH``
+    to a comma separated list of ``name=implementation`` pairs, where the name
+    is that of the dispatched function, optionally qualified by its module.
+    '''
+
+    def __init__(self, func, registered=True):
+        '''
+        :param func: Portable implementation, whose name is rebound.
+        :type func: function
+        :param registered: Whether refresh() resets the choice and
+            dispatched() reports it.
+        :type registered: bool
+        '''
+        self.__name__ = func.__name__
+        self.__module__ = func.__module__
+        self.__doc__ = func.__doc__
+        self._default = func
+        self._variants = []
+        self._priorities = {}
+        self._target = None
+        if registered:
+            _dispatchers.append(self)
+
+    def register(self, *requirements, **options):
+        '''
+        register(feature, ...[, priority=0]) -> decorator
+        registers an implementation requiring all of the given features,
+        preferred over implementations of lower priority
+        '''
+        priority = options.pop('priority', 0)
+        if options:
+            raise TypeError("register() got an unexpected keyword argument %r" % options.keys()[0])
+        requirements = FeatureSet(requirements)
+
+        def decorator(func):
+            self._variants.append((requirements, func))
+            self._priorities[func] = priority
+            return func
+        return decorator
+
+    def variants(self):
+        '''
+        variants() -> [(FeatureSet, function), ...]
+        returns the registered implementations with their requirements
+        '''
+        return list(self._variants) + [(FeatureSet(), self._default)]
+
+    def resolve(self, snapshot=None, xcr0=None):
+        '''
+        resolve() -> function
+        returns the best implementation for the processor
+        '''
+        override = _dispatch_override(self)
+        if override is not None:
+            for requirements, func in self.variants():
+                if func.__name__ == override:
+                    return func
+            raise ValueError("%s has no implementation named %r" % (self.name, override))
+        available = usable_features(snapshot, xcr0)
+        best = None
+        for requirements, func in self._variants:
+            if not requirements <= available:
+                continue
+            if best is None or self._priorities[func] > self._priorities[best[1]] or (
+                    self._priorities[func] == self._priorities[best[1]] and requirements > best[0]):
+                best = requirements, func
+        return self._default if best is None else best[1]
+
+    @property
+    def name(self):
+        return '%s.%s' % (self.__module__, self.__name__)
+
+    @property
+    def selected(self):
+        '''
+        The implementation chosen on the first call, or None before then.
+        '''
+        return self._target
+
+    def reset(self):
+        '''
+        Forgets the chosen implementation so the next call resolves it again.
+        '''
+        namespace = self._default.func_globals
+        if self._target is not None and namespace.get(self.__name__) is self._target:
+            namespace[self.__name__] = self
+        self._target = None
+
+    def __call__(self, *args, **kwargs):
+        target = self._target
+        if target is None:
+            target = self._target = self.resolve()
+            namespace = self._default.func_globals
+            if namespace.get(self.__name__) is self:
+                namespace[self.__name__] = target
+        return target(*args, **kwargs)
+
+    def __repr__(self):
+        return '<%s %s>' % (self.__class__.__name__, self.name)
+
+
+def _dispatch_override(dispatcher):
+    for item in os.environ.get('PYCPUID_DISPATCH', '').split(','):
+        name, sep, value = item.partition('=')
+        if sep and name.strip() in (dispatcher.__name__, dispatcher.name):
+            return value.strip()
+    return None
+
+
+def dispatch(func):
+    '''
+    dispatch(func) -> Dispatcher
+    decorator turning a portable function into one that dispatches to the best
+    implementation registered for the processor features
+    '''
+    return Dispatcher(func)
+
+
+def dispatched():
+    '''
+    dispatched() -> {str: str, ...}
+    returns the name of the implementation chosen for every dispatched function
+    that has been called
+    '''
+    return dict((dispatcher.name, dispatcher.selected.__name__)
+                for dispatcher in _dispatchers if dispatcher.selected is not None)
+
+
+# Identification constants resolved on first access.
+_constants = {
+    'VENDOR': vendor,
+    'BRAND_STRING': brand_string,
+    'FAMILY': family,
+    'MODEL': model,
+    'STEPPING_ID': stepping_id,
+    }
+
+
+def _attribute(name):
+    '''
+    Resolves the ``HAS_*`` flags and identification constants from the default
+    snapshot, so that no CPUID is executed until one is actually requested.
+    '''
+    global _features
+    if name.startswith('HAS_') and name[4:] in _feat_names:
+        if _features is None:
+            _features = feature_set()
+        return name[4:] in _features
+    if name in _constants:
+        try:
+            return _constants[name]()
+        except AssertionError:
+            return None
+    raise AttributeError("'module' object has no attribute '%s'" % name)
+
+
+class _LazyModule(_types.ModuleType):
+    '''
+    Module whose feature flags and identification constants are resolved on
+    first access rather than at import.
+    '''
+
+    def __init__(self, module):
+        _types.ModuleType.__init__(self, module.__name__, module.__doc__)
+        self.__dict__.update(module.__dict__)
+        # Python 2 clears the globals of a module when it is freed.
+        self.__dict__['_LazyModule__module'] = module
+
+    def __getattr__(self, name):
+        if name == '__all__':
+            names = [key for key in self.__dict__ if not key.startswith('_')]
+            return names + ['HAS_' + key for key in sorted(_feat_names)] + sorted(_constants)
+        return _attribute(name)
+
+    def __dir__(self):
+        return sorted(set(self.__dict__) | set(self.__all__))
 
-_init()
 
 if __name__ == "__main__":
     print "Vendor:", vendor()
@@ -142,3 +2232,4 @@ if __name__ == "__main__":
     print "Brand ID:", hex(brand_id())
     print "Brand String:", brand_string()
     print "Features:", features()
+    print "Microarchitecture Level:", microarch_level()
@@ -0,0 +1,25 @@
+import struct
+import pycpuid
+
+def make_snapshot(leaves):
+	keys = sorted(leaves)
+	regs = bytearray()
+	for key in keys:
+		regs += struct.pack('4I', *leaves[key])
+	return pycpuid.Snapshot(dict((key, row) for row, key in enumerate(keys)), regs)
+
+def ccx_snapshots():
+	# Two CCXs of four cores with two threads each, numbered like Linux.
+	snapshots = {}
+	for core in range(8):
+		for thread in range(2):
+			snapshots[thread * 8 + core] = make_snapshot({
+				(0, 0): (0xd, 0x68747541, 0x444d4163, 0x69746e65),
+				(1, 0): (0, (core << 1 | thread) << 24, 0, 0),
+				(0x80000000, 0): (0x8000001d, 0, 0, 0),
+				(0x80000001, 0): (0, 0, 1 << 22, 0),
+				(0x8000001d, 0): (1 << 14 | 0x121, 0x1c0003f, 0x3f, 0),
+				(0x8000001d, 1): (1 << 14 | 0x143, 0x1c0003f, 0x3ff, 0x2),
+				(0x8000001d, 2): (7 << 14 | 0x163, 0x3c0003f, 0x7fff, 0x1),
+				})
+	return snapshots
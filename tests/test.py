@@ -1,10 +1,716 @@
+import array
+import ctypes
+import os
+import pickle
+import struct
+import subprocess
+import sys
 import unittest
 import pycpuid
+from pycpuid import pycpuid as _impl
+from fixtures import make_snapshot, ccx_snapshots
+
+@pycpuid.dispatch
+def kernel():
+	return 'generic'
+
+@kernel.register('SSE2')
+def kernel_sse2():
+	return 'sse2'
+
+@kernel.register('AVX512F & AVX512VL', priority=2)
+def kernel_avx512():
+	return 'avx512'
+
+@kernel.register('AVX2 & FMA', priority=1)
+def kernel_fma():
+	return 'fma'
+
+@kernel.register('AVX2 & FMA & BMI2', priority=1)
+def kernel_avx2():
+	return 'avx2'
+
+dispatcher = kernel
 
 class test_pycpuid(unittest.TestCase):
 	def test_vendor(self):
 		self.assert_(isinstance(pycpuid.vendor(), basestring))
 		self.assertEqual(len(pycpuid.vendor()), 12)
-		
+
+class test_lazy(unittest.TestCase):
+	def test_import_executes_no_cpuid(self):
+		code = 'import pycpuid, pycpuid._pycpuid as c; n = c.executions(); pycpuid.HAS_SSE2; print n, c.executions()'
+		root = os.path.dirname(os.path.dirname(os.path.abspath(pycpuid.__file__)))
+		process = subprocess.Popen([sys.executable, '-c', code], cwd=root, stdout=subprocess.PIPE)
+		before, after = map(int, process.communicate()[0].split())
+		self.assertEqual(before, 0)
+		self.assert_(after > 0)
+
+	def test_attributes(self):
+		self.assertEqual(pycpuid.HAS_SSE2, 'SSE2' in pycpuid.features())
+		self.assertEqual(pycpuid.VENDOR, pycpuid.vendor())
+		self.assert_('HAS_SSE2' in pycpuid.__all__)
+		self.assertRaises(AttributeError, getattr, pycpuid, 'HAS_NOSUCH')
+		self.assertRaises(AttributeError, getattr, pycpuid, 'NOSUCH')
+
+	def test_features(self):
+		from pycpuid.backends import ReplayBackend
+		self.assertEqual(pycpuid.features(), list(pycpuid.feature_set()))
+		pycpuid.features().append('NOSUCH')
+		self.assert_('NOSUCH' not in pycpuid.features())
+		# The cached list follows the default snapshot.
+		previous = pycpuid.set_backend(ReplayBackend.from_leaves({(0, 0): (1, 0, 0, 0), (1, 0): (0, 0, 0, 1 << 26)}))
+		try:
+			self.assertEqual(pycpuid.features(), ['SSE2'])
+		finally:
+			pycpuid.set_backend(previous)
+		self.assertEqual(pycpuid.features(), list(pycpuid.feature_set()))
+
+class test_cpuid_many(unittest.TestCase):
+	def test_sequence(self):
+		regs = pycpuid.cpuid_many([0, (0x80000000, 0)])
+		self.assertEqual(len(regs), 32)
+		self.assertEqual(struct.unpack('8I', bytes(regs)), pycpuid.cpuid(0) + pycpuid.cpuid(0x80000000))
+
+	def test_buffer(self):
+		out = array.array('I', [0] * 4)
+		self.assert_(pycpuid.cpuid_many(array.array('I', [0, 0]), out) is out)
+		self.assertEqual(tuple(out), pycpuid.cpuid(0))
+
+	def test_subleaf(self):
+		regs = pycpuid.cpuid_many([(0xd, 0), (0xd, 1)])
+		self.assertEqual(struct.unpack('4I', bytes(regs[16:])), pycpuid.cpuid(0xd, 1))
+
+	def test_pinned(self):
+		cpus = pycpuid.affinity()
+		regs = pycpuid.cpuid_many([0], cpu=cpus[-1])
+		self.assertEqual(struct.unpack('4I', bytes(regs)), pycpuid.cpuid(0))
+		self.assertEqual(pycpuid.affinity(), cpus)
+
+	def test_invalid(self):
+		self.assertRaises(ValueError, pycpuid.cpuid_many, array.array('I', [0]))
+		self.assertRaises(ValueError, pycpuid.cpuid_many, [0, 0], array.array('I', [0] * 4))
+		self.assertRaises(TypeError, pycpuid.cpuid_many, [0, 'a'])
+		self.assertRaises(OSError, pycpuid.cpuid_many, [0], cpu=1 << 16)
+
+class test_snapshot(unittest.TestCase):
+	def test_probe(self):
+		snapshot = pycpuid.Snapshot.probe()
+		self.assertEqual(snapshot.cpuid(0), pycpuid.cpuid(0))
+		self.assert_(0 in snapshot and 1 in snapshot)
+		self.assertEqual(snapshot.cpuid(0)[0] + 1, len(set([leaf for leaf, subleaf in snapshot.leaves() if leaf < pycpuid.HYPERVISOR_OFFSET])))
+		self.assertEqual(snapshot.leaves(), pycpuid.Snapshot.probe().leaves())
+
+	def test_unsupported_leaf(self):
+		snapshot = pycpuid.default_snapshot()
+		self.assertEqual(snapshot.cpuid(0x3fffffff), (0, 0, 0, 0))
+
+	def test_accessors_do_not_execute_cpuid(self):
+		len(pycpuid.default_snapshot())
+		original = _impl._pycpuid
+		_impl._pycpuid = None
+		try:
+			self.assertEqual(len(pycpuid.vendor()), 12)
+			pycpuid.family(), pycpuid.model(), pycpuid.features()
+		finally:
+			_impl._pycpuid = original
+
+	def test_subleaves(self):
+		snapshot = pycpuid.default_snapshot()
+		if snapshot.cpuid(0)[0] < 0xd:
+			return
+		self.assertEqual(pycpuid.subleaves(0xd)[:2], [(0, snapshot.cpuid(0xd)), (1, snapshot.cpuid(0xd, 1))])
+		self.assertEqual([k for k, regs in pycpuid.subleaves(7)], range(snapshot.cpuid(7)[0] + 1))
+		for subleaf, regs in pycpuid.subleaves(4):
+			self.assertEqual(regs, pycpuid.cpuid(4, subleaf))
+		self.assertRaises(ValueError, pycpuid.subleaves, 1)
+
+	def test_unindexed_subleaf(self):
+		snapshot = pycpuid.default_snapshot()
+		self.assertEqual(snapshot.cpuid(1, 5), snapshot.cpuid(1))
+
+	def test_dump_all_cpus(self):
+		cpus = pycpuid.affinity()
+		snapshots = pycpuid.dump_all_cpus()
+		self.assertEqual(sorted(snapshots), cpus)
+		for cpu, snapshot in snapshots.items():
+			self.assertEqual(pycpuid.vendor(snapshot), pycpuid.vendor())
+		self.assertEqual(pycpuid.affinity(), cpus)
+		self.assertEqual(pycpuid.dump_all_cpus([]), {})
+
+	def test_refresh(self):
+		snapshot = pycpuid.default_snapshot()
+		self.assert_(pycpuid.default_snapshot() is snapshot)
+		refreshed = pycpuid.refresh()
+		self.assert_(pycpuid.default_snapshot() is refreshed)
+		self.assertEqual(snapshot.cpuid(0), refreshed.cpuid(0))
+
+	def test_serialise(self):
+		snapshot = pycpuid.Snapshot.probe()
+		data = snapshot.to_bytes()
+		self.assertEqual(data[:8], pycpuid.SNAPSHOT_MAGIC)
+		for buf in data, bytearray(data), buffer(data), memoryview(data):
+			loaded = pycpuid.Snapshot.from_buffer(buf)
+			self.assertEqual(loaded.leaves(), snapshot.leaves())
+			self.assertEqual(loaded, snapshot)
+			self.assertEqual(loaded.to_bytes(), data)
+		loaded = pycpuid.Snapshot.from_buffer('\0' * 5 + data, 5)
+		self.assertEqual(pycpuid.vendor(loaded), pycpuid.vendor(snapshot))
+
+	def test_serialise_format(self):
+		snapshot = make_snapshot({(1, 0): (1, 2, 3, 4), (0, 0): (1, 5, 6, 7)})
+		data = snapshot.to_bytes()
+		self.assertEqual(data, 'PYCPUIDS' + struct.pack('<12I', 1, 2, 0, 0, 1, 0, 1, 5, 6, 7, 1, 2) + struct.pack('<2I', 3, 4))
+		self.assertEqual(pycpuid.Snapshot.from_buffer(data).cpuid(1), (1, 2, 3, 4))
+		self.assertEqual(pycpuid.Snapshot.from_buffer(make_snapshot({}).to_bytes()).leaves(), [])
+
+	def test_serialise_corrupt(self):
+		data = make_snapshot({(0, 0): (1, 5, 6, 7), (1, 0): (1, 2, 3, 4)}).to_bytes()
+		for corrupt in '', data[:15], data[:-1], data + '\0', 'X' + data[1:], data[:8] + '\2' + data[9:], data[:12] + '\3' + data[13:]:
+			self.assertRaises(ValueError, pycpuid.Snapshot.from_buffer, corrupt)
+		swapped = data[:16] + data[24:32] + data[16:24] + data[32:]
+		self.assertRaises(ValueError, pycpuid.Snapshot.from_buffer(swapped).cpuid, 0)
+
+class test_lazy_snapshot(unittest.TestCase):
+	def tearDown(self):
+		os.environ.pop('PYCPUID_PROBE', None)
+		pycpuid.refresh()
+
+	def test_load(self):
+		executions = _impl._pycpuid.executions
+		snapshot = pycpuid.LazySnapshot()
+		vendor = pycpuid.vendor()
+		eager = pycpuid.Snapshot.probe()
+		before = executions()
+		self.assertEqual(pycpuid.vendor(snapshot), vendor)
+		self.assertEqual(executions() - before, 1)
+		pycpuid.vendor(snapshot)
+		self.assertEqual(snapshot.cpuid(0x3fffffff), (0, 0, 0, 0))
+		self.assertEqual(snapshot.cpuid(0xc0000000), (0, 0, 0, 0))
+		self.assertEqual(executions() - before, 1)
+		if (4, 0) in eager:
+			self.assertEqual(snapshot.cpuid(4, 1), eager.cpuid(4, 1))
+			self.assertEqual(executions() - before, 1 + len([key for key in eager.leaves() if key[0] == 4]))
+		self.assertEqual(snapshot.cpuid(eager.cpuid(0)[0] + 1), (0, 0, 0, 0))
+		self.assertEqual(snapshot.leaves(), eager.leaves())
+		self.assertEqual(executions() - before, len(eager))
+		self.assertEqual(snapshot.cpuid(0), eager.cpuid(0))
+
+	def test_hypervisor_range(self):
+		snapshot = pycpuid.LazySnapshot()
+		leaf = snapshot.cpuid(pycpuid.HYPERVISOR_OFFSET)
+		if pycpuid.hypervisor_present():
+			self.assertEqual(leaf, pycpuid.cpuid(pycpuid.HYPERVISOR_OFFSET))
+		else:
+			self.assertEqual(leaf, (0, 0, 0, 0))
+
+	def test_policy(self):
+		for policy, kind in ('lazy', pycpuid.LazySnapshot), ('eager', pycpuid.Snapshot):
+			os.environ['PYCPUID_PROBE'] = policy
+			self.assertEqual(type(pycpuid.refresh()), kind)
+		os.environ['PYCPUID_PROBE'] = 'sometimes'
+		self.assertRaises(ValueError, pycpuid.refresh)
+		del os.environ['PYCPUID_PROBE']
+		kind = pycpuid.LazySnapshot if pycpuid.hypervisor_present() else pycpuid.Snapshot
+		self.assertEqual(type(pycpuid.refresh()), kind)
+		self.assert_(pycpuid.probe_cost_ns() > 0)
+
+	def test_auto_cost(self):
+		os.environ['PYCPUID_PROBE'] = 'auto'
+		executions = _impl._pycpuid.executions
+		before = executions()
+		eager = pycpuid.Snapshot.probe()
+		cost = executions() - before
+		before = executions()
+		snapshot = pycpuid.refresh()
+		self.assert_(executions() - before <= cost, (executions() - before, cost))
+		if type(snapshot) is pycpuid.Snapshot:
+			self.assertEqual(snapshot, eager)
+
+	def test_auto_bare_metal(self):
+		from pycpuid.backends import ReplayBackend
+		requests = []
+		class bare_metal(ReplayBackend):
+			live = True
+			def cpuid_many(self, pairs, out=None, cpu=None):
+				requests.extend(pairs)
+				return ReplayBackend.cpuid_many(self, pairs, out, cpu)
+		leaves = dict(test_caches.intel)
+		leaves[1, 0] = (0x906ea, 0, 0x7ffafbbf, 0xbfebfbff)
+		os.environ['PYCPUID_PROBE'] = 'auto'
+		previous = pycpuid.set_backend(bare_metal.from_leaves(leaves))
+		try:
+			del requests[:]
+			eager = pycpuid.Snapshot.probe()
+			cost = len(requests)
+			del requests[:]
+			snapshot = pycpuid.refresh()
+			self.assertEqual(type(snapshot), pycpuid.Snapshot)
+			self.assertEqual(snapshot, eager)
+			self.assertEqual(len(requests), cost)
+		finally:
+			pycpuid.set_backend(previous)
+
+class test_hypervisor(unittest.TestCase):
+	def test_decode(self):
+		self.assertEqual(pycpuid.hypervisor(make_snapshot({(1, 0): (0, 0, 0, 0)})), None)
+		kvm = make_snapshot({(1, 0): (0, 0, 1 << 31, 0), (0x40000000, 0): (0x40000001, 0x4b4d564b, 0x564b4d56, 0x4d)})
+		self.assertEqual(pycpuid.hypervisor(kvm), ('KVM', 'KVMKVMKVM', 0x40000001))
+		hyperv = make_snapshot({(1, 0): (0, 0, 1 << 31, 0), (0x40000000, 0): (0x4000000b, 0x7263694d, 0x666f736f, 0x76482074)})
+		self.assertEqual(pycpuid.hypervisor(hyperv).name, 'Hyper-V')
+		unknown = make_snapshot({(1, 0): (0, 0, 1 << 31, 0), (0x40000000, 0): (0, 0x64636261, 0, 0)})
+		self.assertEqual(pycpuid.hypervisor(unknown), ('abcd', 'abcd', 0x40000001))
+		silent = make_snapshot({(1, 0): (0, 0, 1 << 31, 0)})
+		self.assertEqual(pycpuid.hypervisor(silent), (None, '', 0))
+		self.assert_(pycpuid.hypervisor_present(silent))
+
+	def test_live(self):
+		hypervisor = pycpuid.hypervisor()
+		self.assertEqual(hypervisor is not None, pycpuid.hypervisor_present())
+		self.assert_(pycpuid.perfmon_version() >= 0)
+
+	def test_perfmon(self):
+		self.assertEqual(pycpuid.perfmon_version(make_snapshot({(0, 0): (0xa, 0, 0, 0), (0xa, 0): (0x7300805, 0, 0, 0)})), 5)
+		self.assertEqual(pycpuid.perfmon_version(make_snapshot({(0, 0): (0x9, 0, 0, 0), (0xa, 0): (0x7300805, 0, 0, 0)})), 0)
+
+class test_caches(unittest.TestCase):
+	intel = {
+		(0, 0): (0xd, 0x756e6547, 0x6c65746e, 0x49656e69),
+		(4, 0): (0x121, 0x2c0003f, 0x3f, 0),
+		(4, 1): (0x122, 0x1c0003f, 0x3f, 0),
+		(4, 2): (0x143, 0x3c0003f, 0x7ff, 0),
+		(4, 3): (0x3c163, 0x4c0003f, 0x3bfff, 4),
+		(4, 4): (0, 0, 0, 0),
+		}
+
+	def test_intel(self):
+		snapshot = make_snapshot(self.intel)
+		caches = pycpuid.caches(snapshot)
+		self.assertEqual([(cache.level, cache.type) for cache in caches], [(1, 'data'), (1, 'instruction'), (2, 'unified'), (3, 'unified')])
+		self.assertEqual(caches[0].size, 48 << 10)
+		self.assertEqual(caches[2].size, 2 << 20)
+		self.assertEqual(caches[3], pycpuid.Cache(3, 'unified', 300 << 20, 64, 20, 1, 0x3c000, 16, False))
+		self.assertEqual(pycpuid.recommended_block_bytes(snapshot=snapshot), 1 << 20)
+		self.assertEqual(pycpuid.recommended_block_bytes(3, 1.0, True, snapshot), (300 << 20) // 16)
+		self.assertEqual(pycpuid.recommended_block_items(8, 1, 1.0, snapshot=snapshot), 6 << 10)
+		self.assertRaises(ValueError, pycpuid.recommended_block_bytes, 4, snapshot=snapshot)
+		self.assertEqual(pycpuid.cache_line_size(snapshot), 64)
+		leaves = dict(self.intel)
+		leaves[1, 0] = (0, 16 << 8, 0, 1 << 19)
+		self.assertEqual(pycpuid.cache_line_size(make_snapshot(leaves)), 128)
+		self.assertEqual(pycpuid.cache_line_size(make_snapshot({})), pycpuid.DEFAULT_LINE_SIZE)
+
+	def test_amd_legacy(self):
+		snapshot = make_snapshot({
+			(0, 0): (0xd, 0x68747541, 0x444d4163, 0x69746e65),
+			(0x80000000, 0): (0x80000006, 0, 0, 0),
+			(0x80000005, 0): (0, 0, 0x40020140, 0x40020140),
+			(0x80000006, 0): (0, 0, 0x02006140, 0x0040a140),
+			})
+		caches = pycpuid.caches(snapshot)
+		self.assertEqual([(cache.level, cache.size, cache.ways) for cache in caches], [(1, 64 << 10, 2), (1, 64 << 10, 2), (2, 512 << 10, 8), (3, 8 << 20, 32)])
+		self.assertEqual(caches[2].sets, 1024)
+		self.assertEqual(pycpuid.cache_line_size(snapshot), 64)
+		self.assertEqual(pycpuid.cache_domain(snapshot=snapshot), None)
+		self.assertEqual(pycpuid.cache_domains(snapshots={0: snapshot, 1: snapshot}), [(0, 1)])
+
+	def test_domains(self):
+		snapshots = ccx_snapshots()
+		self.assertEqual(pycpuid.cache_domain(snapshot=snapshots[9]), 0)
+		self.assertEqual(pycpuid.cache_domain(snapshot=snapshots[12]), 1)
+		self.assertEqual(pycpuid.cache_domains(snapshots=snapshots), [(0, 1, 2, 3, 8, 9, 10, 11), (4, 5, 6, 7, 12, 13, 14, 15)])
+		self.assertEqual(pycpuid.cache_domains(2, snapshots)[:2], [(0, 8), (1, 9)])
+
+	def test_live_domains(self):
+		domains = pycpuid.cache_domains()
+		self.assertEqual(sorted(sum(domains, ())), pycpuid.affinity())
+
+class test_tlbs(unittest.TestCase):
+	K4, M2, M4, G1 = 4 << 10, 2 << 20, 4 << 20, 1 << 30
+
+	# Leaves 0x0, 0x2 and 0x80000001 as recorded on a Core i7-6700.
+	skylake = {
+		(0, 0): (0x16, 0x756e6547, 0x6c65746e, 0x49656e69),
+		(2, 0): (0x76036301, 0x00f0b5ff, 0x00000000, 0x00c30000),
+		(0x80000000, 0): (0x80000008, 0, 0, 0),
+		(0x80000001, 0): (0, 0, 0x121, 0x2c100800),
+		}
+
+	def test_descriptors(self):
+		tlbs = pycpuid.tlbs(make_snapshot(self.skylake))
+		self.assertEqual(tlbs, [
+			pycpuid.Tlb(1, 'data', (self.M2, self.M4), 32, 4),
+			pycpuid.Tlb(1, 'data', (self.G1,), 4, 4),
+			pycpuid.Tlb(1, 'data', (self.K4,), 64, 4),
+			pycpuid.Tlb(1, 'instruction', (self.M2, self.M4), 8, 0),
+			pycpuid.Tlb(1, 'instruction', (self.K4,), 64, 8),
+			pycpuid.Tlb(2, 'unified', (self.K4, self.M2), 1536, 6),
+			pycpuid.Tlb(2, 'unified', (self.G1,), 16, 4),
+			])
+		self.assertEqual(pycpuid.tlbs(make_snapshot({(0, 0): (1, 0, 0, 0)})), [])
+
+	def test_deterministic(self):
+		snapshot = make_snapshot({
+			(0, 0): (0x18, 0x756e6547, 0x6c65746e, 0x49656e69),
+			(2, 0): (0x00feff01, 0, 0, 0),
+			(0x18, 0): (2, 8 << 16 | 0x1, 16, 1 << 5 | 2),
+			(0x18, 1): (0, 12 << 16 | 0xb, 128, 2 << 5 | 3),
+			(0x18, 2): (0, 0, 0, 0),
+			})
+		self.assertEqual(pycpuid.tlbs(snapshot), [
+			pycpuid.Tlb(1, 'instruction', (self.K4,), 128, 8),
+			pycpuid.Tlb(2, 'unified', (self.K4, self.M2, self.G1), 1536, 12),
+			])
+
+	def test_amd(self):
+		snapshot = make_snapshot({
+			(0, 0): (0x10, 0x68747541, 0x444d4163, 0x69746e65),
+			(0x80000000, 0): (0x80000019, 0, 0, 0),
+			(0x80000001, 0): (0, 0, 0, 1 << 26),
+			(0x80000005, 0): (0xff40ff40, 0xff40ff40, 0, 0),
+			(0x80000006, 0): (0x68006400, 0x68006400, 0, 0),
+			(0x80000019, 0): (0xf040f040, 0, 0, 0),
+			})
+		tlbs = pycpuid.tlbs(snapshot)
+		self.assertEqual(tlbs[:2], [pycpuid.Tlb(1, 'data', (self.M2, self.M4), 64, 0), pycpuid.Tlb(1, 'data', (self.K4,), 64, 0)])
+		self.assert_(pycpuid.Tlb(1, 'data', (self.G1,), 64, 0) in tlbs)
+		self.assert_(pycpuid.Tlb(2, 'instruction', (self.K4,), 1024, 8) in tlbs)
+		self.assertEqual(len(tlbs), 10)
+		self.assertEqual(pycpuid.tlb_reach(self.M2, snapshot), 2048 * self.M2)
+		self.assertEqual(pycpuid.tlb_reach(self.G1, snapshot), 64 * self.G1)
+
+	def test_advice(self):
+		snapshot = make_snapshot(self.skylake)
+		self.assertEqual(pycpuid.page_sizes(snapshot), [self.K4, self.M2, self.G1])
+		self.assertEqual(pycpuid.tlb_reach(self.K4, snapshot), 6 << 20)
+		advice = pycpuid.page_advice(1 << 20, snapshot)
+		self.assertEqual((advice.page_size, advice.strategy, advice.reach), (self.K4, 'MADV_NORMAL', 6 << 20))
+		self.assertEqual(advice.options, {self.K4: 6 << 20, self.M2: 3 << 30, self.G1: 16 << 30})
+		self.assertEqual(pycpuid.page_advice(1 << 30, snapshot).strategy, 'MADV_HUGEPAGE')
+		self.assertEqual(pycpuid.page_advice(8 << 30, snapshot).page_size, self.G1)
+		self.assertEqual(pycpuid.page_advice(100 << 30, snapshot).page_size, self.G1)
+		leaves = dict(self.skylake)
+		leaves[0x80000001, 0] = (0, 0, 0, 0)
+		advice = pycpuid.page_advice(8 << 30, make_snapshot(leaves))
+		self.assertEqual((advice.page_size, sorted(advice.options)), (self.M2, [self.K4, self.M2]))
+		leaves[2, 0] = (0x00feff01, 0xf0, 0, 0)
+		self.assertEqual(pycpuid.page_advice(8 << 30, make_snapshot(leaves)), (self.M2, 'MADV_HUGEPAGE', 0, {self.K4: 0, self.M2: 0}))
+		self.assertEqual(pycpuid.page_advice(1 << 20, make_snapshot(leaves)).page_size, self.K4)
+
+	def test_live(self):
+		for tlb in pycpuid.tlbs():
+			self.assert_(tlb.entries > 0 and tlb.page_sizes, tlb)
+		advice = pycpuid.page_advice(1 << 20)
+		self.assert_(advice.page_size in pycpuid.page_sizes())
+		self.assertEqual(advice.reach, advice.options[advice.page_size])
+
+class test_feature_set(unittest.TestCase):
+	def test_live(self):
+		available = pycpuid.feature_set()
+		self.assertEqual(sorted(available), sorted(pycpuid.features()))
+		self.assert_('SSE2' in available)
+		self.assert_(pycpuid.FeatureSet('SSE & SSE2') <= available)
+
+	def test_algebra(self):
+		a = pycpuid.FeatureSet(['SSE2', 'AVX2', 'LM'])
+		b = pycpuid.FeatureSet('AVX2 & XSAVEC')
+		self.assertEqual(list(a & b), ['AVX2'])
+		self.assertEqual(list(a | b), ['SSE2', 'AVX2', 'LM', 'XSAVEC'])
+		self.assertEqual(list(a - b), ['SSE2', 'LM'])
+		self.assertEqual(list(a ^ b), ['SSE2', 'LM', 'XSAVEC'])
+		self.assert_(a & b <= a and a >= a & b and a & b < a and not a < a)
+		self.assert_(not b <= a and (a | b) > b)
+		self.assertEqual(len(a), 3)
+		self.assert_('LM' in a and 'AVX' not in a and 'NOSUCH' not in a)
+		self.assert_(not pycpuid.FeatureSet())
+		self.assertRaises(ValueError, pycpuid.FeatureSet, ['NOSUCH'])
+
+	def test_mask(self):
+		a = pycpuid.FeatureSet(['SSE2', 'AVX2'])
+		self.assertEqual(pycpuid.FeatureSet(a.mask), a)
+		self.assertEqual(hash(pycpuid.FeatureSet(a.mask)), hash(a))
+		self.assertEqual(pycpuid.FeatureSet(1 << (3 * 32 + 26) | 1 << 20), pycpuid.FeatureSet('SSE2'))
+		for protocol in range(pickle.HIGHEST_PROTOCOL + 1):
+			self.assertEqual(pickle.loads(pickle.dumps(a, protocol)), a)
+			self.assertEqual(pickle.loads(pickle.dumps(pycpuid.FeatureSet(), protocol)), pycpuid.FeatureSet())
+
+	def test_snapshot(self):
+		snapshot = make_snapshot({(0, 0): (0xd, 0, 0, 0), (1, 0): (0, 0, 0, 1 << 26), (0xd, 1): (0x2, 0, 0, 0), (0x80000001, 0): (0, 0, 0, 1 << 29)})
+		self.assertEqual(pycpuid.feature_set(snapshot), pycpuid.FeatureSet('SSE2 & XSAVEC & LM'))
+
+class test_microarch(unittest.TestCase):
+	def snapshot(self, level):
+		features = pycpuid.FeatureSet()
+		for number, added in pycpuid.pycpuid._microarch_table[:level]:
+			features |= added
+		leaves = {(0, 0): (7, 0, 0, 0), (0x80000000, 0): (0x80000001, 0, 0, 0)}
+		for i, ((infotype, subleaf), table) in enumerate(pycpuid.pycpuid._feat_tables):
+			leaves[(infotype, subleaf)] = tuple((features.mask >> ((i * 4 + reg) * 32)) & 0xffffffff for reg in range(4))
+		return make_snapshot(leaves)
+
+	def test_levels(self):
+		for level in range(5):
+			snapshot = self.snapshot(level)
+			self.assertEqual(pycpuid.microarch_level(snapshot, 0xe7), level)
+		self.assertEqual(list(pycpuid.microarch_missing(None, self.snapshot(3), 0xe7)), ['AVX512F', 'AVX512DQ', 'AVX512CD', 'AVX512BW', 'AVX512VL'])
+		self.assertEqual(list(pycpuid.microarch_missing(2, self.snapshot(3), 0xe7)), [])
+		self.assertEqual(pycpuid.microarch_select({1: 'v1', 3: 'v3', 4: 'v4'}, self.snapshot(3), 0xe7), 'v3')
+		self.assertEqual(pycpuid.microarch_select({2: 'v2'}, self.snapshot(1), 0xe7), None)
+
+	def test_os_support(self):
+		snapshot = self.snapshot(4)
+		self.assertEqual(pycpuid.microarch_level(snapshot, 0x7), 3)
+		self.assertEqual(pycpuid.microarch_level(snapshot, 0x3), 2)
+		self.assertEqual(list(pycpuid.microarch_missing(3, snapshot, 0x3)), ['FMA', 'AVX', 'F16C', 'AVX2'])
+
+	def test_live(self):
+		level = pycpuid.microarch_level()
+		self.assert_(level >= 1)
+		self.assertEqual(bool(pycpuid.microarch_missing()), level < 4)
+		self.assertEqual(pycpuid.microarch_missing(level), pycpuid.FeatureSet())
+
+class test_tsc(unittest.TestCase):
+	def test_rdtsc(self):
+		first = pycpuid.rdtsc()
+		self.assert_(pycpuid.rdtsc() >= first > 0)
+		ticks = (ctypes.c_uint64 * 64)()
+		self.assertEqual(pycpuid.rdtsc_fill(ticks), 64)
+		self.assertEqual(sorted(ticks), ticks[:])
+		self.assert_(ticks[0] >= first)
+		self.assertEqual(pycpuid.rdtsc_fill(bytearray()), 0)
+		self.assertRaises(ValueError, pycpuid.rdtsc_fill, bytearray(12))
+		self.assertRaises(TypeError, pycpuid.rdtsc_fill, 'read-only')
+
+	def test_rdtscp(self):
+		if 'RDTSCP' not in pycpuid.feature_set():
+			self.assertRaises(ValueError, pycpuid.rdtscp)
+			return
+		first = pycpuid.rdtsc()
+		ticks, aux = pycpuid.rdtscp()
+		self.assert_(ticks >= first)
+		if sys.platform.startswith('linux'):
+			self.assert_(aux & 0xfff in pycpuid.affinity())
+
+	def test_invariant(self):
+		self.assertEqual(pycpuid.invariant_tsc(make_snapshot({(0x80000000, 0): (0x80000007, 0, 0, 0), (0x80000007, 0): (0, 0, 0, 0x100)})), True)
+		self.assertEqual(pycpuid.invariant_tsc(make_snapshot({(0x80000000, 0): (0x80000006, 0, 0, 0), (0x80000007, 0): (0, 0, 0, 0x100)})), False)
+
+	def test_frequency(self):
+		skylake = {(0, 0): (0x16, 0, 0, 0), (1, 0): (0x506e3, 0, 0, 0), (0x15, 0): (2, 284, 0, 0), (0x16, 0): (3400, 4000, 100, 0)}
+		self.assertEqual(pycpuid.tsc_frequency(make_snapshot(skylake)), 3408000000)
+		skylake[(1, 0)] = (0x50671, 0, 0, 0)
+		self.assert_(abs(pycpuid.tsc_frequency(make_snapshot(skylake)) - 3400000000) < 1000)
+		skylake[(0x15, 0)] = (2, 176, 38400000, 0)
+		self.assertEqual(pycpuid.tsc_frequency(make_snapshot(skylake)), 3379200000)
+		hypervisor = {(0, 0): (0xd, 0, 0, 0), (0x40000000, 0): (0x40000010, 0, 0, 0), (0x40000010, 0): (2592000, 1000000, 0, 0)}
+		self.assertEqual(pycpuid.tsc_frequency(make_snapshot(hypervisor)), 2592000000)
+		self.assertEqual(pycpuid.tsc_frequency(make_snapshot({(0, 0): (0xd, 0, 0, 0)})), None)
+		self.assertEqual(pycpuid.tsc_frequency(make_snapshot({(0, 0): (0x16, 0, 0, 0)})), None)
+
+class test_stats(unittest.TestCase):
+	def setUp(self):
+		pycpuid.reset_stats()
+
+	def tearDown(self):
+		pycpuid.disable_stats()
+		pycpuid.reset_stats()
+
+	def test_counts(self):
+		pycpuid.cpuid(0)
+		self.assertEqual(pycpuid.stats().total, 0)
+		pycpuid.enable_stats()
+		pycpuid.cpuid(0)
+		pycpuid.cpuid_many([0, 1, (4, 1)])
+		stats = pycpuid.stats()
+		self.assertEqual(stats.counts, {(0, 0): 2, (1, 0): 1, (4, 1): 1})
+		self.assertEqual(stats.total, 4)
+		self.assertEqual(len(stats.histogram), 64)
+		self.assertEqual(sum(stats.histogram), 4)
+		self.assert_(0 < stats.percentile(0.5) <= stats.percentile(1.0))
+		self.assertEqual(stats.callers, {})
+		pycpuid.disable_stats()
+		pycpuid.cpuid(0)
+		self.assertEqual(pycpuid.stats().counts, stats.counts)
+		stats.reset()
+		self.assertEqual(pycpuid.stats().counts, {})
+		self.assertEqual(stats.total, 4)
+		self.assertEqual(pycpuid.stats().percentile(0.5), 0)
+
+	def test_frames(self):
+		pycpuid.enable_stats(frames=True)
+		code = sys._getframe().f_code
+		pycpuid.cpuid(0); line = sys._getframe().f_lineno
+		snapshot = pycpuid.Snapshot.probe(); probe = sys._getframe().f_lineno
+		top = pycpuid.stats().top()
+		self.assertEqual(top, [((code.co_filename, probe, 'test_frames'), len(snapshot)), ((code.co_filename, line, 'test_frames'), 1)])
+		self.assertEqual(pycpuid.stats().top(1), top[:1])
+
+class test_xgetbv(unittest.TestCase):
+	def test_live(self):
+		if not pycpuid.HAS_OSXSAVE:
+			self.assertRaises(ValueError, pycpuid.xgetbv)
+			return
+		xcr0 = pycpuid.xgetbv()
+		self.assertEqual(xcr0 & pycpuid.XSTATE_X87, pycpuid.XSTATE_X87)
+		self.assertRaises(ValueError, pycpuid.xgetbv, 2)
+		self.assertEqual(pycpuid.usable_avx(), pycpuid.HAS_AVX and xcr0 & 0x6 == 0x6)
+		self.assert_(pycpuid.usable_features() <= pycpuid.feature_set())
+
+	def test_predicates(self):
+		snapshot = make_snapshot({(0, 0): (7, 0, 0, 0), (1, 0): (0, 0, 1 << 27 | 1 << 28, 0), (7, 0): (0, 1 << 16, 0, 1 << 24)})
+		self.assert_(pycpuid.usable_avx(snapshot, 0x7) and not pycpuid.usable_avx(snapshot, 0x3))
+		self.assert_(pycpuid.usable_avx512(snapshot, 0xe7) and not pycpuid.usable_avx512(snapshot, 0x7))
+		self.assert_(pycpuid.usable_amx(snapshot, 0x60007) and not pycpuid.usable_amx(snapshot, 0x20007))
+
+	def test_amx_permission(self):
+		if not sys.platform.startswith('linux'):
+			return
+		# Checking for AMX leaves the permissions of the process alone.
+		permitted = _impl._pycpuid.xcomp_perm()
+		pycpuid.usable_amx()
+		self.assertEqual(_impl._pycpuid.xcomp_perm(), permitted)
+		self.assertEqual(pycpuid.request_amx(), pycpuid.usable_amx())
+		self.assert_(not pycpuid.usable_avx(make_snapshot({(0, 0): (1, 0, 0, 0), (1, 0): (0, 0, 1 << 28, 0)})))
+
+class test_dispatch(unittest.TestCase):
+	def tearDown(self):
+		os.environ.pop('PYCPUID_DISPATCH', None)
+		dispatcher.reset()
+
+	def test_resolve(self):
+		snapshot = make_snapshot({(0, 0): (7, 0, 0, 0), (1, 0): (0, 0, 0, 1 << 26)})
+		self.assertEqual(dispatcher.resolve(snapshot), kernel_sse2)
+		snapshot = make_snapshot({(0, 0): (7, 0, 0, 0), (1, 0): (0, 0, 1 << 27, 1 << 26), (7, 0): (0, 1 << 31 | 1 << 16, 0, 0)})
+		self.assertEqual(dispatcher.resolve(snapshot, 0xe7), kernel_avx512)
+		self.assertEqual(dispatcher.resolve(snapshot, 0x7), kernel_sse2)
+		self.assertEqual(dispatcher.resolve(make_snapshot({})), dispatcher.variants()[-1][1])
+
+	def test_priority(self):
+		# AVX-512 is preferred to AVX2 despite listing fewer features.
+		leaves = {(0, 0): (7, 0, 0, 0), (1, 0): (0, 0, 1 << 12 | 1 << 27 | 1 << 28, 1 << 26), (7, 0): (0, 1 << 31 | 1 << 16 | 1 << 8 | 1 << 5, 0, 0)}
+		snapshot = make_snapshot(leaves)
+		self.assertEqual(dispatcher.resolve(snapshot, 0xe7), kernel_avx512)
+		self.assertRaises(TypeError, dispatcher.register, 'SSE2', weight=1)
+
+	def test_superset(self):
+		# Of equal priority, a superset of another's requirements wins even
+		# when registered later.
+		leaves = {(0, 0): (7, 0, 0, 0), (1, 0): (0, 0, 1 << 12 | 1 << 27 | 1 << 28, 1 << 26), (7, 0): (0, 1 << 8 | 1 << 5, 0, 0)}
+		self.assertEqual(dispatcher.resolve(make_snapshot(leaves), 0x7), kernel_avx2)
+		leaves[7, 0] = (0, 1 << 5, 0, 0)
+		self.assertEqual(dispatcher.resolve(make_snapshot(leaves), 0x7), kernel_fma)
+
+	def test_rebind(self):
+		from pycpuid.backends import ReplayBackend
+		leaves = {(0, 0): (7, 0, 0, 0), (1, 0): (0, 0, 0, 1 << 26)}
+		previous = pycpuid.set_backend(ReplayBackend.from_leaves(leaves))
+		try:
+			self.assert_(kernel is dispatcher)
+			self.assertEqual(dispatcher.selected, None)
+			self.assertEqual(dispatcher(), 'sse2')
+			self.assert_(kernel is kernel_sse2)
+			self.assertEqual(pycpuid.dispatched()[dispatcher.name], 'kernel_sse2')
+			dispatcher.reset()
+			self.assert_(kernel is dispatcher)
+		finally:
+			pycpuid.set_backend(previous)
+
+	def test_override(self):
+		os.environ['PYCPUID_DISPATCH'] = 'other=x, test.kernel = kernel'
+		self.assertEqual(kernel(), 'generic')
+		dispatcher.reset()
+		os.environ['PYCPUID_DISPATCH'] = 'kernel=kernel_missing'
+		self.assertRaises(ValueError, kernel)
+
+	def test_unknown_feature(self):
+		self.assertRaises(ValueError, dispatcher.register, 'SSE2 & NOSUCH')
+
+class test_topology(unittest.TestCase):
+	def test_extended(self):
+		# Two packages of two cores with two threads each, numbered like Linux.
+		snapshots = {}
+		for package in range(2):
+			for core in range(2):
+				for thread in range(2):
+					x2apic = package << 2 | core << 1 | thread
+					snapshots[thread * 4 + package * 2 + core] = make_snapshot({
+						(0, 0): (0xb, 0, 0, 0),
+						(0xb, 0): (1, 2, 0x100, x2apic),
+						(0xb, 1): (2, 4, 0x201, x2apic),
+						(0xb, 2): (0, 0, 2, x2apic),
+						})
+		topology = pycpuid.topology(snapshots)
+		self.assertEqual(topology.cpus(), range(8))
+		self.assertEqual(topology.packages(), [0, 1])
+		self.assertEqual(topology.cores(), ((0, 0), (0, 1), (1, 0), (1, 1)))
+		self.assertEqual(topology.cores(1), ((1, 0), (1, 1)))
+		self.assertEqual(topology.core(5), (0, 1))
+		self.assertEqual(topology.package(6), 1)
+		self.assertEqual(topology.threads((1, 0)), (2, 6))
+		self.assertEqual(topology.siblings(3), (3, 7))
+		self.assertEqual(pycpuid.topology_levels(snapshots[0]), [('SMT', 1), ('Core', 2)])
+
+	def test_legacy(self):
+		# One package of four cores without SMT, reported by leaves 1 and 4.
+		snapshots = {}
+		for cpu in range(4):
+			snapshots[cpu] = make_snapshot({
+				(0, 0): (4, 0x756e6547, 0x6c65746e, 0x49656e69),
+				(1, 0): (0, cpu << 24 | 4 << 16, 0, 1 << 28),
+				(4, 0): (3 << 26 | 1, 0, 0, 0),
+				})
+		topology = pycpuid.topology(snapshots)
+		self.assertEqual(topology.cores(), ((0, 0), (0, 1), (0, 2), (0, 3)))
+		self.assertEqual(topology.siblings(2), (2,))
+
+	def test_live(self):
+		topology = pycpuid.topology()
+		self.assertEqual(topology.cpus(), pycpuid.affinity())
+		for cpu in topology.cpus():
+			self.assert_(cpu in topology.threads(topology.core(cpu)))
+
+class test_hybrid(unittest.TestCase):
+	def hybrid(self, kind):
+		# Leaves 0x0, 0x7 and 0x1A as recorded on a Core i9-12900K.
+		return make_snapshot({
+			(0, 0): (0x20, 0x756e6547, 0x6c65746e, 0x49656e69),
+			(7, 0): (0x2, 0x239c27eb, 0x98c027bc, 0xfc1cc410),
+			(0x1a, 0): (kind << 24 | 0x1, 0, 0, 0),
+			})
+
+	def setUp(self):
+		self.cpus = pycpuid.affinity()
+
+	def tearDown(self):
+		pycpuid.set_affinity(self.cpus)
+
+	def test_core_type(self):
+		self.assertEqual(pycpuid.core_type(self.hybrid(0x40)), 'performance')
+		self.assertEqual(pycpuid.core_type(self.hybrid(0x20)), 'efficiency')
+		self.assertEqual(pycpuid.core_type(self.hybrid(0x10)), 'unknown-0x10')
+		self.assertEqual(pycpuid.core_type(make_snapshot({(0, 0): (0x1a, 0, 0, 0), (0x1a, 0): (0x40000001, 0, 0, 0)})), None)
+
+	def test_core_types(self):
+		snapshots = dict((cpu, self.hybrid(0x40 if cpu < 4 else 0x20)) for cpu in range(6))
+		self.assertEqual(pycpuid.core_types(snapshots), {'performance': [0, 1, 2, 3], 'efficiency': [4, 5]})
+		self.assertEqual(pycpuid.core_types({0: make_snapshot({}), 1: make_snapshot({})}), {None: [0, 1]})
+
+	def test_set_affinity(self):
+		cpu = self.cpus[-1]
+		pycpuid.set_affinity([cpu])
+		self.assertEqual(pycpuid.affinity(), [cpu])
+		pycpuid.set_affinity(self.cpus, process=True)
+		self.assertEqual(pycpuid.affinity(), self.cpus)
+		self.assertRaises(ValueError, pycpuid.set_affinity, [-1])
+
+	def test_pin_core_type(self):
+		cpu = self.cpus[-1]
+		snapshots = {cpu: self.hybrid(0x40), cpu + 1: self.hybrid(0x20)}
+		self.assertEqual(pycpuid.pin_core_type('performance', snapshots=snapshots), [cpu])
+		self.assertEqual(pycpuid.affinity(), [cpu])
+		self.assertRaises(ValueError, pycpuid.pin_core_type, 'efficiency', snapshots={cpu: self.hybrid(0x40)})
+		# Every processor of a part which is not hybrid has any kind of core.
+		self.assertEqual(pycpuid.pin_core_type('efficiency', snapshots={cpu: make_snapshot({})}), [cpu])
+
 if __name__ == "__main__":
 	unittest.main()
@@ -0,0 +1,173 @@
+import array
+import os
+import shutil
+import struct
+import tempfile
+import threading
+import unittest
+import pycpuid
+from pycpuid import backends
+from pycpuid import pycpuid as _impl
+
+# Trimmed output of ``cpuid -r`` on two logical processors of a Core i7-8700.
+dump = '''\
+CPU 0:
+   0x00000000 0x00: eax=0x00000004 ebx=0x756e6547 ecx=0x6c65746e edx=0x49656e69
+   0x00000001 0x00: eax=0x000906ea ebx=0x00100800 ecx=0x7ffafbbf edx=0xbfebfbff
+   0x00000004 0x00: eax=0x1c004121 ebx=0x01c0003f ecx=0x0000003f edx=0x00000000
+   0x00000004 0x01: eax=0x1c004122 ebx=0x01c0003f ecx=0x0000003f edx=0x00000000
+   0x00000004 0x02: eax=0x1c004143 ebx=0x00c0003f ecx=0x000003ff edx=0x00000000
+   0x00000004 0x03: eax=0x1c03c163 ebx=0x03c0003f ecx=0x00002fff edx=0x00000006
+   0x80000000 0x00: eax=0x80000004 ebx=0x00000000 ecx=0x00000000 edx=0x00000000
+   0x80000001 0x00: eax=0x00000000 ebx=0x00000000 ecx=0x00000121 edx=0x2c100800
+   0x80000002 0x00: eax=0x65746e49 ebx=0x2952286c ecx=0x726f4320 edx=0x4d542865
+   0x80000003 0x00: eax=0x37692029 ebx=0x3037382d ecx=0x50432030 edx=0x20402055
+   0x80000004 0x00: eax=0x30322e33 ebx=0x007a4847 ecx=0x00000000 edx=0x00000000
+CPU 1:
+   0x00000000 0x00: eax=0x00000004 ebx=0x756e6547 ecx=0x6c65746e edx=0x49656e69
+   0x00000001 0x00: eax=0x000906ea ebx=0x02100800 ecx=0x7ffafbbf edx=0xbfebfbff
+'''
+
+class test_backends(unittest.TestCase):
+	def tearDown(self):
+		pycpuid.set_backend(None)
+
+	def test_parse_cpuid_r(self):
+		cpus = backends.parse_cpuid_r(dump)
+		self.assertEqual(sorted(cpus), [0, 1])
+		self.assertEqual(cpus[0][(4, 3)], (0x1c03c163, 0x03c0003f, 0x2fff, 6))
+		self.assertEqual(len(cpus[1]), 2)
+		self.assertEqual(backends.parse_cpuid_r(dump.split('CPU 1:')[1]).keys(), [0])
+		self.assertRaises(ValueError, backends.parse_cpuid_r, 'CPU 0:\n')
+
+	def test_parse_raw(self):
+		data = struct.pack('<8I', 1, 2, 3, 4, 5, 6, 7, 8)
+		self.assertEqual(backends.parse_raw(data), {(0, 0): (1, 2, 3, 4), (1, 0): (5, 6, 7, 8)})
+		self.assertEqual(sorted(backends.parse_raw(data, 1 << 32 | 7)), [(7, 1), (8, 1)])
+		self.assertRaises(ValueError, backends.parse_raw, data[:-1])
+		backend = backends.ReplayBackend.from_raw(data)
+		self.assertEqual(backend.cpuid(1), (5, 6, 7, 8))
+
+	def test_replay(self):
+		executed = _impl._pycpuid.executions()
+		previous = pycpuid.set_backend(backends.ReplayBackend.from_cpuid_r(dump))
+		self.assert_(previous.live)
+		self.assert_(not pycpuid.get_backend().live)
+		self.assertEqual(pycpuid.vendor(), 'GenuineIntel')
+		self.assertEqual((pycpuid.family(), pycpuid.model(), pycpuid.stepping_id()), (6, 0x9e, 0xa))
+		self.assertEqual(pycpuid.brand_string(), 'Intel(R) Core(TM) i7-8700 CPU @ 3.20GHz')
+		self.assertEqual([cache.level for cache in pycpuid.caches()], [1, 1, 2, 3])
+		self.assertEqual(pycpuid.caches()[3].size, 12 << 20)
+		self.assert_('SSE4_2' in pycpuid.feature_set() and 'LZCNT' in pycpuid.feature_set())
+		self.assert_('AVX' not in pycpuid.usable_features())
+		self.assertEqual(dict((cpu, pycpuid.apic_id(snapshot)) for cpu, snapshot in pycpuid.dump_all_cpus().items()), {0: 0, 1: 2})
+		self.assertEqual(_impl._pycpuid.executions(), executed)
+		pycpuid.set_backend(None)
+		self.assertEqual(pycpuid.vendor(), pycpuid.vendor(pycpuid.Snapshot.probe()))
+
+	def test_replay_snapshot(self):
+		snapshot = pycpuid.Snapshot.probe()
+		pycpuid.set_backend(backends.ReplayBackend.from_snapshots(pycpuid.Snapshot.from_buffer(snapshot.to_bytes())))
+		self.assertEqual(pycpuid.default_snapshot(), snapshot)
+		self.assertEqual(pycpuid.feature_set(), pycpuid.feature_set(snapshot))
+		self.assertEqual(pycpuid.cpuid(1, 3), snapshot.cpuid(1))
+
+	def test_replay_cpuid_many(self):
+		keys = [(0, 0), (1, 0), (4, 2)]
+		backend = backends.ReplayBackend.from_array(keys, pycpuid.cpuid_many(keys))
+		requests = array.array('I', [0, 0, 4, 2, 0x4fffffff, 0])
+		out = array.array('I', [0] * 12)
+		self.assert_(backend.cpuid_many(requests, out) is out)
+		self.assertEqual(out[:4].tolist(), list(pycpuid.cpuid(0)))
+		self.assertEqual(out[4:8].tolist(), list(pycpuid.cpuid(4, 2)))
+		self.assertEqual(out[8:].tolist(), [0] * 4)
+		self.assertEqual(backend.cpuid_many([(1,), 4]), backend.cpuid_many([(1, 0), (4, 0)]))
+		self.assertEqual(backend.cpuid_many([(1,)]), pycpuid.cpuid_many([(1,)]))
+		self.assertRaises(ValueError, backend.cpuid_many, [0, 1], bytearray(16))
+		self.assertRaises(ValueError, backend.cpuid_many, [0], cpu=1)
+		self.assertRaises(ValueError, backends.ReplayBackend.from_array, keys, bytearray(16))
+
+class counting_device(backends.DeviceBackend):
+	reads = 0
+
+	def _read(self, fd, position, count):
+		self.reads += 1
+		return backends.DeviceBackend._read(self, fd, position, count)
+
+class test_device(unittest.TestCase):
+	def setUp(self):
+		self.cpu = pycpuid.affinity()[0]
+		if not os.access(backends.DEVICE_PATH % self.cpu, os.R_OK):
+			self.skipTest('the cpuid device is not readable')
+
+	def test_runs(self):
+		self.assertEqual(backends._runs([(0, 0), (1, 0), (2, 0), (1, 0), (4, 1), (5, 1)]), [[0, 3], [1, 1], [1 << 32 | 4, 2]])
+		self.assertEqual(backends._runs([]), [])
+
+	def test_read(self):
+		backend = counting_device()
+		keys = [0, 1, 2, (4, 0), (4, 1), (4, 2), pycpuid.EXTENDED_OFFSET, pycpuid.EXTENDED_OFFSET | 1]
+		executed = _impl._pycpuid.executions()
+		regs = backend.cpuid_many(keys, cpu=self.cpu)
+		self.assertEqual(_impl._pycpuid.executions(), executed)
+		self.assertEqual(backend.reads, 5)
+		self.assertEqual(regs, pycpuid.get_backend().cpuid_many(keys, cpu=self.cpu))
+		out = bytearray(32)
+		self.assert_(backend.cpuid_many([0, 1], out, self.cpu) is out)
+		self.assertEqual(out, regs[:32])
+		backend.close()
+
+	def test_snapshot(self):
+		pycpuid.set_backend(backends.DeviceBackend(max_open=1))
+		try:
+			snapshots = pycpuid.dump_all_cpus()
+			self.assertEqual(sorted(snapshots), pycpuid.affinity())
+			live = pycpuid.LiveBackend()
+			for cpu, snapshot in snapshots.items():
+				self.assertEqual(snapshot.cpuid(0), struct.unpack('4I', str(live.cpuid_many([0], cpu=cpu))))
+		finally:
+			pycpuid.get_backend().close()
+			pycpuid.set_backend(None)
+
+class test_device_fallback(unittest.TestCase):
+	def test_fallback(self):
+		backend = counting_device('/nonexistent/%d/cpuid')
+		cpu = pycpuid.affinity()[0]
+		executed = _impl._pycpuid.executions()
+		self.assertEqual(backend.cpuid_many([0], cpu=cpu), pycpuid.cpuid_many([0], cpu=cpu))
+		self.assertEqual(backend.reads, 0)
+		self.assert_(_impl._pycpuid.executions() > executed)
+		self.assertEqual(backend.cpuid(0), pycpuid.cpuid(0))
+
+class test_device_locks(unittest.TestCase):
+	def setUp(self):
+		# Files standing in for the devices of three processors, each holding
+		# leaf 0x0.
+		self.directory = tempfile.mkdtemp()
+		for cpu in range(3):
+			open(os.path.join(self.directory, str(cpu)), 'wb').write(struct.pack('4I', cpu, 0, 0, 0))
+		self.backend = backends.DeviceBackend(os.path.join(self.directory, '%d'), max_open=1)
+
+	def tearDown(self):
+		self.backend.close()
+		shutil.rmtree(self.directory)
+
+	def read(self, cpu):
+		return struct.unpack('4I', str(self.backend.cpuid_many([0], cpu=cpu)))
+
+	def test_independent(self):
+		self.assertEqual(self.read(0), (0, 0, 0, 0))
+		results = []
+		reader = threading.Thread(target=lambda: results.append(self.read(1)))
+		# A read of processor 0 in progress neither blocks processor 1 nor has
+		# its device closed under it.
+		with self.backend._cpu_lock(0):
+			reader.start()
+			reader.join(5)
+			self.assertEqual(results, [(1, 0, 0, 0)])
+			self.assertEqual(sorted(self.backend._fds), [0, 1])
+		self.assertEqual(self.read(2), (2, 0, 0, 0))
+		self.assertEqual(sorted(self.backend._fds), [2])
+
+if __name__ == "__main__":
+	unittest.main()
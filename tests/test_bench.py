@@ -0,0 +1,85 @@
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+import pycpuid
+from pycpuid import bench
+from pycpuid import pycpuid as _impl
+
+class test_bench(unittest.TestCase):
+	def setUp(self):
+		self.directory = tempfile.mkdtemp()
+
+	def tearDown(self):
+		shutil.rmtree(self.directory)
+
+	def test_measure(self):
+		self.assert_(bench.measure(lambda: None, 0.001, 2) > 0)
+
+	def test_benchmarks(self):
+		names = bench.benchmarks()
+		for name in 'cpuid/0x0', 'probe', 'accessor/features', 'accessor/brand_string', 'accessor/model', 'dispatch/call', 'decode/snapshots':
+			self.assert_(name in names, name)
+		self.assertEqual(names['decode/snapshots'].operations, bench.BULK_SIZE)
+
+	def test_dispatch(self):
+		# The benchmark dispatcher is kept out of the registry, and its name is
+		# rebound to the implementation the call benchmark measures.
+		bench.benchmarks()
+		self.assert_(bench._dispatcher not in _impl._dispatchers)
+		self.assert_(bench._dispatcher.name not in pycpuid.dispatched())
+		self.assert_(bench._kernel is bench._dispatcher.selected)
+		pycpuid.refresh()
+		self.assert_(bench._kernel is bench._dispatcher.selected)
+
+	def test_no_brand_string(self):
+		from pycpuid.backends import ReplayBackend
+		previous = pycpuid.set_backend(ReplayBackend.from_leaves({(0, 0): (1, 0, 0, 0), (pycpuid.EXTENDED_OFFSET, 0): (pycpuid.EXTENDED_OFFSET | 0x1, 0, 0, 0)}))
+		try:
+			self.assert_('accessor/brand_string' not in bench.benchmarks())
+			self.assertEqual(bench.report({})['brand_string'], None)
+		finally:
+			pycpuid.set_backend(previous)
+
+	def test_run(self):
+		results = bench.run(['cpuid/0x0', 'accessor/model', 'import'], 0.001, 1)
+		self.assertEqual(sorted(results), ['accessor/model', 'cpuid/0x0', 'import', 'import+first_access'])
+		for value in results.values():
+			self.assert_(value > 0)
+
+	def test_compare(self):
+		baseline = {'a': 100.0, 'b': 100.0, 'c': 100.0}
+		results = {'a': 105.0, 'b': 120.0, 'c': 80.0, 'd': 1000.0}
+		self.assertEqual(bench.compare(results, baseline), {'b': 1.2})
+		self.assertEqual(bench.compare(results, baseline, 0.01), {'a': 1.05, 'b': 1.2})
+		document = bench.report(results, baseline)
+		self.assertEqual((document['unit'], document['vendor']), ('ns', pycpuid.vendor()))
+		self.assertEqual(document['regressions'], {'b': 1.2})
+		self.assert_('regressions' not in bench.report(results))
+
+	def test_main(self):
+		output = os.path.join(self.directory, 'results.json')
+		self.assertEqual(bench.main(['--budget', '0.001', '-r', '1', '-o', output, 'cpuid/0x0']), 0)
+		with open(output) as f:
+			document = json.load(f)
+		self.assertEqual(document['results'].keys(), ['cpuid/0x0'])
+		document['results']['cpuid/0x0'] /= 1000
+		with open(output, 'w') as f:
+			json.dump(document, f)
+		self.assertEqual(bench.main(['--budget', '0.001', '-r', '1', '-b', output, '-o', output, 'cpuid/0x0']), 1)
+		with open(output) as f:
+			self.assertEqual(json.load(f)['regressions'].keys(), ['cpuid/0x0'])
+
+	def test_module(self):
+		root = os.path.dirname(os.path.dirname(os.path.abspath(pycpuid.__file__)))
+		process = subprocess.Popen([sys.executable, '-m', 'pycpuid.bench', '--budget', '0.001', '-r', '1', 'accessor/vendor'],
+			cwd=root, stdout=subprocess.PIPE)
+		document = json.loads(process.communicate()[0])
+		self.assertEqual(process.returncode, 0)
+		self.assertEqual(document['results'].keys(), ['accessor/vendor'])
+
+if __name__ == "__main__":
+	unittest.main()
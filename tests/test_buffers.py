@@ -0,0 +1,79 @@
+import threading
+import unittest
+import pycpuid
+from pycpuid import buffers
+
+try:
+	import numpy
+except ImportError:
+	numpy = None
+
+class test_buffers(unittest.TestCase):
+	def test_aligned(self):
+		line = pycpuid.cache_line_size()
+		for size in 0, 1, 100, 4096:
+			buf = buffers.aligned(size)
+			self.assertEqual(len(buf), size)
+			self.assertEqual(buffers.address(buf) % line, 0)
+		buf = buffers.aligned(100, 'page')
+		self.assertEqual(buffers.address(buf) % buffers.PAGE_SIZE, 0)
+		buf[:3] = 'abc'
+		self.assertEqual(buf.tobytes()[:4], 'abc\0')
+		self.assertEqual(buffers.address(buffers.aligned(8, 256)) % 256, 0)
+		self.assertRaises(ValueError, buffers.aligned, 8, 48)
+		self.assertRaises(ValueError, buffers.aligned, -1)
+
+	def test_aligned_array(self):
+		if numpy is None:
+			return
+		array = buffers.aligned_array((3, 5), numpy.uint32, 'page')
+		self.assertEqual(array.shape, (3, 5))
+		self.assertEqual(array.ctypes.data % buffers.PAGE_SIZE, 0)
+		array[2, 4] = 7
+		self.assertEqual(array.sum(), 7)
+
+	def test_slots(self):
+		slots = buffers.PaddedSlots(4)
+		line = pycpuid.cache_line_size()
+		self.assertEqual(len(slots), 4)
+		self.assertEqual(slots.offset(3), 3 * line)
+		for slot in range(4):
+			self.assertEqual((buffers.address(slots.buffer()) + slots.offset(slot)) % line, 0)
+		slots.add(1, 5)
+		slots[3] = 2
+		self.assertEqual((slots[0], slots[1], slots.total()), (0, 5, 7))
+		self.assertRaises(IndexError, slots.add, 4)
+		self.assertRaises(ValueError, buffers.PaddedSlots, 4, 12)
+
+	def test_thread_slot(self):
+		slots = buffers.PaddedSlots(2)
+		owned = []
+		def count():
+			slot = slots.thread_slot()
+			owned.append(slot)
+			for i in range(1000):
+				slots.add(slot)
+		threads = [threading.Thread(target=count) for i in range(2)]
+		for thread in threads:
+			thread.start()
+		for thread in threads:
+			thread.join()
+		self.assertEqual(sorted(owned), [0, 1])
+		self.assertEqual(slots.total(), 2000)
+		self.assertRaises(IndexError, slots.thread_slot)
+
+	def test_increment_slot(self):
+		slots = buffers.PaddedSlots(2)
+		pycpuid._pycpuid.increment_slot(slots.buffer(), slots.offset(1), 1000)
+		self.assertEqual((slots[0], slots[1]), (0, 1000))
+		self.assertRaises(ValueError, pycpuid._pycpuid.increment_slot, slots.buffer(), 4, 1)
+		self.assertRaises(ValueError, pycpuid._pycpuid.increment_slot, slots.buffer(), 2 * slots.padding, 1)
+
+	def test_false_sharing(self):
+		result = buffers.false_sharing(2, 10000, 1)
+		self.assertEqual(result['threads'], 2)
+		self.assert_(result['packed'] > 0 and result['padded'] > 0)
+		self.assertEqual(result['ratio'], result['packed'] / result['padded'])
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,33 @@
+import time
+import unittest
+import pycpuid
+from pycpuid import clock
+
+class test_clock(unittest.TestCase):
+	def test_given(self):
+		tsc = clock.TscClock(2000000000)
+		self.assertEqual(tsc.source, 'given')
+		self.assertEqual(tsc.to_ns(3000), 1500)
+		self.assertEqual(tsc.reliable, pycpuid.invariant_tsc())
+		self.assertRaises(ValueError, clock.TscClock, 0)
+
+	def test_default(self):
+		tsc = clock.default_clock()
+		self.assert_(clock.default_clock() is tsc)
+		self.assertEqual(tsc.source, 'cpuid' if pycpuid.tsc_frequency() else 'calibrated')
+		start, ns = tsc.ticks(), tsc.now_ns()
+		time.sleep(0.02)
+		elapsed = tsc.to_ns(tsc.ticks() - start)
+		self.assert_(tsc.now_ns() - ns >= 0)
+		if tsc.reliable:
+			self.assert_(10000000 < elapsed < 1000000000, elapsed)
+
+	def test_calibrate(self):
+		frequency = clock.calibrate(0.02)
+		self.assert_(frequency > 0)
+		reported = pycpuid.tsc_frequency()
+		if reported and pycpuid.invariant_tsc():
+			self.assert_(abs(frequency - reported) < reported * 0.1, (frequency, reported))
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,83 @@
+import unittest
+import pycpuid
+from pycpuid import EXTENDED_OFFSET
+from fixtures import make_snapshot
+
+try:
+	import numpy
+	from pycpuid import fleet
+except ImportError:
+	numpy = None
+
+intel = {
+	(0, 0): (0xd, 0x756e6547, 0x6c65746e, 0x49656e69),
+	(1, 0): (0x906ea, 0x100800, 0x7ffafbbf, 0xbfebfbff),
+	(4, 0): (0x1c004121, 0x1c0003f, 0x3f, 0),
+	(4, 1): (0x1c004122, 0x1c0003f, 0x3f, 0),
+	(4, 2): (0x1c004143, 0xc0003f, 0x3ff, 0),
+	(4, 3): (0x1c03c163, 0x3c0003f, 0x2fff, 6),
+	(4, 4): (0, 0, 0, 0),
+	(7, 0): (0, 0x29c6fbf, 0, 0x9c002400),
+	(0xd, 0): (0x1f, 0x440, 0x440, 0),
+	(EXTENDED_OFFSET, 0): (0x80000008, 0, 0, 0),
+	(EXTENDED_OFFSET | 0x1, 0): (0, 0, 0x121, 0x2c100800),
+	}
+
+amd = {
+	(0, 0): (0x1, 0x68747541, 0x444d4163, 0x69746e65),
+	(1, 0): (0x20f12, 0x800, 0x2001, 0x178bfbff),
+	(EXTENDED_OFFSET, 0): (0x80000008, 0, 0, 0),
+	(EXTENDED_OFFSET | 0x1, 0): (0x20f12, 0, 0x1f, 0xebd3fbff),
+	(EXTENDED_OFFSET | 0x5, 0): (0, 0, 0x40020140, 0x40020140),
+	(EXTENDED_OFFSET | 0x6, 0): (0, 0, 0x2008140, 0x108040),
+	}
+
+@unittest.skipIf(numpy is None, 'NumPy is not installed')
+class test_fleet(unittest.TestCase):
+	def check(self, snapshots, xcr0=None):
+		columns = fleet.decode(fleet.to_array(snapshots), xcr0=xcr0)
+		for row, snapshot in enumerate(snapshots):
+			self.assertEqual(columns['vendor'][row], pycpuid.vendor(snapshot))
+			self.assertEqual(columns['family'][row], pycpuid.family(snapshot))
+			self.assertEqual(columns['model'][row], pycpuid.model(snapshot))
+			self.assertEqual(columns['stepping'][row], pycpuid.stepping_id(snapshot))
+			self.assertEqual(fleet.feature_sets(columns['features'])[row], pycpuid.feature_set(snapshot))
+			sizes = {}
+			for cache in pycpuid.caches(snapshot):
+				name = 'l%d%s' % (cache.level, {'data': 'd', 'instruction': 'i'}.get(cache.type, ''))
+				sizes[name] = sizes.get(name, 0) + cache.size
+			for name in 'l1d', 'l1i', 'l2', 'l3':
+				self.assertEqual(columns[name][row], sizes.get(name, 0))
+		return columns
+
+	def test_recorded(self):
+		snapshots = [make_snapshot(intel), make_snapshot(amd), make_snapshot(intel)]
+		columns = self.check(snapshots)
+		self.assertEqual(columns['vendor'].tolist(), ['GenuineIntel', 'AuthenticAMD', 'GenuineIntel'])
+		self.assertEqual(columns['l3'].tolist(), [12 << 20, 2 << 20, 12 << 20])
+		self.assertEqual(columns['microarch_level'].tolist(), [3, 1, 3])
+		for row, snapshot in enumerate(snapshots):
+			self.assertEqual(columns['microarch_level'][row], pycpuid.microarch_level(snapshot, 0x1f if row != 1 else 0))
+		self.assertEqual(fleet.has_features(columns['usable'], 'AVX2 & FMA').tolist(), [True, False, True])
+		columns = fleet.decode(fleet.to_array(snapshots), xcr0=[0x3, 0, 0x7])
+		self.assertEqual(columns['microarch_level'].tolist(), [2, 1, 3])
+
+	def test_live(self):
+		snapshot = pycpuid.Snapshot.probe()
+		xcr0 = pycpuid.xgetbv() if 'OSXSAVE' in pycpuid.feature_set(snapshot) else 0
+		columns = self.check([snapshot], xcr0)
+		self.assertEqual(columns['microarch_level'][0], pycpuid.microarch_level(snapshot, xcr0))
+		self.assertEqual(fleet.feature_sets(columns['usable'])[0], pycpuid.usable_features(snapshot, xcr0))
+
+	def test_keys(self):
+		keys = [(1, 0), (0, 0)]
+		regs = fleet.to_array([make_snapshot(intel)], keys)
+		self.assertEqual(regs.shape, (1, 2, 4))
+		columns = fleet.decode(regs, keys)
+		self.assertEqual(columns['family'].tolist(), [6])
+		self.assertEqual(columns['l3'].tolist(), [0])
+		self.assertRaises(ValueError, fleet.decode, regs)
+		self.assertEqual(fleet.decode(numpy.zeros((0, len(fleet.LEAVES), 4)))['family'].shape, (0,))
+
+if __name__ == "__main__":
+	unittest.main()
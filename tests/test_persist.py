@@ -0,0 +1,77 @@
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+import pycpuid
+from pycpuid import persist
+from fixtures import make_snapshot
+
+class test_persist(unittest.TestCase):
+	def setUp(self):
+		self.directory = tempfile.mkdtemp()
+		self.path = os.path.join(self.directory, 'snapshot')
+
+	def tearDown(self):
+		shutil.rmtree(self.directory)
+
+	def test_round_trip(self):
+		snapshot = pycpuid.Snapshot.probe()
+		self.assertEqual(persist.save(snapshot, self.path), self.path)
+		self.assertEqual(os.listdir(self.directory), ['snapshot'])
+		loaded = persist.load(self.path)
+		self.assertEqual(loaded, snapshot)
+		self.assertEqual(pycpuid.vendor(loaded), pycpuid.vendor())
+
+	def test_invalid(self):
+		self.assertEqual(persist.load(self.path), None)
+		snapshot = pycpuid.Snapshot.probe()
+		persist.save(snapshot, self.path)
+		data = open(self.path, 'rb').read()
+		for corrupt in '', data[:-1], 'X' + data[1:], data[:8] + '\xff' + data[9:]:
+			open(self.path, 'wb').write(corrupt)
+			self.assertEqual(persist.load(self.path), None)
+
+	def test_mismatch(self):
+		leaves = dict((key, pycpuid.Snapshot.probe().cpuid(*key)) for key in [(0, 0), (1, 0)])
+		leaves[(1, 0)] = (leaves[(1, 0)][0] ^ 0xf,) + leaves[(1, 0)][1:]
+		persist.save(make_snapshot(leaves), self.path)
+		self.assertEqual(persist.load(self.path), None)
+
+	def test_other_boot(self):
+		persist.save(pycpuid.Snapshot.probe(), self.path)
+		data = open(self.path, 'rb').read()
+		magic, version, boot = persist._header.unpack_from(data)
+		open(self.path, 'wb').write(persist._header.pack(magic, version, 'x' * 36) + data[persist._header.size:])
+		self.assertEqual(persist.load(self.path), None)
+
+	def test_prune(self):
+		boot = persist.boot_id()
+		if boot is None:
+			return
+		os.environ['PYCPUID_CACHE_DIR'] = self.directory
+		try:
+			for name in 'snapshot-stale-0123456789abcdef', 'snapshot-%s-0123456789abcdef' % boot, 'other':
+				open(os.path.join(self.directory, name), 'wb').close()
+			path = persist.save(pycpuid.Snapshot.probe())
+		finally:
+			del os.environ['PYCPUID_CACHE_DIR']
+		self.assertEqual(sorted(os.listdir(self.directory)), sorted(['other', 'snapshot-%s-0123456789abcdef' % boot, os.path.basename(path)]))
+
+	def test_environment(self):
+		if persist.boot_id() is None:
+			return
+		code = 'import pycpuid, pycpuid._pycpuid as c; pycpuid.HAS_SSE2; print c.executions()'
+		root = os.path.dirname(os.path.dirname(os.path.abspath(pycpuid.__file__)))
+		env = dict(os.environ, PYCPUID_CACHE='1', PYCPUID_CACHE_DIR=self.directory)
+		counts = []
+		for i in range(2):
+			process = subprocess.Popen([sys.executable, '-c', code], cwd=root, env=env, stdout=subprocess.PIPE)
+			counts.append(int(process.communicate()[0]))
+		self.assertEqual(len(os.listdir(self.directory)), 1)
+		self.assertEqual(counts[1], 2)
+		self.assert_(counts[0] > counts[1])
+
+if __name__ == "__main__":
+	unittest.main()
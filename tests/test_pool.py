@@ -0,0 +1,107 @@
+import Queue
+import threading
+import unittest
+import warnings
+import pycpuid
+from pycpuid import pool
+from fixtures import ccx_snapshots
+
+def pinned(item):
+	return pool.worker_cpu(), pycpuid.affinity()
+
+class test_pool(unittest.TestCase):
+	def setUp(self):
+		# Two packages of two cores with two threads each, numbered like Linux.
+		placement = {}
+		for package in range(2):
+			for core in range(2):
+				for thread in range(2):
+					placement[thread * 4 + package * 2 + core] = (package, core, thread)
+		self.topology = pycpuid.Topology(placement)
+
+	def test_cores(self):
+		placements = pool.plan(topology=self.topology)
+		self.assertEqual([placement.cpu for placement in placements], [0, 1, 2, 3])
+		self.assertEqual(placements[3], pool.Placement(3, 3, 1, (1, 1)))
+		self.assertEqual([placement.cpu for placement in pool.plan(6, topology=self.topology)], [0, 1, 2, 3, 0, 1])
+
+	def test_siblings_last(self):
+		placements = pool.plan(policy='siblings-last', topology=self.topology)
+		self.assertEqual([placement.cpu for placement in placements], [0, 1, 2, 3, 4, 5, 6, 7])
+		self.assertEqual(placements[5].core, (0, 1))
+
+	def test_package(self):
+		placements = pool.plan(policy='siblings-last', package=1, topology=self.topology)
+		self.assertEqual([placement.cpu for placement in placements], [2, 3, 6, 7])
+		self.assertRaises(ValueError, pool.plan, package=2, topology=self.topology)
+		self.assertRaises(ValueError, pool.plan, policy='spread', topology=self.topology)
+		self.assertRaises(ValueError, pool.plan, 0, topology=self.topology)
+
+	def test_live(self):
+		workers = pool.PinnedPool(policy='siblings-last', maxtasksperchild=1)
+		try:
+			cpus = [placement.cpu for placement in workers.plan]
+			self.assertEqual(sorted(cpus), pycpuid.affinity())
+			# Retired workers hand their processor to their replacement.
+			for cpu, affinity in workers.map(pinned, range(3 * len(cpus)), 1):
+				self.assert_(cpu in cpus)
+				self.assertEqual(affinity, [cpu])
+		finally:
+			workers.terminate()
+			workers.join()
+		self.assertEqual(pool.worker_cpu(), None)
+
+	def test_pin_timeout(self):
+		timeout, pool.PIN_TIMEOUT = pool.PIN_TIMEOUT, 0.01
+		try:
+			with warnings.catch_warnings(record=True) as caught:
+				warnings.simplefilter('always')
+				pool._pin(Queue.Queue(), None, ())
+		finally:
+			pool.PIN_TIMEOUT = timeout
+		self.assertEqual(pool.worker_cpu(), None)
+		self.assertEqual([warning.category for warning in caught], [RuntimeWarning])
+
+class test_partitions(unittest.TestCase):
+	def setUp(self):
+		self.snapshots = ccx_snapshots()
+		self.cpus = pycpuid.affinity()
+
+	def tearDown(self):
+		pycpuid.set_affinity(self.cpus)
+
+	def test_assignment(self):
+		scheduler = pool.PartitionScheduler(6, snapshots=self.snapshots)
+		self.assertEqual(scheduler.domains, [(0, 1, 2, 3, 8, 9, 10, 11), (4, 5, 6, 7, 12, 13, 14, 15)])
+		self.assertEqual(scheduler.assignment, [0, 0, 0, 1, 1, 1])
+		self.assertEqual(scheduler.domain(4), scheduler.domains[1])
+		scheduler = pool.PartitionScheduler(3, snapshots=self.snapshots)
+		self.assertEqual(scheduler.partitions(0), [0])
+		self.assertEqual(scheduler.partitions(1), [1, 2])
+		self.assertRaises(ValueError, pool.PartitionScheduler, 0, snapshots=self.snapshots)
+
+	def test_map(self):
+		scheduler = pool.PartitionScheduler(4)
+		results = scheduler.map(lambda partition: (partition, pycpuid.affinity()))
+		self.assertEqual([partition for partition, cpus in results], range(4))
+		for partition, cpus in results:
+			self.assertEqual(tuple(cpus), scheduler.domain(partition))
+		self.assertEqual(pycpuid.affinity(), self.cpus)
+
+	def test_map_workers(self):
+		# Each domain runs at most one thread per processor, whatever the
+		# number of partitions.
+		scheduler = pool.PartitionScheduler(4 * len(self.cpus))
+		results = scheduler.map(lambda partition: (scheduler.assignment[partition], threading.current_thread().ident))
+		for index, cpus in enumerate(scheduler.domains):
+			threads = set(ident for domain, ident in results if domain == index)
+			self.assert_(1 <= len(threads) <= len(cpus))
+
+	def test_map_error(self):
+		def consume(partition):
+			if partition:
+				raise KeyError(partition)
+		self.assertRaises(KeyError, pool.PartitionScheduler(3).map, consume)
+
+if __name__ == "__main__":
+	unittest.main()